@@ -0,0 +1,157 @@
+from pose_backends import ScaledPose, StridedPose
+
+
+# Quality ladder from best to cheapest. Each step gives up one thing, in order:
+# pose model complexity, inference resolution, the MPJPE overlay, then the
+# inference stride (pose estimated on every n-th frame only).
+QUALITY_LEVELS = (
+    {'name': 'full',     'model_complexity': 2, 'inference_scale': 1.0,  'mpjpe_overlay': True,  'stride': 1},
+    {'name': 'balanced', 'model_complexity': 1, 'inference_scale': 1.0,  'mpjpe_overlay': True,  'stride': 1},
+    {'name': 'lite',     'model_complexity': 0, 'inference_scale': 1.0,  'mpjpe_overlay': True,  'stride': 1},
+    {'name': 'scaled',   'model_complexity': 0, 'inference_scale': 0.75, 'mpjpe_overlay': True,  'stride': 1},
+    {'name': 'low-res',  'model_complexity': 0, 'inference_scale': 0.5,  'mpjpe_overlay': True,  'stride': 1},
+    {'name': 'no-mpjpe', 'model_complexity': 0, 'inference_scale': 0.5,  'mpjpe_overlay': False, 'stride': 1},
+    {'name': 'stride-2', 'model_complexity': 0, 'inference_scale': 0.5,  'mpjpe_overlay': False, 'stride': 2},
+    {'name': 'stride-3', 'model_complexity': 0, 'inference_scale': 0.5,  'mpjpe_overlay': False, 'stride': 3},
+)
+
+# 'balanced' matches the fixed settings used before the controller existed.
+DEFAULT_LEVEL = 1
+
+
+class QualityController:
+    """
+    Keep the live pipeline within a per-frame latency budget.
+
+    Frame latency is smoothed with an EWMA. Above the budget the controller
+    steps one level down the ladder; below upgrade_ratio x budget it probes
+    one level up. Hysteresis comes from the gap between the two thresholds,
+    a cooldown of frames after every change and an exponential backoff on
+    re-probing a level that was already too slow.
+    """
+
+    def __init__(self, pose_factory, target_fps=20.0, levels=QUALITY_LEVELS, start_level=DEFAULT_LEVEL,
+                 smoothing=0.1, upgrade_ratio=0.6, cooldown_frames=30, max_backoff_frames=1800):
+        self.pose_factory = pose_factory
+        self.levels = levels
+        self.level = start_level
+        self.budget = 1.0 / target_fps
+
+        self.smoothing = smoothing
+        self.upgrade_ratio = upgrade_ratio
+        self.cooldown_frames = cooldown_frames
+        self.max_backoff_frames = max_backoff_frames
+
+        self.latency = None
+        self.changes = 0
+        self._frames_at_level = 0
+        self._failures = [0] * len(levels)
+
+        # Base pose instances per model complexity, built on first use and kept
+        # so switching back is instant.
+        self._base_poses = {}
+        self._pose = None
+
+
+    @property
+    def mode(self):
+        return self.levels[self.level]['name']
+
+
+    @property
+    def instances(self):
+        """Pose instances built so far (one per model complexity used)."""
+
+        return len(self._base_poses)
+
+
+    def set_target_fps(self, target_fps):
+        self.budget = 1.0 / target_fps
+
+
+    @property
+    def pose(self):
+        """Pose backend for the current level (wrapped for resolution and stride)."""
+
+        if self._pose is None:
+            settings = self.levels[self.level]
+            complexity = settings['model_complexity']
+
+            if complexity not in self._base_poses:
+                self._base_poses[complexity] = self.pose_factory(model_complexity=complexity)
+
+            pose = self._base_poses[complexity]
+            if settings['inference_scale'] < 1.0:
+                pose = ScaledPose(pose, settings['inference_scale'])
+            if settings['stride'] > 1:
+                pose = StridedPose(pose, settings['stride'])
+
+            self._pose = pose
+
+        return self._pose
+
+
+    def apply(self, process_frame):
+        """Push the non-pose settings of the current level to a ProcessFrame."""
+
+        process_frame.mpjpe_overlay = self.levels[self.level]['mpjpe_overlay']
+        process_frame.quality_mode = self.mode
+
+
+    def _set_level(self, level):
+        self.level = level
+        self.latency = None
+        self.changes += 1
+        self._frames_at_level = 0
+        self._pose = None
+
+
+    def set_mode(self, mode):
+        """Switch to a level by name, e.g. in a pose worker following the controller of its session."""
+
+        level = next(idx for idx, settings in enumerate(self.levels) if settings['name'] == mode)
+        if level != self.level:
+            self._set_level(level)
+
+
+    def observe(self, seconds):
+        """Record the latency of one frame; returns True when the level changed."""
+
+        alpha = self.smoothing
+        self.latency = seconds if self.latency is None else (1 - alpha) * self.latency + alpha * seconds
+        self._frames_at_level += 1
+
+        if self._frames_at_level < self.cooldown_frames:
+            return False
+
+        if self.latency > self.budget and self.level < len(self.levels) - 1:
+            self._failures[self.level] += 1
+            self._set_level(self.level + 1)
+            return True
+
+        if self.latency < self.upgrade_ratio * self.budget and self.level > 0:
+            # Wait longer before retrying a level each time it proved too slow.
+            backoff = min(self.cooldown_frames * 2 ** self._failures[self.level - 1], self.max_backoff_frames)
+            if self._frames_at_level >= backoff:
+                self._set_level(self.level - 1)
+                return True
+
+        return False
+
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'level': self.level,
+            'latency_ms': (self.latency or 0.0) * 1e3,
+            'budget_ms': self.budget * 1e3,
+            'changes': self.changes
+        }
+
+
+    def close(self):
+        for pose in self._base_poses.values():
+            pose.close()
+
+        self._base_poses.clear()
+        self._pose = None
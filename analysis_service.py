@@ -0,0 +1,588 @@
+"""
+Standalone squat analysis service: frames in over HTTP, feedback out as JSON.
+
+    python analysis_service.py serve --port 8765
+    python analysis_service.py serve --pose replay            # no mediapipe needed
+    python analysis_service.py client --video output_sample.mp4 --session demo
+
+Endpoints:
+    POST   /sessions/<id>/frames?mode=beginner|pro   body: JPEG/PNG (image/*) or raw RGB
+                                                     (application/octet-stream, ?width=&height=)
+    POST   /sessions/<id>/landmarks?mode=...          body: landmark packets (see landmark_ingest)
+    DELETE /sessions/<id>?user=<athlete>                ends the session and records it in the history
+    GET    /sessions
+    GET    /health
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+import cv2
+import numpy as np
+
+from process_frame import ProcessFrame
+from thresholds import MODES
+from metrics import REGISTRY
+from pose_backends import REPLAY_POSE_HELP, replay_pose
+from session_history import get_history, session_record
+from landmark_ingest import LandmarkSession, PacketError, CONTENT_TYPE as LANDMARK_CONTENT_TYPE
+
+
+
+DEFAULT_PORT = 8765
+DEFAULT_SESSION_TTL = 300.0
+DEFAULT_BATCH_WINDOW = 0.005
+
+# Pose instances kept from expired sessions for reuse; creating one loads the model graph.
+MAX_IDLE_POSES = 8
+
+
+class ServiceError(Exception):
+    """Client error reported as an HTTP status with a JSON message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+
+def summarize_result(result, process_frame):
+    """JSON-ready summary of a ProcessFrame.analyze() result."""
+
+    summary = {
+        'detected': result['detected'],
+        'aligned': result['aligned'],
+        'state': result.get('state'),
+        'offset_angle': result.get('offset_angle'),
+        'play_sound': result['play_sound'],
+        'SQUAT_COUNT': int(result['SQUAT_COUNT']),
+        'IMPROPER_SQUAT': int(result['IMPROPER_SQUAT'])
+    }
+
+    if result['aligned']:
+        summary['side'] = 'left' if result['use_left'] else 'right'
+        summary['angles'] = {
+            'hip': int(result['hip_vertical_angle']),
+            'knee': int(result['knee_vertical_angle']),
+            'ankle': int(result['ankle_vertical_angle'])
+        }
+        summary['feedback'] = [{'id': int(idx), 'message': process_frame.FEEDBACK_ID_MAP[idx][0]}
+                               for idx in result['feedback_ids']]
+        summary['lower_hips'] = bool(result['lower_hips'])
+
+    return summary
+
+
+
+class AnalysisSession:
+    """
+    Server-side state of one client: its ProcessFrame (state_tracker) and
+    either a pose instance (frames) or a landmark decoder (pose is None).
+    """
+
+    def __init__(self, session_id, mode, pose, kind='api'):
+        self.session_id = session_id
+        self.mode = mode
+        self.kind = kind
+        self.process_frame = ProcessFrame(thresholds=MODES[mode]())
+        self.pose = pose
+        self.landmarks = LandmarkSession(self.process_frame) if kind == 'landmarks' else None
+        # Held while a frame is analyzed and while the session is ended.
+        self.lock = threading.Lock()
+        self.ended = False
+        self.frames = 0
+        self.started = time.time()
+        self.last_seen = time.monotonic()
+        self.metrics = REGISTRY.session(session_id, kind, self.process_frame, poses=0 if pose is None else 1)
+
+
+
+class AnalysisService:
+    """
+    Micro-batching front of ProcessFrame for HTTP clients.
+
+    Requests from all sessions go into one queue. A dispatcher thread collects
+    up to batch_size of them (waiting at most batch_window after the first),
+    with at most one frame per session so every session is processed in
+    order, and runs decode + inference + analysis for the whole batch on the
+    pose thread pool. Pose backends are stateful per stream, so each session
+    holds its own pose instance; instances of expired sessions are recycled.
+    """
+
+    def __init__(self, pose_factory, workers=None, batch_size=None, batch_window=DEFAULT_BATCH_WINDOW,
+                 session_ttl=DEFAULT_SESSION_TTL, history=None):
+        self.pose_factory = pose_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size or self.workers
+        self.batch_window = batch_window
+        self.session_ttl = session_ttl
+        # Where ended sessions are recorded, default: the process-wide session_history store.
+        self.history = history
+
+        self.sessions = {}
+        self.idle_poses = []
+        self.batches = 0
+        self.batched_requests = 0
+
+        self._queue = queue.Queue()
+        self._carry = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='analysis')
+        self._running = True
+        self._last_reap = time.monotonic()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='analysis-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+
+    def submit(self, session_id, mode, payload, content_type, width=None, height=None):
+        """Queue one frame; returns a Future resolving to the JSON summary."""
+
+        if mode not in MODES:
+            raise ServiceError(400, f'unknown mode {mode!r}, expected one of {sorted(MODES)}')
+
+        future = Future()
+        self._queue.put((session_id, mode, payload, content_type, width, height, future))
+
+        return future
+
+
+    def _next_batch(self):
+        batch, deferred, seen = [], [], set()
+        pending = self._carry
+        self._carry = []
+
+        def take(request):
+            if request[0] in seen:
+                deferred.append(request)
+            else:
+                seen.add(request[0])
+                batch.append(request)
+
+        for request in pending:
+            take(request)
+
+        if not batch:
+            try:
+                take(self._queue.get(timeout=1.0))
+            except queue.Empty:
+                return batch
+
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                take(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        self._carry = deferred
+
+        return batch
+
+
+    def _dispatch(self):
+        while self._running:
+            batch = self._next_batch()
+
+            if batch:
+                self.batches += 1
+                self.batched_requests += len(batch)
+                # One frame per session per batch, so sessions never run concurrently.
+                list(self._executor.map(self._run, batch))
+
+            if time.monotonic() - self._last_reap > 1.0:
+                self.expire_sessions()
+
+
+    def _session(self, session_id, mode, kind='api'):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                pose = None
+                if kind == 'api':
+                    pose = self.idle_poses.pop() if self.idle_poses else self.pose_factory()
+                session = self.sessions[session_id] = AnalysisSession(session_id, mode, pose, kind)
+
+        if session.kind != kind:
+            raise ServiceError(409, f'session {session_id!r} already streams {session.kind} data')
+
+        return session
+
+
+    @staticmethod
+    def _decode(payload, content_type, width, height):
+        if content_type.startswith('image/'):
+            image = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ServiceError(400, 'could not decode image')
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        if not width or not height:
+            raise ServiceError(400, 'raw frames need width and height query parameters')
+        if len(payload) != width * height * 3:
+            raise ServiceError(400, f'raw frame must be {width * height * 3} bytes of RGB, got {len(payload)}')
+
+        return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, 3)
+
+
+    def _run(self, request):
+        session_id, mode, payload, content_type, width, height, future = request
+
+        try:
+            start = time.perf_counter()
+            frame = self._decode(payload, content_type, width, height)
+
+            session = self._session(session_id, mode)
+            process_frame = session.process_frame
+            frame_height, frame_width = frame.shape[:2]
+
+            with session.lock:
+                if session.ended:
+                    raise ServiceError(409, f'session {session_id!r} was ended')
+                session.last_seen = time.monotonic()
+                session.metrics.frame_started()
+
+                try:
+                    inference_start = time.perf_counter()
+                    keypoints = session.pose.process(frame)
+                    inference_end = time.perf_counter()
+                    process_frame.timings.record('inference', inference_end - inference_start)
+                    process_frame.timings.inference_span = (inference_start, inference_end)
+
+                    result = process_frame.analyze(keypoints, frame_width, frame_height)
+                    process_frame.timings.end_frame(time.perf_counter() - start)
+                finally:
+                    session.metrics.frame_finished()
+                session.frames += 1
+
+                summary = summarize_result(result, process_frame)
+                summary['frame'] = session.frames
+
+            summary['session'] = session_id
+            summary['latency_ms'] = (time.perf_counter() - start) * 1e3
+
+            future.set_result(summary)
+        except Exception as exc:
+            future.set_exception(exc)
+
+
+    def ingest_landmarks(self, session_id, mode, data):
+        """
+        Analyze a body of landmark packets directly on the calling thread.
+
+        No decoding of pixels or inference is involved, so these requests skip
+        the batch queue; a per-session lock keeps packets of a session in order.
+        """
+
+        if mode not in MODES:
+            raise ServiceError(400, f'unknown mode {mode!r}, expected one of {sorted(MODES)}')
+
+        session = self._session(session_id, mode, kind='landmarks')
+
+        with session.lock:
+            if session.ended:
+                raise ServiceError(409, f'session {session_id!r} was ended')
+            session.last_seen = time.monotonic()
+            session.metrics.frame_started()
+            try:
+                results, keyframe_required = session.landmarks.ingest(data)
+            except PacketError as exc:
+                raise ServiceError(400, str(exc))
+            finally:
+                session.metrics.frame_finished()
+
+            session.frames += len(results)
+
+        summaries = []
+        for decoded, result in results:
+            summary = summarize_result(result, session.process_frame)
+            summary['seq'] = decoded['seq']
+            summary['timestamp_us'] = decoded['timestamp_us']
+            summaries.append(summary)
+
+        return {'session': session_id, 'results': summaries, 'keyframe_required': keyframe_required}
+
+
+    def end_session(self, session_id, user=None):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return False
+
+        # Waits for a frame in progress, so the pose is idle and that frame is recorded.
+        with session.lock:
+            session.ended = True
+            if session.pose is not None:
+                with self._lock:
+                    self._release_pose(session.pose)
+
+            REGISTRY.remove_session(session_id, session.kind)
+            if session.frames:
+                (self.history or get_history()).record(session_record(session.process_frame, session.mode,
+                                                                      session.kind, session.started, user=user,
+                                                                      frames=session.frames))
+        return True
+
+
+    def _release_pose(self, pose):
+        if len(self.idle_poses) < MAX_IDLE_POSES:
+            reset = getattr(pose, 'reset', None)
+            if reset is not None:
+                reset()
+            self.idle_poses.append(pose)
+        else:
+            pose.close()
+
+
+    def expire_sessions(self):
+        """Drop sessions idle for longer than session_ttl."""
+
+        now = self._last_reap = time.monotonic()
+        expired = [sid for sid, s in list(self.sessions.items()) if now - s.last_seen > self.session_ttl]
+
+        for session_id in expired:
+            self.end_session(session_id)
+
+        return expired
+
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            sessions = [{'session': s.session_id, 'kind': s.kind, 'mode': s.mode, 'frames': s.frames,
+                         'SQUAT_COUNT': int(s.process_frame.state_tracker['SQUAT_COUNT']),
+                         'IMPROPER_SQUAT': int(s.process_frame.state_tracker['IMPROPER_SQUAT']),
+                         'idle_s': round(now - s.last_seen, 1)} for s in self.sessions.values()]
+
+        return {
+            'sessions': sessions,
+            'queue_depth': self._queue.qsize() + len(self._carry),
+            'batches': self.batches,
+            'mean_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+            'idle_poses': len(self.idle_poses)
+        }
+
+
+    def close(self):
+        self._running = False
+        self._dispatcher.join(timeout=2)
+        self._executor.shutdown()
+
+        for session_id in list(self.sessions):
+            self.end_session(session_id)
+        for pose in self.idle_poses:
+            pose.close()
+        self.idle_poses.clear()
+
+
+
+class _AnalysisHandler(BaseHTTPRequestHandler):
+
+    service = None
+    request_timeout = 30.0
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        return parts, query
+
+
+    def do_POST(self):
+        parts, query = self._route()
+
+        if len(parts) != 3 or parts[0] != 'sessions' or parts[2] not in ('frames', 'landmarks'):
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = self.rfile.read(length)
+            content_type = self.headers.get('Content-Type', 'application/octet-stream')
+
+            if parts[2] == 'landmarks':
+                self._send_json(200, self.service.ingest_landmarks(parts[1], query.get('mode', 'beginner').lower(),
+                                                                   payload))
+                return
+
+            width = int(query['width']) if 'width' in query else None
+            height = int(query['height']) if 'height' in query else None
+
+            future = self.service.submit(parts[1], query.get('mode', 'beginner').lower(), payload, content_type,
+                                         width, height)
+            self._send_json(200, future.result(timeout=self.request_timeout))
+        except ServiceError as exc:
+            self._send_json(exc.status, {'error': str(exc)})
+        except FutureTimeoutError:
+            self._send_json(504, {'error': f'frame not analyzed within {self.request_timeout:g} s'})
+        except ValueError as exc:
+            self._send_json(400, {'error': str(exc)})
+        except Exception as exc:
+            self.log_error('analysis failed: %r', exc)
+            self._send_json(500, {'error': f'{type(exc).__name__}: {exc}'})
+
+
+    def do_DELETE(self):
+        parts, query = self._route()
+
+        if len(parts) != 2 or parts[0] != 'sessions':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        ended = self.service.end_session(parts[1], query.get('user'))
+        self._send_json(200 if ended else 404, {'session': parts[1], 'ended': ended})
+
+
+    def do_GET(self):
+        parts, _ = self._route()
+
+        if parts == ['health']:
+            self._send_json(200, {'status': 'ok'})
+        elif parts == ['sessions']:
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    """HTTP server bound to an AnalysisService; call serve_forever() on it."""
+
+    handler = type('AnalysisHandler', (_AnalysisHandler,), {'service': service})
+
+    return ThreadingHTTPServer((host, port), handler)
+
+
+
+class AnalysisClient:
+    """Minimal client for the service, using only the standard library."""
+
+    def __init__(self, base_url=f'http://127.0.0.1:{DEFAULT_PORT}'):
+        self.base_url = base_url.rstrip('/')
+
+
+    def _request(self, method, path, body=None, content_type=None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+
+    def send_frame(self, session_id, frame, mode='beginner', encoding='jpeg', jpeg_quality=80):
+        """Send one RGB frame; returns the analysis summary."""
+
+        if encoding == 'jpeg':
+            ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                                       [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            return self._request('POST', f'/sessions/{session_id}/frames?mode={mode}', encoded.tobytes(),
+                                 'image/jpeg')
+
+        height, width = frame.shape[:2]
+        return self._request('POST', f'/sessions/{session_id}/frames?mode={mode}&width={width}&height={height}',
+                             np.ascontiguousarray(frame).tobytes(), 'application/octet-stream')
+
+
+    def send_landmarks(self, session_id, packets, mode='beginner'):
+        """Send one or more encoded landmark packets (see landmark_ingest.LandmarkEncoder)."""
+
+        body = packets if isinstance(packets, bytes) else b''.join(packets)
+
+        return self._request('POST', f'/sessions/{session_id}/landmarks?mode={mode}', body, LANDMARK_CONTENT_TYPE)
+
+
+    def end_session(self, session_id, user=None):
+        query = f'?{urlencode({"user": user})}' if user else ''
+        return self._request('DELETE', f'/sessions/{session_id}{query}')
+
+
+    def stats(self):
+        return self._request('GET', '/sessions')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Run the service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--workers', type=int, help='Pose threads, default: CPU count')
+    serve.add_argument('--batch-size', type=int, help='Max frames per micro-batch, default: workers')
+    serve.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW * 1e3)
+    serve.add_argument('--session-ttl', type=float, default=DEFAULT_SESSION_TTL, help='Idle seconds before expiry')
+    serve.add_argument('--pose', choices=['mediapipe', 'replay'], default='mediapipe', help=REPLAY_POSE_HELP)
+
+    client = commands.add_parser('client', help='Stream a video to a running service')
+    client.add_argument('--url', default=f'http://127.0.0.1:{DEFAULT_PORT}')
+    client.add_argument('--video', default='output_sample.mp4')
+    client.add_argument('--session', default='cli')
+    client.add_argument('--mode', choices=sorted(MODES), default='beginner')
+    client.add_argument('--encoding', choices=['jpeg', 'raw'], default='jpeg')
+    client.add_argument('--user', help='Athlete the session is recorded for in the history')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if args.pose == 'replay':
+            pose_factory = replay_pose
+        else:
+            from utils import get_mediapipe_pose
+            pose_factory = get_mediapipe_pose
+
+        service = AnalysisService(pose_factory, workers=args.workers, batch_size=args.batch_size,
+                                  batch_window=args.batch_window_ms / 1e3, session_ttl=args.session_ttl)
+        server = make_server(service, args.host, args.port)
+        print(f'Serving squat analysis on http://{args.host}:{args.port}', file=sys.stderr)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.close()
+        return
+
+    api = AnalysisClient(args.url)
+    vf = cv2.VideoCapture(args.video)
+    try:
+        while True:
+            ret, frame = vf.read()
+            if not ret:
+                break
+            summary = api.send_frame(args.session, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), args.mode, args.encoding)
+            print(json.dumps(summary))
+    finally:
+        vf.release()
+        api.end_session(args.session, args.user)
+
+
+if __name__ == '__main__':
+    main()
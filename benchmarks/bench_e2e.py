@@ -0,0 +1,245 @@
+"""
+End-to-end throughput and memory benchmark of the upload pipeline.
+
+Runs video_pipeline.iter_processed_frames headless over output_sample.mp4 (or
+any video, optionally resized and looped into a longer synthetic input) for
+every Beginner/Pro x MPJPE x comparison-overlay configuration. Each
+configuration runs in its own process so peak RSS is measured per run.
+
+    python benchmarks/bench_e2e.py --output e2e.json
+    python benchmarks/bench_e2e.py --pose replay --loop 10 --size 1920x1080
+    python benchmarks/bench_e2e.py --baseline benchmarks/baseline_e2e.json --tolerance 0.1
+    python benchmarks/bench_e2e.py --save-baseline benchmarks/baseline_e2e.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from common import BASE_DIR, summarize, environment, write_json, squat_landmarks
+
+import cv2
+
+
+SAMPLE_VIDEO = os.path.join(BASE_DIR, 'output_sample.mp4')
+
+CONFIGS = [
+    {'name': f'{mode}/mpjpe_{"on" if mpjpe else "off"}/comparison_{"on" if comparison else "off"}',
+     'mode': mode, 'mpjpe': mpjpe, 'comparison': comparison}
+    for mode in ('Beginner', 'Pro')
+    for mpjpe, comparison in ((False, False), (True, False), (True, True))
+]
+
+# Metrics compared against the baseline and whether higher is better.
+REGRESSION_METRICS = {
+    'fps': True,
+    'p95_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def prepare_input(video_path, size, loop):
+    """Resize and/or loop the input into a temporary synthetic video when requested."""
+
+    if size is None and loop <= 1:
+        return video_path, False
+
+    vf = cv2.VideoCapture(video_path)
+    fps = vf.get(cv2.CAP_PROP_FPS) or 30
+    frames = []
+    while True:
+        ret, frame = vf.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, size) if size else frame)
+    vf.release()
+
+    height, width = frames[0].shape[:2]
+    fd, path = tempfile.mkstemp(suffix='.mp4')
+    os.close(fd)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for _ in range(loop):
+        for frame in frames:
+            writer.write(frame)
+    writer.release()
+
+    return path, True
+
+
+def make_pose(kind, num_frames):
+    if kind == 'replay':
+        from pose_backends import ReplayPose
+        return ReplayPose(squat_landmarks(max(num_frames, 1)))
+
+    from utils import get_mediapipe_pose
+    return get_mediapipe_pose()
+
+
+def run_config(config, video_path, pose_kind):
+    """Process the whole video once and return throughput, latency, memory and output size."""
+
+    from process_frame import ProcessFrame
+    from thresholds import get_thresholds_beginner, get_thresholds_pro
+    from video_pipeline import open_video, iter_processed_frames
+    from profiling import ProfileTrigger, requested_profile_seconds
+
+    thresholds = get_thresholds_beginner() if config['mode'] == 'Beginner' else get_thresholds_pro()
+    processor = ProcessFrame(thresholds=thresholds, evaluate_mpjpe=config['mpjpe'],
+                             visualize_comparison=config['comparison'], display_mpjpe=config['mpjpe'])
+
+    vf, metadata = open_video(video_path)
+    pose = make_pose(pose_kind, metadata['frame_count'])
+
+    fd, out_path = tempfile.mkstemp(suffix='.mp4')
+    os.close(fd)
+    writer = None
+
+    samples = []
+    frames = iter_processed_frames(vf, processor, pose)
+
+    # SQUAT_PROFILE_SECONDS=<n> captures a flamegraph of this configuration.
+    profile_trigger = ProfileTrigger(requested_profile_seconds(), label=config['name'].replace('/', '-'))
+    profile_trigger.maybe_start()
+
+    start = time.perf_counter()
+
+    try:
+        while True:
+            frame_start = time.perf_counter_ns()
+            try:
+                out_frame, _ = next(frames)
+            except StopIteration:
+                break
+
+            if writer is None:
+                height, width = out_frame.shape[:2]
+                writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*'mp4v'), metadata['fps'] or 30,
+                                         (width, height))
+
+            writer.write(cv2.cvtColor(out_frame, cv2.COLOR_RGB2BGR))
+            samples.append(time.perf_counter_ns() - frame_start)
+
+        elapsed = time.perf_counter() - start
+    finally:
+        if profile_trigger.profiler is not None:
+            profile_trigger.profiler.stop()
+            print(f'profile: {profile_trigger.profiler.output_path}', file=sys.stderr)
+        vf.release()
+        if writer is not None:
+            writer.release()
+        output_bytes = os.path.getsize(out_path)
+        os.remove(out_path)
+
+    latency = summarize(samples)
+
+    return {
+        'frames': len(samples),
+        'fps': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': latency.get('p50_us', 0.0) / 1e3,
+        'p95_ms': latency.get('p95_us', 0.0) / 1e3,
+        'p99_ms': latency.get('p99_us', 0.0) / 1e3,
+        'peak_rss_mb': peak_rss_mb(),
+        'output_bytes': output_bytes,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a list of human-readable regressions beyond the relative tolerance."""
+
+    regressions = []
+
+    for name, metrics in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None:
+            continue
+
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            current, expected = metrics.get(metric), reference.get(metric)
+            if not current or not expected:
+                continue
+
+            change = (current - expected) / expected
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f'{name}: {metric} {expected:.2f} -> {current:.2f} ({change:+.1%})')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', default=SAMPLE_VIDEO)
+    parser.add_argument('--size', help='Resize input frames, e.g. 1920x1080')
+    parser.add_argument('--loop', type=int, default=1, help='Repeat the input N times for a longer run')
+    parser.add_argument('--pose', choices=['mediapipe', 'replay'], default='mediapipe',
+                        help='replay uses procedural landmarks and needs no mediapipe model')
+    parser.add_argument('--configs', nargs='*', help='Only run configurations whose name contains one of these')
+    parser.add_argument('--output', default='-', help="JSON output path, '-' for stdout")
+    parser.add_argument('--baseline', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression (0.10 = 10%%)')
+    parser.add_argument('--save-baseline', help='Write these results as the new baseline')
+    parser.add_argument('--run-config', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_config:
+        # Child process: run a single configuration and report on stdout.
+        config = json.loads(args.run_config)
+        json.dump(run_config(config, args.video, args.pose), sys.stdout)
+        return
+
+    size = tuple(int(v) for v in args.size.lower().split('x')) if args.size else None
+    video_path, is_temp = prepare_input(args.video, size, args.loop)
+
+    results = {}
+    try:
+        for config in CONFIGS:
+            if args.configs and not any(sel in config['name'] for sel in args.configs):
+                continue
+
+            cmd = [sys.executable, os.path.abspath(__file__), '--video', video_path, '--pose', args.pose,
+                   '--run-config', json.dumps(config)]
+            completed = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
+            results[config['name']] = json.loads(completed.stdout)
+
+            print(f"{config['name']:<40} {results[config['name']]['fps']:8.1f} fps", file=sys.stderr)
+    finally:
+        if is_temp:
+            os.remove(video_path)
+
+    payload = {
+        'benchmark': 'e2e',
+        'config': {'video': os.path.basename(args.video), 'size': args.size, 'loop': args.loop, 'pose': args.pose},
+        'environment': environment(),
+        'results': results
+    }
+
+    write_json(args.output, payload)
+
+    if args.save_baseline:
+        write_json(args.save_baseline, payload)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark the fused angle kernel against four utils.find_angle calls per frame.
+
+    python benchmarks/bench_kinematics.py --frames 20000
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(__file__, '../../'))
+sys.path.append(BASE_DIR)
+
+from utils import find_angle
+from kinematics import frame_angles, frame_angles_batch, frame_angles_jit, JIT_AVAILABLE
+
+
+def find_angle_reference(c):
+    offset_angle = find_angle(c[11], c[12], c[0])
+
+    use_left = abs(c[31][1] - c[11][1]) > abs(c[32][1] - c[12][1])
+    shldr, hip, knee, ankle = (c[idx] for idx in ((11, 23, 25, 27) if use_left else (12, 24, 26, 28)))
+
+    return (offset_angle, use_left,
+            find_angle(shldr, np.array([hip[0], 0]), hip),
+            find_angle(hip, np.array([knee[0], 0]), knee),
+            find_angle(knee, np.array([ankle[0], 0]), ankle))
+
+
+def time_per_frame(fn, coords):
+    start = time.perf_counter()
+    for c in coords:
+        fn(c)
+    return (time.perf_counter() - start) / len(coords)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # Keep joints below the top edge so find_angle never sees a zero-length vector.
+    coords = rng.integers(1, 1080, size=(args.frames, 33, 2))
+
+    # Check the kernels agree with find_angle before timing anything.
+    batch = frame_angles_batch(coords)
+    for t in range(min(args.frames, 2000)):
+        expected = tuple(int(v) for v in find_angle_reference(coords[t]))
+        assert tuple(int(v) for v in frame_angles(coords[t])) == expected
+        assert tuple(int(v) for v in frame_angles_jit(coords[t])) == expected
+        assert tuple(int(v[t]) for v in batch) == expected
+
+    results = {
+        'find_angle x4': time_per_frame(find_angle_reference, coords),
+        'frame_angles': time_per_frame(frame_angles, coords),
+    }
+
+    if JIT_AVAILABLE:
+        results['frame_angles_jit'] = time_per_frame(frame_angles_jit, coords)
+
+    start = time.perf_counter()
+    frame_angles_batch(coords)
+    results['frame_angles_batch'] = (time.perf_counter() - start) / args.frames
+
+    reference = results['find_angle x4']
+    for name, seconds in results.items():
+        print(f'{name:<20} {seconds * 1e6:9.2f} us/frame   {reference / seconds:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Stage-level microbenchmarks for ProcessFrame.process.
+
+Every stage is timed in isolation on replayed landmarks (no mediapipe needed),
+results are written as JSON with percentile latencies:
+
+    python benchmarks/bench_stages.py --iterations 2000 --output stages.json
+    python benchmarks/bench_stages.py --landmarks recorded.npy --output -
+"""
+import time
+import argparse
+import numpy as np
+
+from common import summarize, environment, write_json, squat_landmarks
+
+import cv2
+from utils import (find_angle, get_landmark_features, get_landmark_coords, draw_text,
+                   draw_dotted_line, draw_rounded_rect)
+from kinematics import frame_angles
+from process_frame import ProcessFrame
+from pose_backends import ReplayPose
+from thresholds import get_thresholds_beginner, get_thresholds_pro
+from mpjpe_evaluation import calculate_mpjpe, format_landmark_array, generate_dummy_ground_truth
+from mpjpe_visualization import draw_mpjpe_results, visualize_mpjpe_comparison
+
+
+def run_stage(fn, inputs, iterations, warmup):
+    """Time fn(item) for each iteration, cycling through inputs."""
+
+    timer = time.perf_counter_ns
+    num_inputs = len(inputs)
+
+    for i in range(warmup):
+        fn(inputs[i % num_inputs])
+
+    samples = []
+    for i in range(iterations):
+        item = inputs[i % num_inputs]
+        start = timer()
+        fn(item)
+        samples.append(timer() - start)
+
+    return summarize(samples)
+
+
+def build_stages(landmarks, width, height, thresholds_fn):
+    detected = [frame for frame in landmarks if not np.isnan(frame).all()]
+    results = ReplayPose(np.stack(detected)).results
+
+    processor = ProcessFrame(thresholds=thresholds_fn())
+    dict_features = processor.dict_features
+
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    coords = [get_landmark_coords(r.pose_landmarks.landmark, width, height) for r in results]
+
+    # Precomputed MPJPE inputs so each MPJPE stage is isolated.
+    np.random.seed(0)
+    pred = [format_landmark_array(r, width, height) for r in results]
+    gt = [generate_dummy_ground_truth(r, width, height, noise_level=0.5) for r in results]
+    mpjpe = [calculate_mpjpe(p, g) for p, g in zip(pred, gt)]
+
+    def extract_features(result):
+        lm = result.pose_landmarks.landmark
+        get_landmark_features(lm, dict_features, 'nose', width, height)
+        get_landmark_features(lm, dict_features, 'left', width, height)
+        get_landmark_features(lm, dict_features, 'right', width, height)
+
+    def angles_find_angle(c):
+        find_angle(c[11], c[12], c[0])
+        use_left = abs(c[31][1] - c[11][1]) > abs(c[32][1] - c[12][1])
+        shldr, hip, knee, ankle = (c[idx] for idx in ((11, 23, 25, 27) if use_left else (12, 24, 26, 28)))
+        find_angle(shldr, np.array([hip[0], 0]), hip)
+        find_angle(hip, np.array([knee[0], 0]), knee)
+        find_angle(knee, np.array([ankle[0], 0]), ankle)
+
+    knee_angles = [frame_angles(c)[3] for c in coords]
+
+    def state_update(knee_angle):
+        state_code = processor.state_machine.get_state(knee_angle)
+        processor._update_state_sequence(state_code)
+        processor.state_machine.rep_outcome(processor.state_tracker['state_seq'], False)
+
+    stages = {
+        'extract.get_landmark_features': (extract_features, results),
+        'extract.get_landmark_coords': (lambda r: get_landmark_coords(r.pose_landmarks.landmark, width, height), results),
+        'angles.find_angle_x4': (angles_find_angle, coords),
+        'angles.frame_angles': (frame_angles, coords),
+        'state.update': (state_update, knee_angles),
+        'draw.draw_text': (lambda msg: draw_text(frame, msg, pos=(30, 80), font_scale=0.7,
+                                                 text_color=(255, 255, 230), text_color_bg=(18, 185, 0)),
+                           ['CORRECT: 12', 'INCORRECT: 3', 'LUTUT MELEWATI JARI KAKI']),
+        'draw.draw_dotted_line': (lambda c: draw_dotted_line(frame, c[25], start=int(c[25][1]) - 50,
+                                                             end=int(c[25][1]) + 20, line_color=(0, 127, 255)),
+                                  coords),
+        'draw.draw_rounded_rect': (lambda _: draw_rounded_rect(frame, (10, 10), (250, 50), 8, (18, 185, 0)), [None]),
+        'mpjpe.format_and_ground_truth': (lambda r: (format_landmark_array(r, width, height),
+                                                     generate_dummy_ground_truth(r, width, height, 0.5)),
+                                          results),
+        'mpjpe.calculate_mpjpe': (lambda pg: calculate_mpjpe(*pg), list(zip(pred, gt))),
+        'mpjpe.draw_mpjpe_results': (lambda m: draw_mpjpe_results(frame, m[0], m[1], position=(30, 180), in_place=True),
+                                     mpjpe),
+        'mpjpe.visualize_mpjpe_comparison': (lambda pg: visualize_mpjpe_comparison(frame, pg[0], pg[1], in_place=True),
+                                             list(zip(pred, gt))),
+    }
+
+    return stages
+
+
+def build_end_to_end(landmarks, width, height, thresholds_fn, evaluate_mpjpe):
+    pose = ReplayPose(landmarks)
+    processor = ProcessFrame(thresholds=thresholds_fn(), evaluate_mpjpe=evaluate_mpjpe,
+                             display_mpjpe=evaluate_mpjpe)
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def step(_):
+        processor.process(frame, pose)
+
+    return step
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--landmarks', help='Recorded (T, 33, 4) landmarks (.npy/.npz), defaults to a procedural squat')
+    parser.add_argument('--frames', type=int, default=300, help='Procedural sequence length')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--mode', choices=['Beginner', 'Pro'], default='Beginner')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--stages', nargs='*', help='Only run stages whose name starts with one of these prefixes')
+    parser.add_argument('--output', default='-', help="JSON output path, '-' for stdout")
+    args = parser.parse_args()
+
+    if args.landmarks:
+        landmarks = ReplayPose.from_file(args.landmarks).landmarks
+    else:
+        landmarks = squat_landmarks(args.frames)
+
+    thresholds_fn = get_thresholds_beginner if args.mode == 'Beginner' else get_thresholds_pro
+
+    stages = build_stages(landmarks, args.width, args.height, thresholds_fn)
+    stages['process.full'] = (build_end_to_end(landmarks, args.width, args.height, thresholds_fn, False), [None])
+    stages['process.full_mpjpe'] = (build_end_to_end(landmarks, args.width, args.height, thresholds_fn, True), [None])
+
+    results = {}
+    for name, (fn, inputs) in stages.items():
+        if args.stages and not any(name.startswith(prefix) for prefix in args.stages):
+            continue
+        results[name] = run_stage(fn, inputs, args.iterations, args.warmup)
+
+    write_json(args.output, {
+        'benchmark': 'stages',
+        'config': {
+            'landmarks': args.landmarks or 'procedural',
+            'frames': int(len(landmarks)),
+            'width': args.width,
+            'height': args.height,
+            'mode': args.mode,
+            'iterations': args.iterations,
+            'opencv_threads': cv2.getNumThreads()
+        },
+        'environment': environment(),
+        'stages': results
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import platform
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(__file__, '../../'))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from synthetic_squat import squat_sequence, add_detection_noise
+
+
+def summarize(samples_ns):
+    """Latency summary in microseconds from a list of per-iteration nanosecond timings."""
+
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e3
+
+    if len(samples) == 0:
+        return {'n': 0}
+
+    p50, p90, p95, p99 = np.percentile(samples, [50, 90, 95, 99])
+
+    return {
+        'n': int(len(samples)),
+        'mean_us': float(samples.mean()),
+        'min_us': float(samples.min()),
+        'p50_us': float(p50),
+        'p90_us': float(p90),
+        'p95_us': float(p95),
+        'p99_us': float(p99),
+        'max_us': float(samples.max())
+    }
+
+
+def environment():
+    import cv2
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_json(path, payload):
+    if path == '-':
+        json.dump(payload, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+
+
+def squat_landmarks(num_frames=300, period=60, seed=0, dropout=0.02):
+    """
+    Small procedural squat sequence, (T, 33, 4) normalized landmarks for ReplayPose.
+
+    Side view facing right with the left side towards the camera, generated by
+    synthetic_squat with per-rep depth variation and detection jitter; a few
+    frames have no detection so every ProcessFrame branch gets exercised.
+    """
+
+    landmarks = squat_sequence(num_frames, fps=30.0, rep_period=period / 30.0, depth=0.95, variation=0.2, seed=seed)
+
+    return add_detection_noise(landmarks, jitter=0.003, dropout=dropout, seed=seed)
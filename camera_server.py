@@ -0,0 +1,555 @@
+"""
+Continuous squat analysis of several fixed cameras, without a browser.
+
+    python camera_server.py --stream rack1=rtsp://10.0.0.21/stream --stream rack2=rtsp://10.0.0.22/stream
+    python camera_server.py --stream test=output_sample.mp4 --loop --pose replay   # looping file stand-in
+
+Every stream keeps its own ProcessFrame (and pose) state. A fixed pool of
+pose workers is shared round-robin between the streams; each stream only
+keeps its newest frame, so a stream the workers cannot keep up with drops
+frames instead of building up lag.
+
+Endpoints:
+    GET /health                  overall and per-stream status
+    GET /streams                 detailed per-stream stats
+    GET /streams/<name>/frame.jpg  latest annotated frame
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import cv2
+
+from process_frame import ProcessFrame
+from thresholds import MODES
+from metrics import REGISTRY, start_metrics_server
+from pose_backends import REPLAY_POSE_HELP, replay_pose
+from pose_workers import get_worker_pool
+from multi_athlete import MultiAthleteProcessor, get_multi_pose
+
+
+
+DEFAULT_PORT = 8766
+
+# A stream without a new frame for this long is reported as stalled.
+STALL_TIMEOUT = 5.0
+# A stream whose frames are older than this when processed is reported as lagging.
+MAX_LAG = 1.0
+
+# Reconnect delays for network sources, doubled per failure.
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+# Smoothing factor of the per-stream lag average.
+LAG_SMOOTHING = 0.1
+
+
+class StreamSource:
+    """
+    Frame reader for one camera URL or video file.
+
+    Files are paced to their frame rate, so they stand in for a live camera
+    (and restart at the end with loop=True). Network sources reconnect with
+    exponential backoff after a failure.
+    """
+
+    def __init__(self, url, loop=False):
+        self.url = url
+        self.loop = loop
+        self.is_file = '://' not in url
+        self.state = 'connecting'
+        self.reconnects = 0
+
+        self._capture = None
+        self._delay = RECONNECT_DELAY
+        self._interval = 0.0
+        self._next_due = 0.0
+
+
+    def _open(self):
+        self._capture = cv2.VideoCapture(self.url)
+        if not self._capture.isOpened():
+            self._capture.release()
+            self._capture = None
+            return False
+
+        fps = self._capture.get(cv2.CAP_PROP_FPS)
+        self._interval = 1.0 / fps if self.is_file and 0 < fps < 1000 else 0.0
+        self._next_due = time.monotonic()
+        self.state = 'running'
+        self._delay = RECONNECT_DELAY
+
+        return True
+
+
+    def _retry(self):
+        self.state = 'reconnecting'
+        self.reconnects += 1
+        time.sleep(self._delay)
+        self._delay = min(self._delay * 2, MAX_RECONNECT_DELAY)
+
+
+    def _end_of_stream(self):
+        self._capture.release()
+        self._capture = None
+
+        if not self.is_file:
+            self._retry()
+        elif self.loop:
+            # Reopened on the next read.
+            self.state = 'connecting'
+        else:
+            self.state = 'ended'
+
+
+    def read(self):
+        """Next frame as BGR, or None (check state: 'ended' means no more frames)."""
+
+        if self.state == 'ended':
+            return None
+
+        if self._capture is None and not self._open():
+            self._retry()
+            return None
+
+        ret, frame = self._capture.read()
+        if not ret:
+            self._end_of_stream()
+            return None
+
+        if self._interval:
+            self._next_due += self._interval
+            delay = self._next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Behind schedule (e.g. after a stall): do not try to catch up.
+                self._next_due = time.monotonic()
+
+        return frame
+
+
+    def close(self):
+        self.state = 'ended'
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+
+class CameraStream:
+    """One camera: its source, analysis state and the newest unprocessed frame."""
+
+    def __init__(self, name, source, processor, pose, mode):
+        self.name = name
+        self.source = source
+        self.processor = processor
+        self.pose = pose
+        self.mode = mode
+        self.metrics = REGISTRY.session(name, 'camera', processor)
+
+        # Newest frame and its capture time; replaced (and counted as dropped) if not taken in time.
+        self.latest = None
+        self.latest_time = 0.0
+        self.queued = False
+        self.busy = False
+        self.stopped = False
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_received = None
+        self.last_processed = None
+        self.lag = 0.0
+        self.output = None
+        self.reader = None
+
+
+    def status(self, now):
+        if self.source.state in ('ended', 'reconnecting', 'connecting'):
+            return self.source.state
+        if self.last_received is None or now - self.last_received > STALL_TIMEOUT:
+            return 'stalled'
+        if self.lag > MAX_LAG:
+            return 'lagging'
+
+        return 'ok'
+
+
+    def stats(self, now):
+        tracker = self.processor.state_tracker
+
+        stats = {
+            'stream': self.name,
+            'url': self.source.url,
+            'mode': self.mode,
+            'status': self.status(now),
+            'received': self.received,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'reconnects': self.source.reconnects,
+            'lag_s': round(self.lag, 3),
+            'age_s': None if self.last_processed is None else round(now - self.last_processed, 3),
+            'fps': round(self.processor.timings.fps, 1),
+            'SQUAT_COUNT': int(tracker['SQUAT_COUNT']),
+            'IMPROPER_SQUAT': int(tracker['IMPROPER_SQUAT'])
+        }
+
+        if hasattr(self.processor, 'athlete_stats'):
+            stats['athletes'] = self.processor.athlete_stats()
+
+        return stats
+
+
+
+class CameraServer:
+    """
+    Shares a fixed pool of pose workers fairly between camera streams.
+
+    A reader thread per stream keeps only the newest frame. Streams with a
+    pending frame wait in a FIFO ready queue; a worker takes the stream at
+    the head, processes its newest frame and, if another frame arrived in
+    the meantime, puts the stream back at the tail. Every stream thus gets
+    one turn per round regardless of its frame rate, has at most one frame
+    in flight (its ProcessFrame state is never used concurrently), and a
+    saturated pool drops the frames that were overwritten while waiting.
+
+    With SQUAT_POSE_WORKERS set, processing runs in the pose worker processes
+    (see pose_workers) and the threads here only feed them. With
+    multi_athlete, every stream runs one multi-person inference per frame
+    and tracks each athlete separately (see multi_athlete); this mode always
+    runs in-process.
+    """
+
+    def __init__(self, pose_factory=None, workers=None, multi_athlete=False):
+        if pose_factory is None:
+            if multi_athlete:
+                pose_factory = get_multi_pose
+            else:
+                from utils import get_mediapipe_pose
+                pose_factory = get_mediapipe_pose
+
+        self.pose_factory = pose_factory
+        self.multi_athlete = multi_athlete
+        self.worker_pool = None if multi_athlete else get_worker_pool()
+        if workers is None:
+            workers = len(self.worker_pool.workers) if self.worker_pool is not None else os.cpu_count() or 1
+        self.workers = workers
+
+        self.streams = {}
+        self._ready = collections.deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._threads = []
+
+
+    def add_stream(self, name, url, mode='beginner', loop=False):
+        if name in self.streams:
+            raise ValueError(f'stream {name!r} already exists')
+        if mode not in MODES:
+            raise ValueError(f'unknown mode {mode!r}, expected one of {sorted(MODES)}')
+
+        if self.multi_athlete:
+            processor, pose = MultiAthleteProcessor(MODES[mode]()), self.pose_factory()
+        elif self.worker_pool is not None:
+            processor, pose = self.worker_pool.open_session(MODES[mode]()), None
+        else:
+            processor, pose = ProcessFrame(thresholds=MODES[mode]()), self.pose_factory()
+
+        stream = self.streams[name] = CameraStream(name, StreamSource(url, loop), processor, pose, mode)
+
+        if self._running:
+            self._start_reader(stream)
+
+        return stream
+
+
+    def remove_stream(self, name):
+        with self._cond:
+            stream = self.streams.pop(name, None)
+            if stream is None:
+                return False
+            stream.stopped = True
+
+        if stream.reader is not None:
+            stream.reader.join(timeout=MAX_RECONNECT_DELAY)
+        self._close_stream(stream)
+
+        return True
+
+
+    def _close_stream(self, stream):
+        # A worker may still be on this stream; it finishes its frame first.
+        with self._cond:
+            while stream.busy:
+                self._cond.wait()
+
+        stream.source.close()
+        if stream.pose is not None:
+            stream.pose.close()
+        close = getattr(stream.processor, 'close', None)
+        if close is not None:
+            close()
+        REGISTRY.remove_session(stream.name, 'camera')
+
+
+    def _start_reader(self, stream):
+        stream.reader = threading.Thread(target=self._read_loop, args=(stream,), name=f'camera-{stream.name}',
+                                         daemon=True)
+        stream.reader.start()
+
+
+    def start(self):
+        self._running = True
+
+        for stream in self.streams.values():
+            self._start_reader(stream)
+
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._work_loop, name=f'camera-worker-{idx}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def _read_loop(self, stream):
+        source = stream.source
+
+        while self._running and not stream.stopped:
+            frame = source.read()
+            if frame is None:
+                if source.state == 'ended':
+                    break
+                continue
+
+            now = time.monotonic()
+
+            with self._cond:
+                stream.received += 1
+                stream.last_received = now
+
+                if stream.latest is not None:
+                    # Not picked up before the next frame: the pool is saturated.
+                    stream.dropped += 1
+                    stream.metrics.frames_lost(1)
+
+                stream.latest = frame
+                stream.latest_time = now
+
+                if not stream.queued and not stream.busy:
+                    stream.queued = True
+                    self._ready.append(stream)
+                    self._cond.notify()
+
+
+    def _work_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._ready:
+                    self._cond.wait()
+                if not self._running:
+                    return
+
+                stream = self._ready.popleft()
+                stream.queued = False
+                frame, captured = stream.latest, stream.latest_time
+                stream.latest = None
+                if frame is None or stream.stopped:
+                    continue
+                stream.busy = True
+
+            try:
+                self._process(stream, frame, captured)
+            finally:
+                with self._cond:
+                    stream.busy = False
+                    # Back of the queue: every other waiting stream goes first.
+                    if stream.latest is not None and not stream.stopped:
+                        stream.queued = True
+                        self._ready.append(stream)
+                    self._cond.notify_all()
+
+
+    def _process(self, stream, frame, captured):
+        stream.metrics.frame_started()
+        try:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            out_frame, _ = stream.processor.process(frame, stream.pose)
+        except Exception as exc:
+            stream.errors += 1
+            stream.last_error = repr(exc)
+            return
+        finally:
+            stream.metrics.frame_finished()
+
+        now = time.monotonic()
+        stream.processed += 1
+        stream.last_processed = now
+        stream.lag += LAG_SMOOTHING * ((now - captured) - stream.lag)
+        stream.output = out_frame
+
+
+    def latest_jpeg(self, name, quality=80):
+        stream = self.streams.get(name)
+        if stream is None or stream.output is None:
+            return None
+
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(stream.output, cv2.COLOR_RGB2BGR),
+                                   [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+        return encoded.tobytes() if ok else None
+
+
+    def stats(self):
+        now = time.monotonic()
+        streams = [stream.stats(now) for stream in list(self.streams.values())]
+
+        return {
+            'workers': self.workers,
+            'worker_processes': self.worker_pool is not None,
+            'ready': len(self._ready),
+            'streams': streams
+        }
+
+
+    def health(self):
+        """Overall status: ok when every stream is ok, degraded otherwise."""
+
+        now = time.monotonic()
+        statuses = {stream.name: stream.status(now) for stream in list(self.streams.values())}
+        healthy = all(status == 'ok' for status in statuses.values())
+
+        return {'status': 'ok' if healthy else 'degraded', 'streams': statuses}
+
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads.clear()
+
+        for name in list(self.streams):
+            self.remove_stream(name)
+
+
+
+class _CameraHandler(BaseHTTPRequestHandler):
+
+    server_ref = None
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), 'application/json')
+
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+
+        if parts == ['health']:
+            health = self.server_ref.health()
+            # 503 lets load balancers / orchestrators act on a degraded camera.
+            self._send_json(200 if health['status'] == 'ok' else 503, health)
+        elif parts == ['streams']:
+            self._send_json(200, self.server_ref.stats())
+        elif len(parts) == 3 and parts[0] == 'streams' and parts[2] == 'frame.jpg':
+            jpeg = self.server_ref.latest_jpeg(parts[1])
+            if jpeg is None:
+                self._send_json(404, {'error': 'no frame'})
+            else:
+                self._send(200, jpeg, 'image/jpeg')
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+def make_server(camera_server, host='127.0.0.1', port=DEFAULT_PORT):
+    """HTTP status server for a CameraServer; call serve_forever() on it."""
+
+    handler = type('CameraHandler', (_CameraHandler,), {'server_ref': camera_server})
+
+    return ThreadingHTTPServer((host, port), handler)
+
+
+
+def _replay_multi_pose_factory():
+    from pose_backends import ReplayMultiPose
+    from synthetic_squat import squat_sequence
+
+    sequences = []
+    for idx, (shift, period) in enumerate(((-0.3, 1.6), (0.0, 2.2), (0.3, 1.9))):
+        sequence = squat_sequence(600, rep_period=period, variation=0.2, scale=0.35, seed=idx)
+        sequence[..., 0] += shift
+        sequences.append(sequence)
+
+    return ReplayMultiPose(sequences)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream', action='append', required=True, metavar='NAME=URL',
+                        help='Camera URL (rtsp://, http://) or video file; repeat for every camera')
+    parser.add_argument('--mode', choices=sorted(MODES), default='beginner')
+    parser.add_argument('--loop', action='store_true', help='Restart video files at the end')
+    parser.add_argument('--workers', type=int, help='Pose workers shared by all streams, default: CPU count')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--pose', choices=['mediapipe', 'replay'], default='mediapipe', help=REPLAY_POSE_HELP)
+    parser.add_argument('--multi-athlete', action='store_true',
+                        help='Track several athletes per camera (PoseLandmarker model from SQUAT_POSE_LANDMARKER_MODEL)')
+    args = parser.parse_args()
+
+    if args.pose == 'replay':
+        pose_factory = _replay_multi_pose_factory if args.multi_athlete else replay_pose
+    else:
+        pose_factory = None
+
+    camera_server = CameraServer(pose_factory, workers=args.workers, multi_athlete=args.multi_athlete)
+
+    for spec in args.stream:
+        name, sep, url = spec.partition('=')
+        if not sep:
+            name, url = f'camera{len(camera_server.streams)}', spec
+        camera_server.add_stream(name, url, args.mode, args.loop)
+
+    start_metrics_server()
+    camera_server.start()
+
+    server = make_server(camera_server, args.host, args.port)
+    print(f'Analyzing {len(camera_server.streams)} streams with {camera_server.workers} workers, '
+          f'status on http://{args.host}:{args.port}/health', file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        camera_server.stop()
+
+
+if __name__ == '__main__':
+    main()
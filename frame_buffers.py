@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class FrameBufferPool:
+    """
+    Named, preallocated frame buffers that are reused across frames.
+
+    A slot keeps handing out the same array as long as the requested shape and
+    dtype match, so the per-frame loop only allocates when the input resolution
+    changes. Allocation and reuse counts are kept for instrumentation.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.allocations = 0
+        self.reuses = 0
+
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self.buffers.get(name)
+
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != np.dtype(dtype):
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buffer
+            self.allocations += 1
+        else:
+            self.reuses += 1
+
+        return buffer
+
+
+    def adopt(self, name, array):
+        """Track an array returned by an API that may reallocate its output (e.g. VideoCapture.read)."""
+
+        if self.buffers.get(name) is array:
+            self.reuses += 1
+        else:
+            self.buffers[name] = array
+            self.allocations += 1
+
+        return array
+
+
+    def stats(self):
+        return {
+            'allocations': self.allocations,
+            'reuses': self.reuses,
+            'buffers': len(self.buffers),
+            'bytes': int(sum(buffer.nbytes for buffer in self.buffers.values()))
+        }
+
+
+
+def video_frame_view(frame):
+    """
+    Writable (H, W, 3) view onto the pixel plane of a packed 24-bit av.VideoFrame.
+
+    Drawing into the view modifies the frame itself, so it can be returned to the
+    WebRTC track without to_ndarray / from_ndarray copies. Row padding is handled
+    through the strides.
+    """
+
+    plane = frame.planes[0]
+
+    return np.ndarray((frame.height, frame.width, 3), dtype=np.uint8,
+                      buffer=plane, strides=(plane.line_size, 3, 1))
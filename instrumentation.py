@@ -0,0 +1,257 @@
+import bisect
+import time
+
+
+# Upper bounds (seconds) of the histogram buckets: 10 us to ~9 s, 4 buckets per octave.
+LATENCY_BUCKETS = tuple(10e-6 * 2 ** (i / 4) for i in range(80))
+
+
+class LatencyHistogram:
+    """
+    Fixed-size latency histogram with logarithmic buckets.
+
+    Recording is a bisect and an increment, memory never grows. Percentiles are
+    resolved to the upper bound of their bucket (~19% relative resolution).
+    Intended for one writer thread; readers may see a slightly stale snapshot.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+
+        rank = q / 100.0 * self.count
+        cumulative = 0
+
+        for idx, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank and bucket_count:
+                return min(self.buckets[idx], self.max) if idx < len(self.buckets) else self.max
+
+        return self.max
+
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1e3 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1e3,
+            'p95_ms': self.percentile(95) * 1e3,
+            'p99_ms': self.percentile(99) * 1e3,
+            'max_ms': self.max * 1e3
+        }
+
+
+
+class StageTimings:
+    """
+    Per-stage latency histograms for ProcessFrame plus a smoothed frame rate.
+
+    Stages: pose inference, landmark extraction, angles/state, drawing, MPJPE
+    and the whole frame ('total'). Timings come from time.perf_counter.
+    """
+
+    STAGES = ('inference', 'landmarks', 'state', 'drawing', 'mpjpe', 'total')
+
+    def __init__(self, smoothing=0.1):
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.last = dict.fromkeys(self.STAGES, 0.0)
+        self.smoothing = smoothing
+
+        self.frames = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self.last_frame_time = None
+        # perf_counter (start, end) of the last pose inference, for LatencyTracer.
+        self.inference_span = (0.0, 0.0)
+
+
+    def record(self, stage, seconds):
+        self.histograms[stage].record(seconds)
+        self.last[stage] = seconds
+
+
+    def end_frame(self, total_seconds):
+        """Close the current frame: record its total latency and update the smoothed FPS."""
+
+        self.record('total', total_seconds)
+        self.frames += 1
+
+        now = time.perf_counter()
+        alpha = self.smoothing
+
+        if self.last_frame_time is not None:
+            interval = now - self.last_frame_time
+            if interval > 0:
+                self.fps = 1.0 / interval if self.fps == 0.0 else (1 - alpha) * self.fps + alpha / interval
+
+        self.latency = total_seconds if self.frames == 1 else (1 - alpha) * self.latency + alpha * total_seconds
+        self.last_frame_time = now
+
+
+    def summary(self):
+        """Cheap per-frame figures for the HUD."""
+
+        return {
+            'fps': self.fps,
+            'total_ms': self.latency * 1e3,
+            'inference_ms': self.last['inference'] * 1e3
+        }
+
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'fps': self.fps,
+            'latency_ms': self.latency * 1e3,
+            'stages': {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+        }
+
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+        self.last = dict.fromkeys(self.STAGES, 0.0)
+        self.frames = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self.last_frame_time = None
+        self.inference_span = (0.0, 0.0)
+
+
+
+class LatencyTracer:
+    """
+    Per-hop latency of the live callback, keyed on the frame's PTS.
+
+    Each frame is traced with its PTS/time_base and four perf_counter
+    timestamps: receive, inference start, inference end and send. Hops:
+
+      network     arrival delay relative to the media clock, normalised to the
+                  fastest frame seen (sender and receiver clocks are not synced,
+                  so this is the extra delay from network/queueing jitter)
+      pre         receive -> inference start (decode, colour conversion)
+      inference   pose estimation
+      post        inference end -> send (analysis, drawing, MPJPE, copy back)
+      processing  receive -> send
+      end_to_end  network + processing
+
+    A PTS gap larger than drop_tolerance frame intervals counts the missing
+    frames as dropped, i.e. discarded upstream because the callback was busy.
+    """
+
+    HOPS = ('network', 'pre', 'inference', 'post', 'processing', 'end_to_end')
+
+    def __init__(self, drop_tolerance=1.5, smoothing=0.1):
+        self.drop_tolerance = drop_tolerance
+        self.smoothing = smoothing
+        self.histograms = {hop: LatencyHistogram() for hop in self.HOPS}
+        self.reset()
+
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+        self.rolling = dict.fromkeys(self.HOPS, 0.0)
+        self.frames = 0
+        self.dropped = 0
+        self.frame_interval = None
+
+        self._min_offset = None
+        self._last_media_time = None
+
+
+    def _detect_drops(self, media_time):
+        """Update the expected frame interval from PTS deltas; return frames missing before this one."""
+
+        last, self._last_media_time = self._last_media_time, media_time
+
+        if last is None:
+            return 0
+
+        delta = media_time - last
+        if delta <= 0:
+            # Stream restarted or PTS wrapped: start over on the new clock.
+            self._min_offset = None
+            self.frame_interval = None
+            return 0
+
+        if self.frame_interval is None:
+            self.frame_interval = delta
+            return 0
+
+        if delta > self.drop_tolerance * self.frame_interval:
+            return max(int(round(delta / self.frame_interval)) - 1, 0)
+
+        self.frame_interval += self.smoothing * (delta - self.frame_interval)
+        return 0
+
+
+    def trace(self, pts, time_base, received, inference_start, inference_end, sent):
+        """Record one frame; returns the number of frames detected as dropped before it."""
+
+        dropped = 0
+        network = 0.0
+
+        if pts is not None and time_base is not None:
+            media_time = float(pts * time_base)
+            dropped = self._detect_drops(media_time)
+
+            offset = received - media_time
+            if self._min_offset is None or offset < self._min_offset:
+                self._min_offset = offset
+            network = offset - self._min_offset
+
+        processing = sent - received
+        hops = {
+            'network': network,
+            'pre': inference_start - received,
+            'inference': inference_end - inference_start,
+            'post': sent - inference_end,
+            'processing': processing,
+            'end_to_end': network + processing
+        }
+
+        alpha = self.smoothing
+        for hop, seconds in hops.items():
+            self.histograms[hop].record(seconds)
+            self.rolling[hop] = seconds if self.frames == 0 else (1 - alpha) * self.rolling[hop] + alpha * seconds
+
+        self.frames += 1
+        self.dropped += dropped
+
+        return dropped
+
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'frame_interval_ms': (self.frame_interval or 0.0) * 1e3,
+            'hops': {hop: dict(histogram.snapshot(), rolling_ms=self.rolling[hop] * 1e3)
+                     for hop, histogram in self.histograms.items()}
+        }
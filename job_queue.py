@@ -0,0 +1,457 @@
+"""
+Durable queue of upload analysis jobs, backed by SQLite plus a job directory.
+
+    python job_queue.py worker --processes 4      # on every compute node
+    python job_queue.py enqueue squat.mp4 --mode pro
+    python job_queue.py status [job_id]
+
+The web node only spools the upload into the job directory and enqueues it;
+workers (any number of processes, on any node that sees the same
+SQUAT_JOB_DIR) claim jobs under a lease, run the ProcessFrame pipeline and
+write the annotated video and a result summary back. A worker that dies
+stops renewing its lease and the job is handed to another worker.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import cv2
+import numpy as np
+
+from pose_backends import REPLAY_POSE_HELP, replay_pose
+
+
+# Shared job directory: jobs.sqlite3, inputs/ and outputs/.
+JOB_DIR_ENV = 'SQUAT_JOB_DIR'
+DEFAULT_JOB_DIR = os.path.join(tempfile.gettempdir(), 'squat_vision_jobs')
+
+# A claimed job is taken over by another worker if not renewed for this long.
+LEASE_SECONDS = 60.0
+# Progress updates (which also renew the lease) at most this often.
+HEARTBEAT_INTERVAL = 1.0
+# Claims per job before it is marked failed (covers workers crashing on it).
+MAX_ATTEMPTS = 3
+# Idle workers look for new jobs this often.
+POLL_INTERVAL = 1.0
+
+STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    output_path TEXT,
+    filename TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    frames_done INTEGER NOT NULL DEFAULT 0,
+    frame_count INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+
+class LeaseLost(Exception):
+    """The job was cancelled or taken over by another worker."""
+
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue.
+
+    Every call opens its own short-lived connection, so one instance can be
+    shared between threads (Streamlit script runs) and the database file can
+    be shared between processes. Claims run in an IMMEDIATE transaction, so
+    two workers never claim the same job.
+    """
+
+    def __init__(self, job_dir=None):
+        self.job_dir = job_dir or os.environ.get(JOB_DIR_ENV, DEFAULT_JOB_DIR)
+        self.db_path = os.path.join(self.job_dir, 'jobs.sqlite3')
+        self.input_dir = os.path.join(self.job_dir, 'inputs')
+        self.output_dir = os.path.join(self.job_dir, 'outputs')
+
+        os.makedirs(self.input_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+
+        return _Connection(conn)
+
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['progress'] = job['frames_done'] / job['frame_count'] if job['frame_count'] else 0.0
+
+        return job
+
+
+    def enqueue(self, video_path, params=None, filename=None, move=True):
+        """
+        Add a job for a video; returns its id.
+
+        The video is moved (or copied with move=False) into the job directory,
+        so it outlives the upload's temporary file.
+        """
+
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.input_dir, job_id + os.path.splitext(video_path)[1])
+        (shutil.move if move else shutil.copyfile)(video_path, input_path)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT INTO jobs (id, status, params, input_path, filename, created, updated) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, 'queued', json.dumps(params or {}), input_path,
+                          filename or os.path.basename(video_path), now, now))
+
+        return job_id
+
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """Claim the oldest queued job (or one whose lease expired); None if there is none."""
+
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs of dead workers that used up their attempts are given up on.
+                conn.execute("UPDATE jobs SET status = 'failed', error = 'worker lost too often', updated = ? "
+                             "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                             (now, now, MAX_ATTEMPTS))
+
+                row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' "
+                                   "OR (status = 'running' AND lease_until < ?) "
+                                   "ORDER BY created LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+
+                conn.execute("UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                             "attempts = attempts + 1, updated = ? WHERE id = ?",
+                             (worker_id, now + lease_seconds, now, row['id']))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+            return self._job(conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone())
+
+
+    def heartbeat(self, job_id, worker_id, frames_done, frame_count, lease_seconds=LEASE_SECONDS):
+        """Record progress and renew the lease; raises LeaseLost if the job is no longer ours."""
+
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET frames_done = ?, frame_count = ?, lease_until = ?, updated = ? "
+                                  "WHERE id = ? AND worker = ? AND status = 'running'",
+                                  (frames_done, frame_count, now + lease_seconds, now, job_id, worker_id))
+
+        if cursor.rowcount == 0:
+            raise LeaseLost(job_id)
+
+
+    def complete(self, job_id, worker_id, result, output_path):
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'done', result = ?, output_path = ?, "
+                                  "frames_done = ?, frame_count = ?, lease_until = NULL, updated = ? "
+                                  "WHERE id = ? AND worker = ? AND status = 'running'",
+                                  (json.dumps(result), output_path, result['frames'], result['frames'], now,
+                                   job_id, worker_id))
+
+        if cursor.rowcount == 0:
+            raise LeaseLost(job_id)
+
+
+    def fail(self, job_id, worker_id, error):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated = ? "
+                         "WHERE id = ? AND worker = ? AND status = 'running'", (error, now, job_id, worker_id))
+
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; a running worker notices at its next heartbeat."""
+
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'cancelled', lease_until = NULL, updated = ? "
+                                  "WHERE id = ? AND status IN ('queued', 'running')", (now, job_id))
+
+        return cursor.rowcount > 0
+
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+
+    def list_jobs(self, limit=50):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM jobs ORDER BY created DESC LIMIT ?', (limit,)).fetchall()
+
+        return [self._job(row) for row in rows]
+
+
+    def counts(self):
+        """Number of jobs per status."""
+
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+
+        return counts
+
+
+    def partial_path(self, job):
+        """
+        Output file a claim of the job writes before renaming it into place.
+
+        Includes the attempt number, so a worker that lost its lease never
+        touches the file of the worker that took the job over.
+        """
+
+        return os.path.join(self.output_dir, f"{job['id']}.{job['attempts']}.part.mp4")
+
+
+    def delete(self, job_id):
+        """Remove a finished job and its files."""
+
+        job = self.get(job_id)
+        if job is None or job['status'] in ('queued', 'running'):
+            return False
+
+        for path in (job['input_path'], job['output_path']):
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+        return True
+
+
+
+class _Connection:
+    """sqlite3 connection that is closed (not only committed) at the end of a with block."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+
+    def __enter__(self):
+        return self._conn
+
+
+    def __exit__(self, *exc_info):
+        self._conn.close()
+
+
+
+def run_job(job, queue, worker_id, pose):
+    """Process one claimed job: annotated video into outputs/, summary into the job row."""
+
+    # Imported here so enqueueing (the web node) does not load the pipeline.
+    from process_frame import ProcessFrame
+    from thresholds import MODES, get_thresholds_beginner
+    from video_pipeline import open_video, iter_processed_frames
+    from session_history import get_history, session_record
+
+    params = job['params']
+    thresholds = MODES.get(params.get('mode', 'beginner').lower(), get_thresholds_beginner)()
+    process_frame = ProcessFrame(thresholds=thresholds, evaluate_mpjpe=params.get('evaluate_mpjpe', False),
+                                 visualize_comparison=params.get('visualize_comparison', False),
+                                 display_mpjpe=params.get('display_mpjpe', False))
+
+    output_path = os.path.join(queue.output_dir, job['id'] + '.mp4')
+    partial_path = queue.partial_path(job)
+
+    vf, metadata = open_video(job['input_path'])
+    writer = None
+    frames = 0
+    last_heartbeat = time.monotonic()
+    start = time.perf_counter()
+    started = time.time()
+
+    try:
+        if not vf.isOpened():
+            raise ValueError('cannot open the uploaded video')
+
+        writer = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*'mp4v'), metadata['fps'] or 30,
+                                 (metadata['width'], metadata['height']))
+
+        for out_frame, _ in iter_processed_frames(vf, process_frame, pose):
+            writer.write(cv2.cvtColor(out_frame, cv2.COLOR_RGB2BGR))
+            frames += 1
+
+            now = time.monotonic()
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                queue.heartbeat(job['id'], worker_id, frames, max(metadata['frame_count'], frames))
+                last_heartbeat = now
+    finally:
+        vf.release()
+        if writer is not None:
+            writer.release()
+
+    os.replace(partial_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    result = {
+        'frames': frames,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        # Whole-video totals; the displayed counters reset after a pause.
+        'SQUAT_COUNT': int(process_frame.state_tracker['SQUAT_TOTAL']),
+        'IMPROPER_SQUAT': int(process_frame.state_tracker['IMPROPER_TOTAL']),
+        'stages': process_frame.get_stats()['stages']
+    }
+    if process_frame.mpjpe_values:
+        result['mpjpe'] = {'mean': float(np.mean(process_frame.mpjpe_values)),
+                           'min': float(np.min(process_frame.mpjpe_values)),
+                           'max': float(np.max(process_frame.mpjpe_values))}
+
+    queue.complete(job['id'], worker_id, result, output_path)
+    # Keyed by job id: a job re-run after a lost lease is recorded once.
+    get_history().record(session_record(process_frame, params.get('mode', 'beginner'), 'job', started,
+                                        user=params.get('user'), session_key=f"job:{job['id']}", frames=frames))
+
+    return result
+
+
+
+def worker_loop(queue=None, pose_factory=None, worker_id=None, max_jobs=None, poll_interval=POLL_INTERVAL):
+    """Claim and run jobs until max_jobs are done (forever by default)."""
+
+    queue = queue or JobQueue()
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    if pose_factory is None:
+        from utils import get_mediapipe_pose
+        pose_factory = get_mediapipe_pose
+
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        # Pose trackers carry state between frames: a fresh instance per video.
+        pose = pose_factory()
+        try:
+            result = run_job(job, queue, worker_id, pose)
+            print(f"{worker_id}: job {job['id']} done, {result['frames']} frames at {result['fps']:.1f} fps",
+                  file=sys.stderr, flush=True)
+        except LeaseLost:
+            print(f"{worker_id}: job {job['id']} cancelled or taken over", file=sys.stderr, flush=True)
+        except Exception as exc:
+            queue.fail(job['id'], worker_id, repr(exc))
+            print(f"{worker_id}: job {job['id']} failed: {exc!r}", file=sys.stderr, flush=True)
+        finally:
+            pose.close()
+            partial_path = queue.partial_path(job)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        done += 1
+
+    return done
+
+
+
+def _worker_process(job_dir, replay):
+    try:
+        worker_loop(JobQueue(job_dir), replay_pose if replay else None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # multiprocessing children exit without running atexit handlers.
+        from session_history import get_history
+        get_history().close()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--job-dir', help=f'Job directory, default: ${JOB_DIR_ENV} or {DEFAULT_JOB_DIR}')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker = commands.add_parser('worker', help='Process queued jobs')
+    worker.add_argument('--processes', type=int, default=1, help='Worker processes on this node')
+    worker.add_argument('--pose', choices=['mediapipe', 'replay'], default='mediapipe', help=REPLAY_POSE_HELP)
+
+    enqueue = commands.add_parser('enqueue', help='Queue a video (copied into the job directory)')
+    enqueue.add_argument('video')
+    enqueue.add_argument('--mode', choices=['beginner', 'pro'], default='beginner')
+    enqueue.add_argument('--mpjpe', action='store_true', help='Evaluate MPJPE')
+    enqueue.add_argument('--user', help='Athlete the session is recorded for in the history')
+
+    status = commands.add_parser('status', help='Show one job or the most recent ones')
+    status.add_argument('job_id', nargs='?')
+
+    args = parser.parse_args()
+    queue = JobQueue(args.job_dir)
+
+    if args.command == 'worker':
+        context = mp.get_context('spawn')
+        processes = [context.Process(target=_worker_process, args=(queue.job_dir, args.pose == 'replay'),
+                                     name=f'job-worker-{idx}') for idx in range(args.processes)]
+        for process in processes:
+            process.start()
+        print(f'{args.processes} job workers on {queue.job_dir}', file=sys.stderr)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join(timeout=5)
+
+    elif args.command == 'enqueue':
+        job_id = queue.enqueue(args.video, {'mode': args.mode, 'evaluate_mpjpe': args.mpjpe, 'user': args.user},
+                               move=False)
+        print(job_id)
+
+    elif args.job_id:
+        print(json.dumps(queue.get(args.job_id), indent=2))
+
+    else:
+        for job in queue.list_jobs():
+            print(f"{job['id']}  {job['status']:<9}  {job['progress']:6.1%}  {job['filename']}")
+
+
+if __name__ == '__main__':
+    main()
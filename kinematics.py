@@ -0,0 +1,138 @@
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Landmark ids used by the angle kernel.
+NOSE = 0
+LEFT_CHAIN = (11, 23, 25, 27, 31)    # shoulder, hip, knee, ankle, foot
+RIGHT_CHAIN = (12, 24, 26, 28, 32)
+
+# utils.find_angle converts with int(180 / pi) == 57, keep the same factor so
+# the kernel reproduces its output exactly.
+DEGREES = float(int(180 / np.pi))
+
+
+def _angle(p1x, p1y, p2x, p2y, ref_x, ref_y):
+    ax, ay = p1x - ref_x, p1y - ref_y
+    bx, by = p2x - ref_x, p2y - ref_y
+
+    denom = math.sqrt(ax * ax + ay * ay) * math.sqrt(bx * bx + by * by)
+    if denom == 0:
+        return 0
+
+    cos_theta = min(1.0, max(-1.0, (ax * bx + ay * by) / denom))
+
+    return int(DEGREES * math.acos(cos_theta))
+
+
+
+def frame_angles(coords):
+    """
+    Compute every angle ProcessFrame needs from a (33, 2) pixel landmark array in one call.
+
+    Returns:
+        (offset_angle, use_left, hip_vertical_angle, knee_vertical_angle, ankle_vertical_angle)
+        where use_left tells whether the left side faces the camera.
+    """
+
+    c = coords.tolist() if isinstance(coords, np.ndarray) else coords
+
+    nose_x, nose_y = c[NOSE]
+    l_shldr_x, l_shldr_y = c[LEFT_CHAIN[0]]
+    r_shldr_x, r_shldr_y = c[RIGHT_CHAIN[0]]
+
+    offset_angle = _angle(l_shldr_x, l_shldr_y, r_shldr_x, r_shldr_y, nose_x, nose_y)
+
+    use_left = abs(c[LEFT_CHAIN[4]][1] - l_shldr_y) > abs(c[RIGHT_CHAIN[4]][1] - r_shldr_y)
+    shldr, hip, knee, ankle, _ = (c[idx] for idx in (LEFT_CHAIN if use_left else RIGHT_CHAIN))
+
+    # Vertical angles are measured against the point straight above the joint at y = 0.
+    hip_vertical_angle = _angle(shldr[0], shldr[1], hip[0], 0, hip[0], hip[1])
+    knee_vertical_angle = _angle(hip[0], hip[1], knee[0], 0, knee[0], knee[1])
+    ankle_vertical_angle = _angle(knee[0], knee[1], ankle[0], 0, ankle[0], ankle[1])
+
+    return offset_angle, use_left, hip_vertical_angle, knee_vertical_angle, ankle_vertical_angle
+
+
+
+def _angle_batch(p1, p2, ref_pt):
+    a = (p1 - ref_pt).astype(np.float64)
+    b = (p2 - ref_pt).astype(np.float64)
+
+    denom = np.sqrt((a * a).sum(axis=-1)) * np.sqrt((b * b).sum(axis=-1))
+    dot = (a * b).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_theta = np.clip(dot / denom, -1.0, 1.0)
+
+    degrees = np.trunc(DEGREES * np.arccos(cos_theta))
+
+    return np.where(denom == 0, 0, degrees).astype(np.int64)
+
+
+
+def frame_angles_batch(coords):
+    """
+    Batched frame_angles over a (T, 33, 2) landmark array.
+
+    Returns a tuple of (T,) arrays in the same order as frame_angles.
+    """
+
+    coords = np.asarray(coords)
+
+    l_chain = coords[:, LEFT_CHAIN]
+    r_chain = coords[:, RIGHT_CHAIN]
+
+    offset_angle = _angle_batch(l_chain[:, 0], r_chain[:, 0], coords[:, NOSE])
+
+    use_left = np.abs(l_chain[:, 4, 1] - l_chain[:, 0, 1]) > np.abs(r_chain[:, 4, 1] - r_chain[:, 0, 1])
+    chain = np.where(use_left[:, None, None], l_chain, r_chain)
+    shldr, hip, knee, ankle = chain[:, 0], chain[:, 1], chain[:, 2], chain[:, 3]
+
+    def vertical(p1, joint):
+        top = joint.copy()
+        top[:, 1] = 0
+        return _angle_batch(p1, top, joint)
+
+    return (offset_angle, use_left, vertical(shldr, hip), vertical(hip, knee), vertical(knee, ankle))
+
+
+
+def _build_jit_kernel():
+    angle = numba.njit(cache=True)(_angle)
+
+    @numba.njit(cache=True)
+    def kernel(c):
+        offset_angle = angle(c[11, 0], c[11, 1], c[12, 0], c[12, 1], c[0, 0], c[0, 1])
+
+        use_left = abs(c[31, 1] - c[11, 1]) > abs(c[32, 1] - c[12, 1])
+        if use_left:
+            shldr, hip, knee, ankle = 11, 23, 25, 27
+        else:
+            shldr, hip, knee, ankle = 12, 24, 26, 28
+
+        hip_vertical_angle = angle(c[shldr, 0], c[shldr, 1], c[hip, 0], 0, c[hip, 0], c[hip, 1])
+        knee_vertical_angle = angle(c[hip, 0], c[hip, 1], c[knee, 0], 0, c[knee, 0], c[knee, 1])
+        ankle_vertical_angle = angle(c[knee, 0], c[knee, 1], c[ankle, 0], 0, c[ankle, 0], c[ankle, 1])
+
+        return offset_angle, use_left, hip_vertical_angle, knee_vertical_angle, ankle_vertical_angle
+
+    return kernel
+
+
+JIT_AVAILABLE = numba is not None
+_frame_angles_jit = _build_jit_kernel() if JIT_AVAILABLE else None
+
+
+def frame_angles_jit(coords):
+    """numba-compiled frame_angles, falls back to the pure Python kernel when numba is not installed."""
+
+    if _frame_angles_jit is None:
+        return frame_angles(coords)
+
+    return _frame_angles_jit(np.ascontiguousarray(coords, dtype=np.int64))
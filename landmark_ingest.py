@@ -0,0 +1,216 @@
+"""
+Compact landmark packets for clients that run pose estimation on-device.
+
+Packet layout (little endian):
+
+    header  24 bytes  magic b'SQLM', version u8, flags u8, landmark count u16,
+                      sequence u32, timestamp (us) u64, frame width u16, frame height u16
+    payload           count x 4 float16 (x, y, z, visibility), absent with FLAG_NO_POSE
+
+A keyframe (FLAG_KEYFRAME) carries normalized landmarks; other packets carry
+the difference to the previous reconstructed frame. The encoder applies the
+same float16 rounding as the decoder to its reference, so errors never
+accumulate across deltas. A delta that does not follow the previous sequence
+number cannot be decoded and the client has to send a keyframe.
+"""
+import time
+import struct
+
+import numpy as np
+
+from pose_backends import NUM_LANDMARKS, landmarks_to_result
+
+
+MAGIC = b'SQLM'
+VERSION = 1
+
+FLAG_KEYFRAME = 0x01
+FLAG_NO_POSE = 0x02
+
+HEADER = struct.Struct('<4sBBHIQHH')
+CONTENT_TYPE = 'application/x-squat-landmarks'
+
+
+class PacketError(ValueError):
+    """Malformed or undecodable landmark packet."""
+
+
+
+class KeyframeRequired(PacketError):
+    """A delta packet arrived without the reference frame it is relative to."""
+
+
+
+class LandmarkEncoder:
+    """Client-side encoder: (33, 4) normalized landmarks per frame to packets."""
+
+    def __init__(self, width, height, keyframe_interval=30):
+        self.width = width
+        self.height = height
+        self.keyframe_interval = keyframe_interval
+
+        self.seq = 0
+        self._reference = None
+        self._since_keyframe = 0
+
+
+    def force_keyframe(self):
+        self._reference = None
+
+
+    def encode(self, landmarks, timestamp_us=0):
+        """Encode one frame; landmarks None (or containing NaN) means no person detected."""
+
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+
+        if landmarks is None or np.isnan(landmarks).any():
+            self._reference = None
+            return HEADER.pack(MAGIC, VERSION, FLAG_NO_POSE, 0, seq, timestamp_us, self.width, self.height)
+
+        landmarks = np.asarray(landmarks, dtype=np.float32).reshape(NUM_LANDMARKS, 4)
+
+        if self._reference is None or self._since_keyframe >= self.keyframe_interval:
+            flags = FLAG_KEYFRAME
+            payload = landmarks.astype(np.float16)
+            self._reference = payload.astype(np.float32)
+            self._since_keyframe = 0
+        else:
+            flags = 0
+            payload = (landmarks - self._reference).astype(np.float16)
+            # Track the decoder's reconstruction, not the true landmarks.
+            self._reference = self._reference + payload.astype(np.float32)
+            self._since_keyframe += 1
+
+        header = HEADER.pack(MAGIC, VERSION, flags, NUM_LANDMARKS, seq, timestamp_us, self.width, self.height)
+
+        return header + payload.astype('<f2').tobytes()
+
+
+
+class LandmarkDecoder:
+    """Server-side decoder for one stream; keeps the reference frame of the deltas."""
+
+    def __init__(self):
+        self._reference = None
+        self._last_seq = None
+
+
+    def decode(self, packet):
+        """Decode one packet into a dict with seq, timestamp_us, width, height and landmarks (None: no pose)."""
+
+        if len(packet) < HEADER.size:
+            raise PacketError('truncated header')
+
+        magic, version, flags, count, seq, timestamp_us, width, height = HEADER.unpack_from(packet)
+        if magic != MAGIC or version != VERSION:
+            raise PacketError('not a landmark packet')
+
+        decoded = {'seq': seq, 'timestamp_us': timestamp_us, 'width': width, 'height': height, 'landmarks': None}
+
+        expected = None if self._last_seq is None else (self._last_seq + 1) & 0xFFFFFFFF
+        self._last_seq = seq
+
+        if flags & FLAG_NO_POSE:
+            self._reference = None
+            return decoded
+
+        if count != NUM_LANDMARKS or len(packet) != packet_size(flags):
+            raise PacketError(f'expected {NUM_LANDMARKS} landmarks in {packet_size(flags)} bytes')
+
+        values = np.frombuffer(packet, dtype='<f2', count=NUM_LANDMARKS * 4, offset=HEADER.size)
+        values = values.reshape(NUM_LANDMARKS, 4).astype(np.float32)
+
+        if flags & FLAG_KEYFRAME:
+            self._reference = values
+        elif self._reference is None or seq != expected:
+            self._reference = None
+            raise KeyframeRequired(f'delta packet {seq} without its reference frame')
+        else:
+            self._reference = self._reference + values
+
+        decoded['landmarks'] = self._reference
+
+        return decoded
+
+
+
+def packet_size(flags):
+    return HEADER.size if flags & FLAG_NO_POSE else HEADER.size + NUM_LANDMARKS * 4 * 2
+
+
+
+def split_packets(data):
+    """Split a body of concatenated packets into individual packets."""
+
+    data = memoryview(data)
+    offset = 0
+
+    while offset < len(data):
+        if len(data) - offset < HEADER.size:
+            raise PacketError('truncated header')
+
+        flags = data[offset + 5]
+        size = packet_size(flags)
+        if offset + size > len(data):
+            raise PacketError('truncated payload')
+
+        yield data[offset:offset + size]
+        offset += size
+
+
+
+class LandmarkSession:
+    """
+    Analysis of one landmark stream: decoder plus a ProcessFrame used for
+    analyze() only, no pixels and no inference.
+    """
+
+    def __init__(self, process_frame):
+        self.process_frame = process_frame
+        self.decoder = LandmarkDecoder()
+        self.frames = 0
+
+
+    def ingest(self, data):
+        """
+        Analyze every packet of a body in order.
+
+        The whole body is split and decoded before anything is analyzed, so a
+        malformed packet (PacketError) rejects it without changing the session
+        and the client can resend it.
+
+        Returns:
+            (results, keyframe_required): a list of (decoded packet, analyze() result)
+            pairs, and whether decoding stopped at a delta that needs a keyframe.
+        """
+
+        packets = list(split_packets(data))
+
+        # Deltas decode against the previous frame: undo the whole body on a bad packet.
+        reference, last_seq = self.decoder._reference, self.decoder._last_seq
+        decoded_packets = []
+        keyframe_required = False
+
+        try:
+            for packet in packets:
+                try:
+                    decoded_packets.append(self.decoder.decode(packet))
+                except KeyframeRequired:
+                    keyframe_required = True
+                    break
+        except PacketError:
+            self.decoder._reference, self.decoder._last_seq = reference, last_seq
+            raise
+
+        results = []
+
+        for decoded in decoded_packets:
+            start = time.perf_counter()
+            result = self.process_frame.analyze(landmarks_to_result(decoded['landmarks']),
+                                                decoded['width'], decoded['height'])
+            self.process_frame.timings.end_frame(time.perf_counter() - start)
+            self.frames += 1
+            results.append((decoded, result))
+
+        return results, keyframe_required
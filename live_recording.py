@@ -0,0 +1,480 @@
+"""
+Per-session recordings of the live stream in rolling, size-capped segments.
+
+Every recording gets its own directory under SQUAT_RECORDING_DIR with a
+manifest and numbered segments of SEGMENT_SECONDS each; a segment is written
+as <n>.part.<ext> and renamed when complete, so only finished segments are
+ever read. Two kinds of recordings:
+
+    video       the annotated frames as mp4 segments, encoded on a writer
+                thread so the frame callback only pays for a copy
+    landmarks   only the pose landmarks as landmark_ingest packets (~300 bytes
+                per frame); the annotated video is re-rendered on demand
+
+Each recording keeps at most session_quota bytes (oldest segments go first)
+and all recordings together at most SQUAT_RECORDING_QUOTA_MB; recordings
+older than RETENTION_SECONDS are removed.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from landmark_ingest import LandmarkEncoder, LandmarkDecoder, split_packets
+from pose_backends import landmarks_to_result, result_to_array
+
+
+RECORDING_DIR_ENV = 'SQUAT_RECORDING_DIR'
+DEFAULT_RECORDING_DIR = os.path.join(tempfile.gettempdir(), 'squat_vision_recordings')
+
+QUOTA_ENV = 'SQUAT_RECORDING_QUOTA_MB'
+DEFAULT_QUOTA_MB = 2048
+
+# Share of the total quota a single recording may hold before its oldest segments are rotated out.
+SESSION_QUOTA_SHARE = 0.25
+
+SEGMENT_SECONDS = 10.0
+RETENTION_SECONDS = 24 * 3600.0
+
+# Frames waiting for the video writer thread; further frames are dropped from the recording.
+WRITER_QUEUE_SIZE = 64
+
+# Frame rate assumed until the interval between frames has been measured.
+DEFAULT_FPS = 15.0
+
+KINDS = {'video': '.mp4', 'landmarks': '.sqlm'}
+
+MANIFEST = 'recording.json'
+
+
+def _segment_index(name):
+    stem = name.split('.', 1)[0]
+    return int(stem) if stem.isdigit() else None
+
+
+
+class _TapPose:
+    """Pose wrapper that hands every result to a landmark recording."""
+
+    def __init__(self, pose, recording):
+        self.pose = pose
+        self.recording = recording
+
+
+    def process(self, image):
+        result = self.pose.process(image)
+        height, width = image.shape[:2]
+        self.recording.write_landmarks(result, width, height)
+
+        return result
+
+
+    def close(self):
+        self.pose.close()
+
+
+
+class LiveRecording:
+    """
+    One recording, created by RecordingStore.open().
+
+    Video recordings take processed frames through write(); landmark
+    recordings take pose results, either through write_landmarks() or by
+    processing with tap(pose) in place of the pose.
+    """
+
+    def __init__(self, store, path, kind, segment_seconds=SEGMENT_SECONDS):
+        self.store = store
+        self.path = path
+        self.kind = kind
+        self.ext = KINDS[kind]
+        self.segment_seconds = segment_seconds
+        self.recording_id = os.path.basename(path)
+
+        self.frames = 0
+        self.dropped = 0
+        self.closed = False
+
+        self._index = 0
+        self._segment_start = None
+        self._segment_path = None
+        self._file = None
+        self._encoder = None
+        self._writer = None
+        self._interval = None
+        self._last_write = None
+        self._tap = None
+        self._lock = threading.Lock()
+
+        if kind == 'video':
+            self._queue = queue.Queue(WRITER_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._write_loop, name=f'recording-{self.recording_id}',
+                                            daemon=True)
+            self._thread.start()
+
+
+    def _part_path(self):
+        return os.path.join(self.path, f'{self._index:06d}.part{self.ext}')
+
+
+    def _open_segment(self, now, frame_shape=None):
+        self._index += 1
+        self._segment_start = now
+        self._segment_path = self._part_path()
+        self.store.active.add(self._segment_path)
+
+        if self.kind == 'video':
+            height, width = frame_shape[:2]
+            fps = min(max(1.0 / self._interval, 1.0), 60.0) if self._interval else DEFAULT_FPS
+            self._writer = cv2.VideoWriter(self._segment_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        else:
+            self._file = open(self._segment_path, 'wb')
+            # A fresh encoder starts every segment with a keyframe, so segments decode on their own.
+            self._encoder = None
+
+
+    def _close_segment(self):
+        if self._segment_path is None:
+            return
+
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        os.replace(self._segment_path, self._segment_path.replace('.part', ''))
+        self.store.active.discard(self._segment_path)
+        self._segment_path = None
+        self.store.enforce_quota(self)
+
+
+    def _due(self, now):
+        return self._segment_path is None or now - self._segment_start >= self.segment_seconds
+
+
+    def _track_interval(self, now):
+        if self._last_write is not None:
+            interval = now - self._last_write
+            self._interval = interval if self._interval is None else 0.9 * self._interval + 0.1 * interval
+        self._last_write = now
+
+
+    def write(self, frame):
+        """Queue a processed RGB frame (copied) for a video recording; dropped if the writer is behind."""
+
+        if self.closed:
+            return
+
+        now = time.monotonic()
+        self._track_interval(now)
+
+        try:
+            self._queue.put_nowait((now, frame.copy()))
+        except queue.Full:
+            self.dropped += 1
+
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            now, frame = item
+            with self._lock:
+                if self._due(now):
+                    self._close_segment()
+                    self._open_segment(now, frame.shape)
+                self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+                self.frames += 1
+
+        with self._lock:
+            self._close_segment()
+
+
+    def write_landmarks(self, result, width, height):
+        """Append one frame's pose result (None or no landmarks: no person) to a landmark recording."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            if self.closed:
+                return
+            if self._due(now):
+                self._close_segment()
+                self._open_segment(now)
+            if self._encoder is None or (self._encoder.width, self._encoder.height) != (width, height):
+                self._encoder = LandmarkEncoder(width, height)
+
+            landmarks = result_to_array(result)
+            self._file.write(self._encoder.encode(None if np.isnan(landmarks).any() else landmarks,
+                                                  int(time.time() * 1e6)))
+            self.frames += 1
+
+
+    def tap(self, pose):
+        """Wrap a pose backend so its results are recorded (landmark recordings)."""
+
+        if self._tap is None or self._tap.pose is not pose:
+            self._tap = _TapPose(pose, self)
+
+        return self._tap
+
+
+    def segments(self):
+        return self.store.segments(self.path)
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.kind == 'video':
+            self._queue.put(None)
+            self._thread.join()
+        else:
+            with self._lock:
+                self._close_segment()
+
+
+
+class RecordingStore:
+    """Directory of recordings with a total quota, per-recording rotation and age-based cleanup."""
+
+    def __init__(self, root=None, quota_bytes=None, session_quota_bytes=None, retention=RETENTION_SECONDS):
+        self.root = root or os.environ.get(RECORDING_DIR_ENV, DEFAULT_RECORDING_DIR)
+        self.quota_bytes = quota_bytes or int(float(os.environ.get(QUOTA_ENV, DEFAULT_QUOTA_MB)) * (1 << 20))
+        self.session_quota_bytes = session_quota_bytes or int(self.quota_bytes * SESSION_QUOTA_SHARE)
+        self.retention = retention
+
+        # Segments being written, never removed by the quota.
+        self.active = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+
+
+    def open(self, session_id, kind='video', segment_seconds=SEGMENT_SECONDS, **metadata):
+        """
+        Start a recording.
+
+        Args:
+            session_id: The page session, part of the recording id.
+            kind: 'video' or 'landmarks'.
+            segment_seconds: Length of a segment.
+            **metadata: Stored in the manifest, e.g. mode and flip_frame,
+                which render() needs for landmark recordings.
+
+        Returns:
+            A LiveRecording.
+        """
+
+        if kind not in KINDS:
+            raise ValueError(f'unknown recording kind {kind!r}, expected one of {sorted(KINDS)}')
+
+        self.cleanup()
+
+        recording_id = f'{session_id}-{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}'
+        path = os.path.join(self.root, recording_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, MANIFEST), 'w') as file:
+            json.dump(dict(metadata, session=session_id, kind=kind, started=time.time()), file)
+
+        return LiveRecording(self, path, kind, segment_seconds)
+
+
+    def manifest(self, path):
+        with open(os.path.join(path, MANIFEST)) as file:
+            return json.load(file)
+
+
+    def segments(self, path):
+        """Finished segments of a recording, oldest first."""
+
+        names = [name for name in os.listdir(path) if '.part' not in name and _segment_index(name) is not None]
+
+        return [os.path.join(path, name) for name in sorted(names, key=_segment_index)]
+
+
+    def _segment_files(self):
+        entries = []
+
+        for recording_id in os.listdir(self.root):
+            path = os.path.join(self.root, recording_id)
+            if not os.path.isdir(path):
+                continue
+            for name in os.listdir(path):
+                segment = os.path.join(path, name)
+                if _segment_index(name) is None:
+                    continue
+                try:
+                    stat = os.stat(segment)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, segment, path))
+
+        return entries
+
+
+    def enforce_quota(self, recording=None):
+        """Rotate out the oldest segments of a recording over session_quota_bytes, then globally over quota_bytes."""
+
+        with self._lock:
+            entries = sorted(self._segment_files())
+
+            if recording is not None:
+                own = [entry for entry in entries if entry[3] == recording.path]
+                total = sum(size for _, size, _, _ in own)
+                # The newest finished segment always stays.
+                for entry in own[:-1]:
+                    if total <= self.session_quota_bytes:
+                        break
+                    if entry[2] not in self.active:
+                        self._remove(entry[2])
+                        entries.remove(entry)
+                        total -= entry[1]
+
+            total = sum(size for _, size, _, _ in entries)
+            for _, size, segment, _ in entries:
+                if total <= self.quota_bytes:
+                    break
+                if segment not in self.active:
+                    self._remove(segment)
+                    total -= size
+
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def cleanup(self, now=None):
+        """Remove recordings not written to for longer than the retention period."""
+
+        now = time.time() if now is None else now
+        active_dirs = {os.path.dirname(segment) for segment in self.active}
+
+        for recording_id in os.listdir(self.root):
+            path = os.path.join(self.root, recording_id)
+            if path in active_dirs or not os.path.isdir(path):
+                continue
+            try:
+                modified = max(os.stat(os.path.join(path, name)).st_mtime for name in os.listdir(path))
+            except (OSError, ValueError):
+                modified = 0
+            if now - modified > self.retention:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+    def delete(self, recording):
+        shutil.rmtree(recording.path, ignore_errors=True)
+
+
+    def export(self, recording, output_path, thresholds=None):
+        """
+        Write the finished segments of a recording as one mp4.
+
+        Video segments are concatenated; landmark recordings are re-rendered
+        with a fresh ProcessFrame (thresholds default to the manifest's mode)
+        onto a plain background.
+
+        Returns:
+            The number of frames written.
+        """
+
+        if recording.kind == 'landmarks':
+            return self._render(recording, output_path, thresholds)
+
+        writer = None
+        frames = 0
+        try:
+            for segment in recording.segments():
+                capture = cv2.VideoCapture(segment)
+                try:
+                    while True:
+                        ok, frame = capture.read()
+                        if not ok:
+                            break
+                        if writer is None:
+                            height, width = frame.shape[:2]
+                            writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                                     capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS, (width, height))
+                        writer.write(frame)
+                        frames += 1
+                finally:
+                    capture.release()
+        finally:
+            if writer is not None:
+                writer.release()
+
+        return frames
+
+
+    def _render(self, recording, output_path, thresholds):
+        # Imported here: recording itself does not need the analysis pipeline.
+        from process_frame import ProcessFrame
+        from thresholds import get_thresholds_beginner, get_thresholds_pro
+
+        manifest = self.manifest(recording.path)
+        if thresholds is None:
+            thresholds = get_thresholds_pro() if manifest.get('mode', 'beginner').lower() == 'pro' \
+                else get_thresholds_beginner()
+        process_frame = ProcessFrame(thresholds=thresholds, flip_frame=manifest.get('flip_frame', False))
+
+        decoded = []
+        for segment in recording.segments():
+            decoder = LandmarkDecoder()
+            with open(segment, 'rb') as file:
+                decoded.extend(decoder.decode(packet) for packet in split_packets(file.read()))
+
+        if not decoded:
+            return 0
+
+        timestamps = np.array([packet['timestamp_us'] for packet in decoded], dtype=np.float64)
+        intervals = np.diff(timestamps)
+        fps = 1e6 / np.median(intervals) if len(intervals) and np.median(intervals) > 0 else DEFAULT_FPS
+
+        width, height = decoded[0]['width'], decoded[0]['height']
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), min(fps, 60.0), (width, height))
+        canvas = np.empty((height, width, 3), dtype=np.uint8)
+
+        try:
+            for packet in decoded:
+                canvas[...] = 32
+                result = process_frame.analyze(landmarks_to_result(packet['landmarks']), width, height)
+                frame = process_frame.draw(canvas, result)
+                writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        finally:
+            writer.release()
+
+        return len(decoded)
+
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_recording_store():
+    """Process-wide RecordingStore on SQUAT_RECORDING_DIR."""
+
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = RecordingStore()
+
+    return _store
@@ -0,0 +1,287 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Side-car metrics endpoint, SQUAT_METRICS_PORT=0 disables it. Bound to
+# loopback unless SQUAT_METRICS_HOST says otherwise (e.g. 0.0.0.0 in a container).
+METRICS_PORT_ENV = 'SQUAT_METRICS_PORT'
+METRICS_HOST_ENV = 'SQUAT_METRICS_HOST'
+DEFAULT_METRICS_PORT = 9108
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# A session that has not seen a frame for this long no longer counts as active,
+# and is forgotten entirely after SESSION_EXPIRY.
+SESSION_IDLE_TIMEOUT = 30.0
+SESSION_EXPIRY = 3600.0
+
+# Every 4th LatencyHistogram bucket (one per octave, ~17 us .. ~9 s) is exported.
+EXPORT_BUCKET_STEP = 4
+
+
+class SessionMetrics:
+    """
+    Counters for one live or upload session, updated from the frame callback / loop.
+
+    poses is the number of pose estimator instances the session holds; with an
+    adaptive quality controller its ladder of instances is counted instead.
+    """
+
+    def __init__(self, session_id, kind, process_frame, tracer=None, quality=None, poses=1):
+        self.session_id = session_id
+        self.kind = kind
+        self.process_frame = process_frame
+        self.tracer = tracer
+        self.quality = quality
+        self.poses = poses
+
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.in_flight = 0
+        self.created = time.time()
+        self.last_seen = self.created
+
+
+    def frame_started(self):
+        self.frames_received += 1
+        self.in_flight += 1
+        self.last_seen = time.time()
+
+
+    def frame_finished(self):
+        self.in_flight -= 1
+
+
+    def frames_lost(self, count):
+        self.frames_dropped += count
+
+
+    @property
+    def pose_instances(self):
+        return self.quality.instances if self.quality is not None else self.poses
+
+
+    def is_active(self, now):
+        return now - self.last_seen < SESSION_IDLE_TIMEOUT
+
+
+
+class MetricsRegistry:
+    """Process-wide set of sessions and extra collectors rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+
+    def session(self, session_id, kind, process_frame, tracer=None, quality=None, poses=1):
+        """Get or create the metrics of a session; rebinds the ProcessFrame/tracer/controller if rebuilt."""
+
+        with self._lock:
+            metrics = self._sessions.get((session_id, kind))
+            if metrics is None:
+                metrics = self._sessions[session_id, kind] = SessionMetrics(session_id, kind, process_frame,
+                                                                            tracer, quality, poses)
+            else:
+                metrics.process_frame = process_frame
+                metrics.tracer = tracer
+                metrics.quality = quality
+                metrics.poses = poses
+
+        return metrics
+
+
+    def remove_session(self, session_id, kind):
+        with self._lock:
+            self._sessions.pop((session_id, kind), None)
+
+
+    def add_collector(self, collector):
+        """Register a callable returning extra (name, type, help, [(labels, value), ...]) metrics."""
+
+        with self._lock:
+            self._collectors.append(collector)
+
+
+    def _expire(self, now):
+        for key in [key for key, m in self._sessions.items() if now - m.last_seen > SESSION_EXPIRY]:
+            del self._sessions[key]
+
+
+    def collect(self):
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+            sessions = list(self._sessions.values())
+            collectors = list(self._collectors)
+
+        active = [m for m in sessions if m.is_active(now)]
+
+        families = [
+            ('squat_sessions_active', 'gauge', 'Sessions that processed a frame recently.',
+             [({'kind': kind}, sum(1 for m in active if m.kind == kind))
+              for kind in sorted({'live', 'upload'} | {m.kind for m in sessions})]),
+            ('squat_pose_instances_in_use', 'gauge', 'Pose estimator instances held by active sessions.',
+             [({}, sum(m.pose_instances for m in active))]),
+            ('squat_frames_received_total', 'counter', 'Frames handed to the pipeline.',
+             [(self._labels(m), m.frames_received) for m in sessions]),
+            ('squat_frames_processed_total', 'counter', 'Frames fully processed by ProcessFrame.',
+             [(self._labels(m), m.process_frame.timings.frames) for m in sessions]),
+            ('squat_frames_dropped_total', 'counter', 'Frames lost because processing could not keep up.',
+             [(self._labels(m), m.frames_dropped) for m in sessions]),
+            ('squat_frames_in_flight', 'gauge', 'Frames currently inside the frame callback (queue depth).',
+             [(self._labels(m), m.in_flight) for m in sessions]),
+            ('squat_reps', 'gauge', 'Current squat counters per session.',
+             [(dict(self._labels(m), result=result), m.process_frame.state_tracker[key])
+              for m in sessions for result, key in (('correct', 'SQUAT_COUNT'), ('improper', 'IMPROPER_SQUAT'))]),
+            ('squat_processing_fps', 'gauge', 'Smoothed processing frame rate per session.',
+             [(self._labels(m), m.process_frame.timings.fps) for m in sessions]),
+        ]
+
+        traced = [m for m in sessions if m.tracer is not None]
+        families.append(
+            ('squat_live_latency_rolling_seconds', 'gauge', 'Smoothed glass-to-glass latency per session and hop.',
+             [(dict(self._labels(m), hop=hop), seconds) for m in traced for hop, seconds in m.tracer.rolling.items()]))
+
+        adaptive = [m for m in sessions if m.quality is not None]
+        families.extend([
+            ('squat_quality_level', 'gauge', 'Adaptive quality level per session (0 = best), labelled with its mode.',
+             [(dict(self._labels(m), mode=m.quality.mode), m.quality.level) for m in adaptive]),
+            ('squat_quality_changes_total', 'counter', 'Adaptive quality level changes per session.',
+             [(self._labels(m), m.quality.changes) for m in adaptive]),
+        ])
+
+        for collector in collectors:
+            families.extend(collector())
+
+        histograms = [
+            ('squat_stage_latency_seconds', 'ProcessFrame per-stage latency.', 'stage',
+             _merge_histograms(m.process_frame.timings.histograms for m in sessions)),
+            ('squat_live_latency_seconds', 'Live callback latency per hop, from frame receive to send.', 'hop',
+             _merge_histograms(m.tracer.histograms for m in traced)),
+        ]
+
+        return families, histograms
+
+
+    @staticmethod
+    def _labels(metrics):
+        return {'session': metrics.session_id, 'kind': metrics.kind}
+
+
+    def render(self):
+        families, histograms = self.collect()
+        lines = []
+
+        for name, metric_type, help_text, samples in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {float(value):.6g}')
+
+        for name, help_text, label, merged in histograms:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+
+            for key, entry in merged.items():
+                cumulative = 0
+                for idx, bucket_count in enumerate(entry['counts'][:-1]):
+                    cumulative += bucket_count
+                    if idx % EXPORT_BUCKET_STEP == EXPORT_BUCKET_STEP - 1:
+                        le = f"{entry['buckets'][idx]:.6g}"
+                        lines.append(f'{name}_bucket{_format_labels({label: key, "le": le})} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels({label: key, "le": "+Inf"})} {entry["count"]}')
+                lines.append(f'{name}_sum{_format_labels({label: key})} {entry["sum"]:.6g}')
+                lines.append(f'{name}_count{_format_labels({label: key})} {entry["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+
+def _merge_histograms(histogram_sets):
+    """Sum LatencyHistograms with the same key across sessions."""
+
+    merged = {}
+
+    for histograms in histogram_sets:
+        for key, histogram in histograms.items():
+            entry = merged.setdefault(key, {'buckets': histogram.buckets, 'counts': [0] * len(histogram.counts),
+                                            'count': 0, 'sum': 0.0})
+            entry['counts'] = [a + b for a, b in zip(entry['counts'], histogram.counts)]
+            entry['count'] += histogram.count
+            entry['sum'] += histogram.total
+
+    return merged
+
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels.items())
+
+    return '{' + ','.join(escaped) + '}'
+
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Start the metrics HTTP server once per process (subsequent calls are no-ops).
+
+    Returns the server, or None when disabled or the port is already taken by
+    another process.
+    """
+
+    global _server
+
+    if port is None:
+        port = int(os.environ.get(METRICS_PORT_ENV, DEFAULT_METRICS_PORT))
+
+    if host is None:
+        host = os.environ.get(METRICS_HOST_ENV, DEFAULT_METRICS_HOST)
+
+    if port <= 0:
+        return None
+
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                return None
+
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+
+    return _server
@@ -3,7 +3,7 @@ import numpy as np
 
 def draw_mpjpe_results(frame, mpjpe_value, joint_errors, position=(30, 60), 
                       overall_color=(0, 255, 0), joint_colors=None, font_scale=0.6,
-                      add_background=True):
+                      add_background=True, in_place=False):
     """
     Draw MPJPE evaluation results on the frame
     
@@ -16,12 +16,13 @@ def draw_mpjpe_results(frame, mpjpe_value, joint_errors, position=(30, 60),
         joint_colors: Dictionary of colors for each joint
         font_scale: Font scale for text
         add_background: Whether to add a semi-transparent background behind text
+        in_place: Draw directly on the given frame instead of a copy
     
     Returns:
         Frame with MPJPE visualization
     """
-    # Create a copy of the frame
-    result_frame = frame.copy()
+    # Create a copy of the frame unless drawing in place
+    result_frame = frame if in_place else frame.copy()
     
     # Set default colors if not provided
     if joint_colors is None:
@@ -58,13 +59,16 @@ def draw_mpjpe_results(frame, mpjpe_value, joint_errors, position=(30, 60),
         panel_height = text_size[1] + (len(joint_errors) * 30) + 10
         panel_width = max(text_size[0], 200) + 20
         
-        overlay = result_frame.copy()
-        cv2.rectangle(overlay, (x-5, y-text_size[1]-5), 
-                     (x+panel_width, y+panel_height), 
-                     (0, 0, 0), -1)
-        # Apply overlay with transparency
+        frame_height, frame_width = result_frame.shape[:2]
+        x1, y1 = max(x - 5, 0), max(y - text_size[1] - 5, 0)
+        x2, y2 = min(x + panel_width, frame_width - 1), min(y + panel_height, frame_height - 1)
+
+        # Blending with a black panel only darkens the panel region, so apply
+        # the transparency to that region alone instead of a full-frame overlay.
         alpha = 0.6
-        cv2.addWeighted(overlay, alpha, result_frame, 1-alpha, 0, result_frame)
+        if x2 >= x1 and y2 >= y1:
+            panel = result_frame[y1:y2+1, x1:x2+1]
+            cv2.addWeighted(panel, 1-alpha, panel, 0, 0, panel)
     
     # Draw overall MPJPE value
     cv2.putText(result_frame, text, (x, y), 
@@ -84,7 +88,8 @@ def draw_mpjpe_results(frame, mpjpe_value, joint_errors, position=(30, 60),
 
 
 def visualize_mpjpe_comparison(frame, prediction_landmarks, ground_truth_landmarks, 
-                              target_landmarks=None, line_color=(0, 0, 255), line_thickness=2):
+                              target_landmarks=None, line_color=(0, 0, 255), line_thickness=2,
+                              in_place=False):
     """
     Visualize the difference between predicted landmarks and ground truth landmarks
     
@@ -95,6 +100,7 @@ def visualize_mpjpe_comparison(frame, prediction_landmarks, ground_truth_landmar
         target_landmarks: Dictionary or list of target landmark indices
         line_color: Color for the error lines
         line_thickness: Thickness for the error lines
+        in_place: Draw directly on the given frame instead of a copy
     
     Returns:
         Frame with visualization of prediction errors
@@ -110,8 +116,8 @@ def visualize_mpjpe_comparison(frame, prediction_landmarks, ground_truth_landmar
             'foot': 31
         }
     
-    # Create a copy of the frame
-    result_frame = frame.copy()
+    # Create a copy of the frame unless drawing in place
+    result_frame = frame if in_place else frame.copy()
     
     # Draw lines between predicted and ground truth landmarks
     for joint_name, landmark_id in target_landmarks.items():
@@ -0,0 +1,321 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils import draw_text
+from process_frame import ProcessFrame
+from pose_backends import PoseResult, MultiPoseLandmarker
+from frame_buffers import FrameBufferPool
+from instrumentation import StageTimings
+
+
+# PoseLandmarker .task model for the multi-person backend.
+POSE_MODEL_ENV = 'SQUAT_POSE_LANDMARKER_MODEL'
+DEFAULT_POSE_MODEL = 'pose_landmarker_full.task'
+
+# Landmarks below this visibility are left out of a person's bounding box.
+BOX_VISIBILITY = 0.5
+
+# Track colors in RGB, cycled by track id.
+TRACK_COLORS = (
+    (0, 255, 127),
+    (255, 153, 0),
+    (102, 204, 255),
+    (255, 0, 255),
+    (255, 255, 0),
+    (255, 80, 80),
+)
+
+# Per-athlete counters summed into the processor's state_tracker.
+COUNTER_KEYS = ('SQUAT_COUNT', 'IMPROPER_SQUAT', 'SQUAT_TOTAL', 'IMPROPER_TOTAL')
+
+_NO_POSE = PoseResult()
+
+
+def get_multi_pose(model_path=None, num_poses=4):
+    """Multi-person pose backend, model from SQUAT_POSE_LANDMARKER_MODEL by default."""
+
+    return MultiPoseLandmarker(model_path or os.environ.get(POSE_MODEL_ENV, DEFAULT_POSE_MODEL), num_poses=num_poses)
+
+
+
+def pose_box(result):
+    """Normalized (x0, y0, x1, y1) bounding box of a pose result's (visible) landmarks."""
+
+    points = np.array([(lm.x, lm.y, lm.visibility if lm.visibility is not None else 1.0)
+                       for lm in result.pose_landmarks.landmark], dtype=np.float64)
+
+    visible = points[points[:, 2] >= BOX_VISIBILITY]
+    if len(visible) < 2:
+        visible = points
+
+    return np.array([visible[:, 0].min(), visible[:, 1].min(), visible[:, 0].max(), visible[:, 1].max()])
+
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of two (N, 4) and (M, 4) box arrays, shape (N, M)."""
+
+    x0 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y0 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x1 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y1 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+
+    intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+
+class AthleteTracker:
+    """
+    Assigns stable ids to per-frame person detections.
+
+    Detections are matched to tracks greedily by bounding box IoU, then any
+    left over by centroid distance (normalized image units). Unmatched
+    detections start new tracks; a track survives max_missed frames without
+    a match, so short occlusions keep their id.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_distance=0.1, max_missed=30):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+
+        # track id -> {'box': array, 'missed': frames without a match}
+        self.tracks = {}
+        self._next_id = 1
+
+
+    def _match(self, track_ids, boxes):
+        pairs = {}
+        if not track_ids or not len(boxes):
+            return pairs
+
+        track_boxes = np.stack([self.tracks[tid]['box'] for tid in track_ids])
+
+        iou = box_iou(track_boxes, boxes)
+        for t, d in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+            if iou[t, d] < self.iou_threshold:
+                break
+            if t not in pairs and d not in pairs.values():
+                pairs[t] = d
+
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        distance = np.linalg.norm(track_centers[:, None] - centers[None], axis=2)
+        for t, d in zip(*np.unravel_index(np.argsort(distance, axis=None), distance.shape)):
+            if distance[t, d] > self.max_distance:
+                break
+            if t not in pairs and d not in pairs.values():
+                pairs[t] = d
+
+        return {track_ids[t]: d for t, d in pairs.items()}
+
+
+    def update(self, boxes):
+        """
+        Match one frame's detections.
+
+        Args:
+            boxes: (N, 4) normalized bounding boxes of the detections.
+
+        Returns:
+            (ids, removed): the track id of every detection, and the ids of
+            tracks dropped after max_missed frames without a match.
+        """
+
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        matches = self._match(list(self.tracks), boxes)
+
+        ids = [None] * len(boxes)
+        for tid, d in matches.items():
+            self.tracks[tid] = {'box': boxes[d], 'missed': 0}
+            ids[d] = tid
+
+        removed = []
+        for tid, track in list(self.tracks.items()):
+            if tid not in matches:
+                track['missed'] += 1
+                if track['missed'] > self.max_missed:
+                    del self.tracks[tid]
+                    removed.append(tid)
+
+        for d in range(len(boxes)):
+            if ids[d] is None:
+                ids[d] = self._next_id
+                self.tracks[self._next_id] = {'box': boxes[d], 'missed': 0}
+                self._next_id += 1
+
+        return ids, removed
+
+
+
+class MultiAthleteProcessor:
+    """
+    Squat analysis of several people in one frame from a single inference pass.
+
+    The multi-person pose backend (pose_backends.MultiPoseLandmarker) runs once
+    per frame; AthleteTracker keeps ids stable across frames and every track
+    gets its own ProcessFrame, so rep state machines, counters and inactivity
+    timers are independent. A track missing from a frame is analyzed as
+    "no person" so its inactivity handling matches the single-person mode.
+
+    Mirrors the ProcessFrame interface used by the pages and servers:
+    process(frame, pose) -> (frame, play_sound), timings and an aggregated
+    state_tracker.
+    """
+
+    def __init__(self, thresholds, flip_frame=False, max_athletes=None, tracker=None, show_hud=False):
+        self.thresholds = thresholds
+        self.flip_frame = flip_frame
+        self.max_athletes = max_athletes
+        self.tracker = tracker or AthleteTracker()
+        self.show_hud = show_hud
+
+        self.timings = StageTimings()
+        self.buffer_pool = FrameBufferPool()
+        self.athletes = {}
+        self.last_results = {}
+        self.mpjpe_values = []
+        # Counters of athletes whose tracks were removed, so the aggregate keeps their reps.
+        self.departed = dict.fromkeys(COUNTER_KEYS, 0)
+
+
+    @property
+    def state_tracker(self):
+        """Counters summed over all athletes, including those no longer tracked."""
+
+        return {key: self.departed[key] + sum(int(athlete.state_tracker[key]) for athlete in self.athletes.values())
+                for key in COUNTER_KEYS}
+
+
+    def _athlete(self, track_id):
+        athlete = self.athletes.get(track_id)
+        if athlete is None:
+            # Drawing is done here; each ProcessFrame only analyzes.
+            athlete = self.athletes[track_id] = ProcessFrame(thresholds=self.thresholds,
+                                                             buffer_pool=self.buffer_pool)
+
+        return athlete
+
+
+    def process(self, frame, pose):
+        timings = self.timings
+        frame_start = time.perf_counter()
+        frame_height, frame_width, _ = frame.shape
+
+        detections = pose.process(frame)
+        if self.max_athletes is not None:
+            detections = detections[:self.max_athletes]
+
+        inference_end = time.perf_counter()
+        timings.record('inference', inference_end - frame_start)
+        timings.inference_span = (frame_start, inference_end)
+
+        ids, removed = self.tracker.update([pose_box(detection) for detection in detections])
+        for track_id in removed:
+            athlete = self.athletes.pop(track_id, None)
+            if athlete is not None:
+                for key in COUNTER_KEYS:
+                    self.departed[key] += int(athlete.state_tracker[key])
+
+        detection_of = dict(zip(ids, detections))
+        results = {}
+        play_sound = None
+
+        for track_id in self.tracker.tracks:
+            result = self._athlete(track_id).analyze(detection_of.get(track_id, _NO_POSE), frame_width, frame_height)
+            results[track_id] = result
+            play_sound = play_sound or result['play_sound']
+
+        self.last_results = results
+
+        analysis_end = time.perf_counter()
+        timings.record('state', analysis_end - inference_end)
+
+        frame = self.draw(frame, results)
+        timings.record('drawing', time.perf_counter() - analysis_end)
+        timings.end_frame(time.perf_counter() - frame_start)
+
+        return frame, play_sound
+
+
+    def _draw_skeleton(self, frame, athlete, result, color):
+        coords = result['coords']
+        features = athlete.left_features if result['use_left'] else athlete.right_features
+        points = [tuple(int(v) for v in coords[idx]) for idx in features.values()]
+
+        # shoulder-elbow-wrist, shoulder-hip-knee-ankle-foot
+        for a, b in ((0, 1), (1, 2), (0, 3), (3, 4), (4, 5), (5, 6)):
+            cv2.line(frame, points[a], points[b], color, 3, lineType=cv2.LINE_AA)
+        for point in points:
+            cv2.circle(frame, point, 5, color, -1, lineType=cv2.LINE_AA)
+
+
+    def draw(self, frame, results):
+        """Per-athlete skeleton and a HUD label (id, counters, state, feedback) above each person."""
+
+        frame_height, frame_width, _ = frame.shape
+        labels = []
+
+        for track_id, result in results.items():
+            if not result['detected']:
+                continue
+
+            athlete = self.athletes[track_id]
+            color = TRACK_COLORS[track_id % len(TRACK_COLORS)]
+            if result['aligned']:
+                self._draw_skeleton(frame, athlete, result, color)
+
+            x0, y0 = result['coords'].min(axis=0)
+            x1 = result['coords'][:, 0].max()
+            x = int(frame_width - x1) if self.flip_frame else int(x0)
+
+            lines = [f"#{track_id}  {athlete.state_tracker['SQUAT_COUNT']} / {athlete.state_tracker['IMPROPER_SQUAT']}"]
+            if not result['aligned']:
+                lines.append('NOT ALIGNED')
+            else:
+                lines.append(f"State: {result['state']}")
+                lines.extend(athlete.FEEDBACK_ID_MAP[idx][0] for idx in result['feedback_ids'])
+                if result['lower_hips']:
+                    lines.append('LOWER YOUR HIPS')
+
+            labels.append((max(x, 10), max(int(y0) - 30 * len(lines), 20), lines, color))
+
+        if self.flip_frame:
+            frame = cv2.flip(frame, 1, dst=frame)
+
+        # Text after the flip so it stays readable.
+        for x, y, lines, color in labels:
+            for idx, line in enumerate(lines):
+                draw_text(frame, line, pos=(x + 20, y + 30 * idx), text_color=(255, 255, 230), font_scale=0.5,
+                          font_thickness=1, text_color_bg=color if idx == 0 else (40, 40, 40))
+
+        if self.show_hud:
+            stats = self.timings.summary()
+            cv2.putText(frame, f"{stats['fps']:.1f} FPS | {stats['total_ms']:.1f} ms | {len(results)} athletes",
+                        (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1, lineType=cv2.LINE_AA)
+
+        return frame
+
+
+    def athlete_stats(self):
+        return [{'athlete': track_id,
+                 'SQUAT_COUNT': int(athlete.state_tracker['SQUAT_COUNT']),
+                 'IMPROPER_SQUAT': int(athlete.state_tracker['IMPROPER_SQUAT']),
+                 'state': athlete.state_tracker['curr_state'],
+                 'missed_frames': self.tracker.tracks[track_id]['missed']}
+                for track_id, athlete in self.athletes.items()]
+
+
+    def get_stats(self):
+        stats = self.timings.stats()
+        stats['athletes'] = self.athlete_stats()
+
+        return stats
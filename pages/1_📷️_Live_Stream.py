@@ -1,9 +1,11 @@
 import av
 import os
 import sys
+import time
+import uuid
+import tempfile
 import streamlit as st
 from streamlit_webrtc import VideoHTMLAttributes, webrtc_streamer
-from aiortc.contrib.media import MediaRecorder
 
 
 BASE_DIR = os.path.abspath(os.path.join(__file__, '../../'))
@@ -13,6 +15,15 @@ sys.path.append(BASE_DIR)
 from utils import get_mediapipe_pose
 from process_frame import ProcessFrame
 from thresholds import get_thresholds_beginner, get_thresholds_pro
+from frame_buffers import video_frame_view
+from profiling import ProfileTrigger, requested_profile_seconds
+from metrics import REGISTRY, start_metrics_server
+from instrumentation import LatencyTracer
+from adaptive_quality import QualityController
+from pose_workers import get_worker_pool
+from session_history import SessionRecorder
+from session_artifacts import get_artifact_store, POSE_NBYTES
+from live_recording import get_recording_store
 
 
 st.title('Live Fitness Vision : V-Squat Analysis')
@@ -58,6 +69,30 @@ else:
     show_comparison = False
     display_mpjpe = False
 
+athlete = st.text_input('Athlete', value='', help="Name the session is saved under in the history (optional)")
+
+show_hud = st.checkbox('Show FPS/Latency HUD', value=False,
+                       help="Overlay the processing frame rate and per-frame latency on the video")
+
+col1_rec, col2_rec = st.columns(2)
+with col1_rec:
+    record_session = st.checkbox('Record Session', value=True,
+                                 help="Keep the annotated stream for download (rolling segments, oldest dropped "
+                                      "beyond the recording quota)")
+with col2_rec:
+    recording_kind = st.radio('Recording', ['Video', 'Landmarks only'], horizontal=True,
+                              disabled=not record_session,
+                              help="Landmarks only stores a few hundred bytes per frame and renders the video "
+                                   "when it is downloaded (video is recorded when pose workers are enabled)")
+
+col1_quality, col2_quality = st.columns(2)
+with col1_quality:
+    adaptive_quality = st.checkbox('Adaptive Quality', value=False,
+                                   help="Lower pose model complexity, inference resolution, MPJPE overlay and "
+                                        "inference rate when frames take longer than the target frame rate allows")
+with col2_quality:
+    target_fps = st.slider('Target FPS', min_value=5, max_value=30, value=20, disabled=not adaptive_quality)
+
 thresholds = None 
 
 if mode == 'Beginner':
@@ -67,29 +102,145 @@ elif mode == 'Pro':
     thresholds = get_thresholds_pro()
 
 
-live_process_frame = ProcessFrame(thresholds=thresholds, flip_frame=True, 
-                                  evaluate_mpjpe=enable_mpjpe, 
-                                  visualize_comparison=show_comparison,
-                                  display_mpjpe=display_mpjpe)
-# Initialize face mesh solution
-pose = get_mediapipe_pose()
+# Keep the processor across reruns so counters and timing stats survive
+# widget interactions; only rebuild it when the analysis settings change.
+live_settings = (mode, enable_mpjpe, show_comparison, display_mpjpe)
+
+# With SQUAT_POSE_WORKERS set, pose inference and ProcessFrame run in worker
+# processes and live_process_frame is a RemoteSession standing in for it.
+worker_pool = get_worker_pool()
+
+if 'metrics_session_id' not in st.session_state:
+    st.session_state['metrics_session_id'] = uuid.uuid4().hex[:12]
+
+# The session's pose is kept in the shared artifact store (budgeted, closed when
+# the session goes idle) rather than recreated on every rerun.
+artifacts = get_artifact_store()
+artifacts.touch(st.session_state['metrics_session_id'])
+
+# Every stretch of streaming (start to stop, or until the settings change) is
+# saved as one session in the history store.
+if 'history_recorder' not in st.session_state:
+    st.session_state['history_recorder'] = SessionRecorder(mode, 'live')
+history_recorder = st.session_state['history_recorder']
+history_recorder.user = athlete or None
+
+if st.session_state.get('live_settings') != live_settings:
+    previous = st.session_state.pop('live_process_frame', None)
+    if previous is not None:
+        history_recorder.checkpoint(previous)
+    if previous is not None and hasattr(previous, 'close'):
+        previous.close()
+
+    if worker_pool is not None:
+        st.session_state['live_process_frame'] = worker_pool.open_session(thresholds, flip_frame=True,
+                                                                          evaluate_mpjpe=enable_mpjpe,
+                                                                          visualize_comparison=show_comparison,
+                                                                          display_mpjpe=display_mpjpe)
+    else:
+        st.session_state['live_process_frame'] = ProcessFrame(thresholds=thresholds, flip_frame=True, 
+                                                              evaluate_mpjpe=enable_mpjpe, 
+                                                              visualize_comparison=show_comparison,
+                                                              display_mpjpe=display_mpjpe)
+    st.session_state['live_settings'] = live_settings
+    history_recorder.mode = mode
+    history_recorder.start(None)
+
+live_process_frame = st.session_state['live_process_frame']
+live_process_frame.show_hud = show_hud
+
+if adaptive_quality:
+    # The controller owns the pose instances and swaps them as it changes level;
+    # the store closes them with the session.
+    quality = artifacts.get(st.session_state['metrics_session_id'], 'quality_controller')
+    if quality is None:
+        quality = QualityController(get_mediapipe_pose, target_fps=target_fps)
+        # Holds up to one pose per model complexity.
+        complexities = {level['model_complexity'] for level in quality.levels}
+        artifacts.put(st.session_state['metrics_session_id'], 'quality_controller', quality,
+                      nbytes=POSE_NBYTES * len(complexities), pinned=True, close=quality.close)
+
+    quality.set_target_fps(target_fps)
+    quality.apply(live_process_frame)
+    pose = None
+else:
+    quality = None
+    artifacts.discard(st.session_state['metrics_session_id'], 'quality_controller')
+    live_process_frame.mpjpe_overlay = True
+    live_process_frame.quality_mode = None
+    # Initialize face mesh solution (worker sessions own their pose)
+    pose = None
+    if worker_pool is None:
+        pose = artifacts.get(st.session_state['metrics_session_id'], 'pose')
+        if pose is None:
+            pose = get_mediapipe_pose()
+            artifacts.put(st.session_state['metrics_session_id'], 'pose', pose, nbytes=POSE_NBYTES, pinned=True,
+                          close=pose.close)
 
 
-if 'download' not in st.session_state:
-    st.session_state['download'] = False
+# Per-session recordings in rolling segments under SQUAT_RECORDING_DIR. The frame
+# callback reads the active recording from the slot, which is swapped on start/stop.
+recording_store = get_recording_store()
 
-output_video_file = f'output_live.flv'
+if 'live_recording_slot' not in st.session_state:
+    st.session_state['live_recording_slot'] = {'recording': None, 'last': None}
+recording_slot = st.session_state['live_recording_slot']
 
-  
+# Operator-only sampling profiler for this session (hidden ?profile=<seconds>).
+if 'profile_trigger' not in st.session_state:
+    st.session_state['profile_trigger'] = ProfileTrigger(requested_profile_seconds(st.query_params), label='live')
 
-def video_frame_callback(frame: av.VideoFrame):
-    frame = frame.to_ndarray(format="rgb24")  # Decode and get RGB frame
-    frame, _ = live_process_frame.process(frame, pose)  # Process frame
-    return av.VideoFrame.from_ndarray(frame, format="rgb24")  # Encode and return BGR frame
+profile_trigger = st.session_state['profile_trigger']
+
+# Prometheus-format counters for this session, scraped from SQUAT_METRICS_PORT.
+start_metrics_server()
+
+# Receive -> inference -> send timestamps per frame, keyed on the frame PTS.
+if 'latency_tracer' not in st.session_state:
+    st.session_state['latency_tracer'] = LatencyTracer()
+
+latency_tracer = st.session_state['latency_tracer']
+
+session_metrics = REGISTRY.session(st.session_state['metrics_session_id'], 'live', live_process_frame,
+                                   tracer=latency_tracer, quality=quality)
 
+  
 
-def out_recorder_factory() -> MediaRecorder:
-        return MediaRecorder(output_video_file)
+def video_frame_callback(frame: av.VideoFrame):
+    received = time.perf_counter()
+    pts, time_base = frame.pts, frame.time_base
+
+    profile_trigger.maybe_start()  # No-op unless a capture was requested
+    session_metrics.frame_started()
+    artifacts.touch(session_metrics.session_id)  # Streaming keeps the session's artifacts alive
+
+    try:
+        frame = frame.reformat(format="rgb24")  # Decode to an RGB av frame
+        view = video_frame_view(frame)  # Writable view onto its pixels, no copy
+        # Workers follow the controller's mode themselves, only local processing needs its pose.
+        current_pose = quality.pose if quality is not None and worker_pool is None else pose
+        recording = recording_slot['recording']
+        if recording is not None and recording.kind == 'landmarks':
+            current_pose = recording.tap(current_pose)
+        out_frame, _ = live_process_frame.process(view, current_pose)  # Process frame in place
+
+        if out_frame is not view:
+            view[...] = out_frame
+        if recording is not None and recording.kind == 'video':
+            recording.write(view)
+    finally:
+        session_metrics.frame_finished()
+
+    frame.pts, frame.time_base = pts, time_base
+    sent = time.perf_counter()
+    inference_start, inference_end = live_process_frame.timings.inference_span
+    dropped = latency_tracer.trace(pts, time_base, received, inference_start, inference_end, sent)
+    session_metrics.frames_lost(dropped)
+
+    if quality is not None and quality.observe(sent - received):
+        quality.apply(live_process_frame)
+
+    return frame
 
 
 ctx = webrtc_streamer(
@@ -97,10 +248,32 @@ ctx = webrtc_streamer(
                         video_frame_callback=video_frame_callback,
                         rtc_configuration={"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]},  # Add this config
                         media_stream_constraints={"video": {"width": {'min':480, 'ideal':480}}, "audio": False},
-                        video_html_attrs=VideoHTMLAttributes(autoPlay=True, controls=False, muted=False),
-                        out_recorder_factory=out_recorder_factory
+                        video_html_attrs=VideoHTMLAttributes(autoPlay=True, controls=False, muted=False)
                     )
 
+if ctx.state.playing != st.session_state.get('live_was_playing', False):
+    if ctx.state.playing:
+        history_recorder.start(live_process_frame)
+        if record_session:
+            # Landmarks need the pose results, which stay in the worker processes with pose workers.
+            kind = 'landmarks' if recording_kind == 'Landmarks only' and worker_pool is None else 'video'
+            recording = recording_store.open(st.session_state['metrics_session_id'], kind, mode=mode,
+                                             flip_frame=True)
+            # No rerun sees the stream stop when the tab is closed; the store then
+            # closes the recording (and finishes its segment) when the session expires.
+            artifacts.put(st.session_state['metrics_session_id'], 'recording', recording, pinned=True,
+                          close=recording.close)
+            recording_slot['recording'] = recording
+    else:
+        history_recorder.checkpoint(live_process_frame)
+        recording, recording_slot['recording'] = recording_slot['recording'], None
+        if recording is not None:
+            # Closes the recording.
+            artifacts.discard(st.session_state['metrics_session_id'], 'recording')
+            recording_slot['last'] = recording
+            artifacts.discard(st.session_state['metrics_session_id'], 'recording_export')
+    st.session_state['live_was_playing'] = ctx.state.playing
+
 # Display real-time MPJPE value if streaming and evaluation is enabled
 if ctx.state.playing and enable_mpjpe:
     st.markdown("### MPJPE Over Time")
@@ -155,21 +328,56 @@ if ctx.state.playing and enable_mpjpe:
         """, unsafe_allow_html=True)
 
 
-download_button = st.empty()
-
-if os.path.exists(output_video_file):
-    with open(output_video_file, 'rb') as op_vid:
-        download = download_button.download_button('Download Video', data = op_vid, file_name='output_live.flv')
-
-        if download:
-            st.session_state['download'] = True
-
-
-
-if os.path.exists(output_video_file) and st.session_state['download']:
-    os.remove(output_video_file)
-    st.session_state['download'] = False
-    download_button.empty()
+# Per-stage timings recorded by ProcessFrame inside the live callback
+if ctx.state.playing:
+    with st.expander('Pipeline Stats'):
+        st.button('Refresh Stats')
+
+        stats = live_process_frame.get_stats()
+        st.caption(f"{stats['frames']} frames | {stats['fps']:.1f} FPS | {stats['latency_ms']:.1f} ms per frame")
+
+        if quality is not None:
+            quality_stats = quality.stats()
+            st.caption(f"Quality: {quality_stats['mode']} | {quality_stats['latency_ms']:.1f} ms smoothed / "
+                       f"{quality_stats['budget_ms']:.1f} ms budget | {quality_stats['changes']} changes")
+        st.table([{'stage': stage, **{k: round(v, 2) for k, v in snapshot.items()}}
+                  for stage, snapshot in stats['stages'].items()])
+
+        trace = latency_tracer.stats()
+        st.caption(f"Glass-to-glass: {trace['frames']} frames traced | {trace['dropped']} dropped | "
+                   f"{trace['frame_interval_ms']:.1f} ms frame interval")
+        st.table([{'hop': hop, **{k: round(v, 2) for k, v in snapshot.items()}}
+                  for hop, snapshot in trace['hops'].items()])
+
+
+if profile_trigger.profiler is not None:
+    state = 'running' if profile_trigger.profiler.is_running() else 'written'
+    st.caption(f"Profile ({state}): {profile_trigger.profiler.output_path}")
+
+
+# The download is assembled from the finished segments of the last recording
+# (re-rendered for landmark recordings) when asked for, then kept in the artifact store.
+last_recording = recording_slot['last']
+
+if last_recording is not None and not ctx.state.playing and last_recording.segments():
+    export = artifacts.get(st.session_state['metrics_session_id'], 'recording_export')
+
+    if export is None and st.button('Prepare Recording for Download'):
+        with st.spinner("Preparing recording..."):
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
+                export_path = temp_file.name
+            try:
+                recording_store.export(last_recording, export_path)
+                with open(export_path, 'rb') as file:
+                    export = artifacts.put(st.session_state['metrics_session_id'], 'recording_export', file.read())
+            finally:
+                os.unlink(export_path)
+
+    if export is not None:
+        st.download_button('Download Video', data=export, file_name=f'{last_recording.recording_id}.mp4',
+                           mime='video/mp4')
+    if last_recording.dropped:
+        st.caption(f"{last_recording.dropped} frames were not recorded because the writer fell behind.")
 
 
     
@@ -1,6 +1,9 @@
 import os
 import sys
+import time
+import uuid
 import streamlit as st
+import streamlit.components.v1 as components
 import cv2
 import tempfile
 import numpy as np
@@ -9,10 +12,23 @@ import numpy as np
 BASE_DIR = os.path.abspath(os.path.join(__file__, '../../'))
 sys.path.append(BASE_DIR)
 
+# Seconds between status refreshes of a background job.
+JOB_POLL_INTERVAL = 1.0
 
-from utils import get_mediapipe_pose
+# Frames between checks for the first published segment of the progressive output.
+PLAYER_CHECK_FRAMES = 10
+
+
+from utils import get_mediapipe_pose, encode_preview, spool_upload, remove_upload
 from process_frame import ProcessFrame
 from thresholds import get_thresholds_beginner, get_thresholds_pro
+from video_pipeline import open_video, iter_processed_frames
+from profiling import ProfileTrigger, requested_profile_seconds
+from metrics import REGISTRY, start_metrics_server
+from job_queue import JobQueue
+from session_history import get_history, session_record
+from session_artifacts import get_artifact_store
+from progressive_output import HlsWriter, ffmpeg_available, player_html
 
 
 
@@ -38,6 +54,26 @@ else:
     show_comparison = False
     display_mpjpe = False
 
+# Preview settings are independent of processing: every frame is analysed,
+# only a throttled, downscaled JPEG is sent to the browser.
+with st.expander('Preview Settings'):
+    col1_prev, col2_prev = st.columns(2)
+    with col1_prev:
+        preview_fps = st.slider('Preview FPS', min_value=0, max_value=30, value=5,
+                                help="How often the preview is refreshed while processing (0 disables it)")
+    with col2_prev:
+        preview_width = st.select_slider('Preview Width (px)', options=[240, 360, 480, 640, 960], value=480)
+
+athlete = st.text_input('Athlete', value='', help="Name the session is saved under in the history (optional)")
+
+progressive = st.checkbox('Play while processing', value=ffmpeg_available(), disabled=not ffmpeg_available(),
+                          help="Stream the annotated video as it is processed (needs ffmpeg); the download is "
+                               "ready as soon as processing ends")
+
+run_in_background = st.checkbox('Process in background', value=False,
+                                help="Queue the video for the job workers (python job_queue.py worker) instead of "
+                                     "processing it in this page; progress survives a page refresh")
+
 thresholds = None 
 
 if mode == 'Beginner':
@@ -48,16 +84,18 @@ elif mode == 'Pro':
 
 
 
-upload_process_frame = ProcessFrame(thresholds=thresholds, evaluate_mpjpe=enable_mpjpe,
-                                   visualize_comparison=show_comparison,
-                                   display_mpjpe=display_mpjpe)
+# Shared with the job workers through SQUAT_JOB_DIR.
+job_queue = JobQueue()
 
-# Initialize face mesh solution
-pose = get_mediapipe_pose()
+# Processed frames and the encoded video live in the process-wide artifact
+# store (memory budget, spilled to disk under pressure), keyed by this session.
+if 'metrics_session_id' not in st.session_state:
+    st.session_state['metrics_session_id'] = uuid.uuid4().hex[:12]
+session_id = st.session_state['metrics_session_id']
+artifacts = get_artifact_store()
+artifacts.touch(session_id)
 
 # Initialize session state variables
-if 'processed_frames' not in st.session_state:
-    st.session_state['processed_frames'] = []
 if 'video_metadata' not in st.session_state:
     st.session_state['video_metadata'] = None
 if 'show_download' not in st.session_state:
@@ -78,56 +116,137 @@ warn = st.empty()
 # Placeholder for download button (will be shown after processing)
 download_section = st.empty()
 
-if up_file and uploaded:
+if up_file and uploaded and run_in_background:
+    upload_path = None
+    try:
+        warn.empty()
+        upload_path = spool_upload(up_file, suffix=os.path.splitext(up_file.name)[1])
+        job_id = job_queue.enqueue(upload_path, {'mode': mode, 'evaluate_mpjpe': enable_mpjpe,
+                                                 'visualize_comparison': show_comparison,
+                                                 'display_mpjpe': display_mpjpe, 'user': athlete or None},
+                                 filename=up_file.name)
+        # Kept in the URL so a refresh (or a bookmarked link) keeps following the job.
+        st.query_params['job'] = job_id
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+    finally:
+        # Moved into the job directory by enqueue, or left over when it failed.
+        remove_upload(upload_path)
+
+elif up_file and uploaded:
     # Clear previous session data
-    st.session_state['processed_frames'] = []
+    artifacts.discard(session_id, 'processed_frames')
+    artifacts.discard(session_id, 'video_bytes')
     st.session_state['video_metadata'] = None
     st.session_state['show_download'] = False
+    st.session_state['hls_url'] = None
     
-    tfile = tempfile.NamedTemporaryFile(delete=False)
+    upload_path = None
+    vf = None
+    pose = None
+    hls_writer = None
 
     try:
         warn.empty()
-        tfile.write(up_file.read())
 
         # Store video metadata for potential download
         input_filename = up_file.name
-        filename_without_ext = os.path.splitext(input_filename)[0]
-        
-        vf = cv2.VideoCapture(tfile.name)
+        filename_without_ext, input_ext = os.path.splitext(input_filename)
 
-        # Get video properties for metadata
-        fps = int(vf.get(cv2.CAP_PROP_FPS))
-        width = int(vf.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(vf.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Stream the upload to disk in chunks instead of one whole-file read.
+        upload_path = spool_upload(up_file, suffix=input_ext)
+        
+        vf, metadata = open_video(upload_path)
         
         # Store metadata for potential video creation
         st.session_state['video_metadata'] = {
-            'fps': fps,
-            'width': width,
-            'height': height,
+            'fps': metadata['fps'],
+            'width': metadata['width'],
+            'height': metadata['height'],
             'filename': f'Result_{filename_without_ext}.mp4'
         }
-        ip_video = st.sidebar.video(tfile.name) 
-
-        while vf.isOpened():
-            ret, frame = vf.read()
-            if not ret:
-                break
-
-            # convert frame from BGR to RGB before processing it.
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            out_frame, _ = upload_process_frame.process(frame, pose)
-            stframe.image(out_frame)
+        ip_video = st.sidebar.video(upload_path) 
+
+        # Built per video: pose trackers carry state between frames.
+        upload_process_frame = ProcessFrame(thresholds=thresholds, evaluate_mpjpe=enable_mpjpe,
+                                           visualize_comparison=show_comparison,
+                                           display_mpjpe=display_mpjpe)
+        pose = get_mediapipe_pose()
+
+        preview_interval = 1.0 / preview_fps if preview_fps > 0 else None
+        last_preview_time = 0.0
+
+        # Operator-only sampling profiler of the upload loop (hidden ?profile=<seconds>).
+        profile_trigger = ProfileTrigger(requested_profile_seconds(st.query_params), label='upload')
+        profile_trigger.maybe_start()
+        started = time.time()
+
+        # Upload progress is exported next to the live sessions' metrics.
+        start_metrics_server()
+        upload_metrics = REGISTRY.session(session_id, 'upload', upload_process_frame)
+
+        # Progressive output: HLS segments the player starts on once the first one is published.
+        if progressive:
+            hls_writer = HlsWriter(f'{session_id}-{uuid.uuid4().hex[:6]}', metadata['width'], metadata['height'],
+                                   metadata['fps'] or 30)
+        player_shown = False
+        frames_kept = True
+
+        for out_frame, _ in iter_processed_frames(vf, upload_process_frame, pose, metrics=upload_metrics):
+            # Only push a preview when the interval has elapsed (until the player takes over).
+            now = time.perf_counter()
+            if preview_interval is not None and not player_shown and now - last_preview_time >= preview_interval:
+                preview = encode_preview(out_frame, max_width=preview_width)
+                if preview is not None:
+                    stframe.image(preview)
+                last_preview_time = now
             
-            # Store processed frame in session state for potential download
-            st.session_state['processed_frames'].append(out_frame.copy())
+            if hls_writer is not None:
+                hls_writer.write(out_frame)
+                if not player_shown and hls_writer.frames % PLAYER_CHECK_FRAMES == 0 and hls_writer.ready():
+                    with stframe.container():
+                        components.html(player_html(hls_writer.url), height=420)
+                        st.caption(f"Playing after {hls_writer.first_segment_time:.1f} s, processing continues...")
+                    player_shown = True
+            elif frames_kept:
+                # Store processed frame for potential download.
+                # Frames are kept in BGR so the conversion doubles as the copy
+                # and the writer can consume them directly.
+                # False once the frames were dropped over the disk budget.
+                frames_kept = artifacts.append(session_id, 'processed_frames',
+                                               cv2.cvtColor(out_frame, cv2.COLOR_RGB2BGR))
+
+        artifacts.finish(session_id, 'processed_frames')
+
+        if hls_writer is not None:
+            # Ends the playlist, then the segments are remuxed (no re-encode) into the download.
+            hls_writer.close()
+            with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
+                remux_path = temp_file.name
+            try:
+                with open(hls_writer.to_mp4(remux_path), 'rb') as file:
+                    artifacts.put(session_id, 'video_bytes', file.read())
+            finally:
+                os.unlink(remux_path)
+            st.session_state['hls_url'] = hls_writer.url
+            hls_writer = None
 
         
-        vf.release()
-        
+        if profile_trigger.profiler is not None:
+            profile_trigger.profiler.stop()
+            st.caption(f"Profile written: {profile_trigger.profiler.output_path}")
+
         # Enable download option after processing is complete
         st.session_state['show_download'] = True
+
+        get_history().record(session_record(upload_process_frame, mode, 'upload', started, user=athlete or None))
+
+        pool_stats = upload_process_frame.buffer_pool.stats()
+        st.caption(f"Frame buffers: {pool_stats['allocations']} allocations, "
+                   f"{pool_stats['reuses']} reuses ({pool_stats['bytes'] / (1 << 20):.1f} MiB held)")
+        session_bytes = artifacts.stats()['sessions'].get(session_id, {'memory_bytes': 0, 'disk_bytes': 0})
+        st.caption(f"Processed frames: {session_bytes['memory_bytes'] / (1 << 20):.1f} MiB in memory, "
+                   f"{session_bytes['disk_bytes'] / (1 << 20):.1f} MiB spilled to disk")
         
         # Show MPJPE statistics if evaluation was enabled
         if enable_mpjpe and upload_process_frame.mpjpe_values:
@@ -176,12 +295,51 @@ if up_file and uploaded:
         
         stframe.empty()
         ip_video.empty()
-        tfile.close()
     except Exception as e:
         st.error(f"An error occurred: {e}")
+    finally:
+        if hls_writer is not None:
+            hls_writer.abort()
+        if vf is not None:
+            vf.release()
+        if pose is not None:
+            pose.close()
+        remove_upload(upload_path)
+
+# Status of a background job, polled until it finishes.
+job_id = st.query_params.get('job')
+if job_id:
+    job = job_queue.get(job_id)
+
+    if job is None:
+        st.warning(f"Job {job_id} no longer exists.")
+    elif job['status'] in ('queued', 'running'):
+        counts = job_queue.counts()
+        st.markdown(f"### Background job: {job['filename']}")
+        st.progress(job['progress'], text=f"{job['status'].capitalize()} - {job['frames_done']} / "
+                                          f"{job['frame_count'] or '?'} frames ({counts['queued']} jobs queued)")
+        if st.button('Cancel job'):
+            job_queue.cancel(job_id)
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    elif job['status'] == 'done':
+        result = job['result']
+        st.markdown(f"### Background job: {job['filename']}")
+        st.success(f"✅ {result['SQUAT_COUNT']} correct and {result['IMPROPER_SQUAT']} improper squats "
+                   f"in {result['frames']} frames ({result['fps']:.1f} fps).")
+        if 'mpjpe' in result:
+            st.caption(f"MPJPE (px): average {result['mpjpe']['mean']:.2f}, min {result['mpjpe']['min']:.2f}, "
+                       f"max {result['mpjpe']['max']:.2f}")
+        with open(job['output_path'], 'rb') as file:
+            st.download_button(label="⬇️ Download Processed Video", data=file.read(),
+                               file_name=f"Result_{os.path.splitext(job['filename'])[0]}.mp4", mime='video/mp4',
+                               key='download_job', use_container_width=True)
+    else:
+        st.error(f"Job {job['status']}: {job['error'] or 'no details'}")
 
 # Show download button if processing is complete
-if st.session_state['show_download'] and st.session_state['processed_frames'] and st.session_state['video_metadata']:
+if st.session_state['show_download'] and st.session_state['video_metadata'] \
+        and ((session_id, 'video_bytes') in artifacts or (session_id, 'processed_frames') in artifacts):
     
     def create_video_buffer():
         """Create video file in memory buffer for direct download"""
@@ -200,11 +358,9 @@ if st.session_state['show_download'] and st.session_state['processed_frames'] an
             (metadata['width'], metadata['height'])
         )
         
-        # Write all frames to video
-        for frame in st.session_state['processed_frames']:
-            # Convert RGB back to BGR for video writing
-            bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            video_writer.write(bgr_frame)
+        # Write all frames to video (already stored in BGR), spilled chunks are read back one at a time
+        for frame in artifacts.iterate(session_id, 'processed_frames'):
+            video_writer.write(frame)
         
         video_writer.release()
         
@@ -217,13 +373,19 @@ if st.session_state['show_download'] and st.session_state['processed_frames'] an
         
         return video_bytes
     
+    if st.session_state.get('hls_url'):
+        components.html(player_html(st.session_state['hls_url']), height=420)
+
     download_section.markdown("### Download Processed Video")
     download_section.markdown("✅ **Video analysis complete!** You can now download the processed video.")
     
     # Prepare video data and show download button directly
     with st.spinner("Preparing video for download..."):
         try:
-            video_data = create_video_buffer()
+            # Encoded once per video, not on every rerun.
+            video_data = artifacts.get(session_id, 'video_bytes')
+            if video_data is None:
+                video_data = artifacts.put(session_id, 'video_bytes', create_video_buffer())
             
             # Show download button directly
             download_section.download_button(
@@ -245,4 +407,8 @@ if st.session_state['show_download'] and st.session_state['processed_frames'] an
 
     
 
-
+elif st.session_state['show_download'] and st.session_state['video_metadata'] \
+        and (artifacts.dropped(session_id, 'video_bytes') or artifacts.dropped(session_id, 'processed_frames')):
+    download_section.markdown("### Download Processed Video")
+    download_section.warning("The processed video is too large to keep for download. "
+                             "Use **Process in background** for long videos.")
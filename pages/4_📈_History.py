@@ -0,0 +1,72 @@
+import os
+import sys
+import datetime
+import streamlit as st
+import pandas as pd
+
+
+BASE_DIR = os.path.abspath(os.path.join(__file__, '../../'))
+sys.path.append(BASE_DIR)
+
+
+from session_history import get_history, period_buckets
+
+
+st.title('Training History')
+
+history = get_history()
+# Sessions recorded in this process may still be waiting for their batch.
+history.flush()
+
+col1, col2, col3 = st.columns(3)
+with col1:
+    athlete = st.selectbox('Athlete', ['All'] + history.users())
+with col2:
+    mode = st.radio('Mode', ['All', 'Beginner', 'Pro'], horizontal=True)
+with col3:
+    period = st.radio('Group by', ['Day', 'Week'], horizontal=True)
+
+days = st.slider('Days of history', min_value=7, max_value=365, value=90)
+
+now = datetime.datetime.now()
+start_day, start_week = period_buckets((now - datetime.timedelta(days=days)).timestamp())
+
+# Pre-aggregated rows: one per day/week, however many sessions they hold.
+rows = history.rollups(period.lower(), user=None if athlete == 'All' else athlete,
+                       mode=None if mode == 'All' else mode,
+                       start=start_day if period == 'Day' else start_week)
+
+if not rows:
+    st.info("No sessions recorded yet. Finished live streams and uploaded videos show up here.")
+else:
+    df = pd.DataFrame(rows).set_index('bucket')
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric('Sessions', int(df['sessions'].sum()))
+    with col2:
+        st.metric('Correct Reps', int(df['reps'].sum()))
+    with col3:
+        attempts = df['reps'].sum() + df['improper'].sum()
+        st.metric('Error Rate', f"{df['improper'].sum() / attempts:.1%}" if attempts else '-')
+    with col4:
+        st.metric('Training Time', f"{df['duration'].sum() / 3600:.1f} h")
+
+    st.markdown('### Reps')
+    st.bar_chart(df[['reps', 'improper']].rename(columns={'reps': 'correct'}), use_container_width=True)
+
+    st.markdown('### Error Rate')
+    st.line_chart(df['error_rate'], use_container_width=True)
+
+    if df['mpjpe_mean'].notna().any():
+        st.markdown('### MPJPE (px)')
+        st.line_chart(df[['mpjpe_mean', 'mpjpe_min', 'mpjpe_max']], use_container_width=True)
+
+    with st.expander('Recent Sessions'):
+        sessions = history.sessions(user=None if athlete == 'All' else athlete, start_day=start_day, limit=50)
+        st.dataframe(pd.DataFrame([{
+            'started': datetime.datetime.fromtimestamp(s['started']).strftime('%Y-%m-%d %H:%M'),
+            'athlete': s['user'], 'mode': s['mode'], 'source': s['source'], 'reps': s['reps'],
+            'improper': s['improper'], 'minutes': round((s['ended'] - s['started']) / 60, 1),
+            'mpjpe': None if s['mpjpe_mean'] is None else round(s['mpjpe_mean'], 2)
+        } for s in sessions]), use_container_width=True)
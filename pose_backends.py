@@ -0,0 +1,294 @@
+import time
+import cv2
+import numpy as np
+
+
+NUM_LANDMARKS = 33
+
+
+class Landmark:
+    __slots__ = ('x', 'y', 'z', 'visibility')
+
+    def __init__(self, x, y, z=0.0, visibility=1.0):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.visibility = visibility
+
+
+class PoseLandmarks:
+    __slots__ = ('landmark',)
+
+    def __init__(self, landmark):
+        self.landmark = landmark
+
+
+class PoseResult:
+    """Minimal stand-in for the mediapipe Pose result consumed by ProcessFrame."""
+
+    __slots__ = ('pose_landmarks',)
+
+    def __init__(self, pose_landmarks=None):
+        self.pose_landmarks = pose_landmarks
+
+
+
+def landmarks_to_result(landmarks):
+    """
+    Wrap a (33, 3) or (33, 4) array of normalized x, y, z[, visibility] values as a pose result.
+
+    None or an all-NaN array yields a result without landmarks (no person detected).
+    """
+
+    if landmarks is None:
+        return PoseResult()
+
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+
+    if np.isnan(landmarks).all():
+        return PoseResult()
+
+    rows = landmarks.tolist()
+
+    if landmarks.shape[1] >= 4:
+        landmark = [Landmark(x, y, z, v) for x, y, z, v in (row[:4] for row in rows)]
+    else:
+        landmark = [Landmark(x, y, z) for x, y, z in rows]
+
+    return PoseResult(PoseLandmarks(landmark))
+
+
+
+def result_to_array(result):
+    """Inverse of landmarks_to_result: a (33, 4) float32 array, all NaN when nothing was detected."""
+
+    array = np.full((NUM_LANDMARKS, 4), np.nan, dtype=np.float32)
+
+    if result is None or not result.pose_landmarks:
+        return array
+
+    for idx, lm in enumerate(result.pose_landmarks.landmark):
+        array[idx] = (lm.x, lm.y, lm.z, getattr(lm, 'visibility', 1.0))
+
+    return array
+
+
+
+class ReplayPose:
+    """
+    Pose backend that replays recorded landmarks instead of running inference.
+
+    Accepts a (T, 33, 4) array of normalized landmarks, NaN frames meaning no
+    detection. Results are prebuilt so process() costs next to nothing and runs
+    are deterministic without mediapipe.
+    """
+
+    def __init__(self, landmarks, loop=True):
+        self.landmarks = np.asarray(landmarks, dtype=np.float32)
+        self.results = [landmarks_to_result(frame) for frame in self.landmarks]
+        self.loop = loop
+        self.index = 0
+
+
+    @classmethod
+    def from_file(cls, path, loop=True):
+        data = np.load(path)
+        if isinstance(data, np.lib.npyio.NpzFile):
+            data = data['landmarks']
+
+        return cls(data, loop=loop)
+
+
+    def process(self, image):
+        if self.index >= len(self.results):
+            if not self.loop:
+                return PoseResult()
+            self.index = 0
+
+        result = self.results[self.index]
+        self.index += 1
+
+        return result
+
+
+    def reset(self):
+        self.index = 0
+
+
+    def close(self):
+        pass
+
+
+
+# --pose replay of the command line servers.
+REPLAY_POSE_HELP = 'replay answers with procedural landmarks, for testing without mediapipe'
+
+
+def replay_pose():
+    """Pose factory replaying a noisy procedural squat sequence (the --pose replay backend)."""
+
+    from synthetic_squat import squat_sequence, add_detection_noise
+
+    return ReplayPose(add_detection_noise(squat_sequence(600, variation=0.2), dropout=0.02))
+
+
+
+class RecordingPose:
+    """Wrap a real pose backend and keep every result so a session can be replayed later."""
+
+    def __init__(self, pose):
+        self.pose = pose
+        self.frames = []
+
+
+    def process(self, image):
+        result = self.pose.process(image)
+        self.frames.append(result_to_array(result))
+
+        return result
+
+
+    def save(self, path):
+        np.save(path, np.stack(self.frames) if self.frames else np.empty((0, NUM_LANDMARKS, 4), np.float32))
+
+
+    def close(self):
+        self.pose.close()
+
+
+
+class ScaledPose:
+    """
+    Run a pose backend on a downscaled copy of the frame.
+
+    Landmarks are normalized, so results apply unchanged to the full-size
+    frame. The resize buffer is reused across frames.
+    """
+
+    def __init__(self, pose, scale):
+        self.pose = pose
+        self.scale = scale
+        self._buffer = None
+
+
+    def process(self, image):
+        if self.scale >= 1.0 or image is None:
+            return self.pose.process(image)
+
+        height, width = image.shape[:2]
+        size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+
+        if self._buffer is None or self._buffer.shape[1::-1] != size:
+            self._buffer = np.empty((size[1], size[0]) + image.shape[2:], dtype=image.dtype)
+
+        cv2.resize(image, size, dst=self._buffer, interpolation=cv2.INTER_LINEAR)
+
+        return self.pose.process(self._buffer)
+
+
+    def close(self):
+        self.pose.close()
+
+
+
+class StridedPose:
+    """Run inference on every stride-th frame and repeat the last result in between."""
+
+    def __init__(self, pose, stride):
+        self.pose = pose
+        self.stride = max(1, int(stride))
+        self.index = 0
+        self.last_result = None
+
+
+    def process(self, image):
+        if self.last_result is None or self.index % self.stride == 0:
+            self.last_result = self.pose.process(image)
+
+        self.index += 1
+
+        return self.last_result
+
+
+    def close(self):
+        self.pose.close()
+
+
+
+class MultiPoseLandmarker:
+    """
+    Multi-person backend on mediapipe's PoseLandmarker task (one inference for all people).
+
+    process() returns a list of pose results, one per detected person, in
+    no particular order (see multi_athlete.AthleteTracker for stable ids).
+    The .task model is downloaded separately, e.g. pose_landmarker_full.task
+    from the mediapipe model page.
+    """
+
+    def __init__(self, model_path, num_poses=4, min_detection_confidence=0.5, min_presence_confidence=0.5,
+                 min_tracking_confidence=0.5):
+        import mediapipe as mp
+        from mediapipe.tasks.python import BaseOptions, vision
+
+        self._mp = mp
+        options = vision.PoseLandmarkerOptions(base_options=BaseOptions(model_asset_path=model_path),
+                                               running_mode=vision.RunningMode.VIDEO,
+                                               num_poses=num_poses,
+                                               min_pose_detection_confidence=min_detection_confidence,
+                                               min_pose_presence_confidence=min_presence_confidence,
+                                               min_tracking_confidence=min_tracking_confidence)
+        self.landmarker = vision.PoseLandmarker.create_from_options(options)
+        self._timestamp_ms = -1
+
+
+    def process(self, image):
+        image = self._mp.Image(image_format=self._mp.ImageFormat.SRGB, data=np.ascontiguousarray(image))
+
+        # Video mode requires strictly increasing timestamps.
+        self._timestamp_ms = max(self._timestamp_ms + 1, int(time.monotonic() * 1000))
+        detection = self.landmarker.detect_for_video(image, self._timestamp_ms)
+
+        return [PoseResult(PoseLandmarks(landmarks)) for landmarks in detection.pose_landmarks]
+
+
+    def close(self):
+        self.landmarker.close()
+
+
+
+class ReplayMultiPose:
+    """
+    Multi-person counterpart of ReplayPose.
+
+    Accepts one (T, 33, 4) landmark array per person; NaN frames mean that
+    person is not detected in that frame.
+    """
+
+    def __init__(self, sequences, loop=True):
+        sequences = [np.asarray(sequence, dtype=np.float32) for sequence in sequences]
+        num_frames = min(len(sequence) for sequence in sequences)
+
+        self.results = [[landmarks_to_result(sequence[idx]) for sequence in sequences
+                         if not np.isnan(sequence[idx]).all()] for idx in range(num_frames)]
+        self.loop = loop
+        self.index = 0
+
+
+    def process(self, image):
+        if self.index >= len(self.results):
+            if not self.loop:
+                return []
+            self.index = 0
+
+        results = self.results[self.index]
+        self.index += 1
+
+        return results
+
+
+    def reset(self):
+        self.index = 0
+
+
+    def close(self):
+        pass
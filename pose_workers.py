@@ -0,0 +1,643 @@
+import os
+import sys
+import time
+import atexit
+import queue
+import weakref
+import functools
+import threading
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from instrumentation import StageTimings
+from session_snapshot import restore_state
+from thread_budget import plan_budgets, thread_env, apply_thread_budget, print_report
+
+
+# Number of worker processes for live sessions; 0 keeps processing in the
+# Streamlit process. 'auto' uses every core.
+POSE_WORKERS_ENV = 'SQUAT_POSE_WORKERS'
+
+# Frame slots per worker and the largest frame a slot holds (1080p RGB).
+DEFAULT_SLOTS = 4
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+
+# How long a session waits for a free slot before the frame is passed through unprocessed.
+SLOT_TIMEOUT = 1.0
+
+# How long a session waits for a processed frame before passing it through unprocessed
+# (a hung worker); the slot is reused once the late reply arrives.
+FRAME_TIMEOUT = 5.0
+
+# How long a migration waits for a worker's snapshot before continuing from the
+# state mirrored with the session's last processed frame.
+SNAPSHOT_TIMEOUT = 2.0
+
+# ProcessFrame attributes the page may change between frames; sent along with every frame.
+FORWARDED_ATTRIBUTES = ('show_hud', 'mpjpe_overlay', 'quality_mode')
+
+# Worker messages that carry a request id and are answered (errors included).
+REPLY_KINDS = ('frame', 'snapshot')
+
+
+class WorkerLost(RuntimeError):
+    """The worker process exited (crashed or was killed) before answering."""
+
+
+
+def _handle_message(message, conn, shm, slot_bytes, sessions, pose_factory):
+    """Handle one parent message in the worker; replies go out on conn."""
+
+    kind = message[0]
+
+    if kind == 'frame':
+        _, request_id, session_id, slot, shape, attributes = message
+        process_frame, quality = sessions[session_id]
+
+        for name, value in attributes.items():
+            setattr(process_frame, name, value)
+        if attributes.get('quality_mode') is not None:
+            quality.set_mode(attributes['quality_mode'])
+
+        view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+        num_mpjpe = len(process_frame.mpjpe_values)
+
+        out_frame, play_sound = process_frame.process(view, quality.pose)
+        if out_frame is not view:
+            view[...] = out_frame
+
+        timings = process_frame.timings
+        conn.send((request_id, {
+            'play_sound': play_sound,
+            'SQUAT_COUNT': process_frame.state_tracker['SQUAT_COUNT'],
+            'IMPROPER_SQUAT': process_frame.state_tracker['IMPROPER_SQUAT'],
+            'SQUAT_TOTAL': process_frame.state_tracker['SQUAT_TOTAL'],
+            'IMPROPER_TOTAL': process_frame.state_tracker['IMPROPER_TOTAL'],
+            'stages': dict(timings.last),
+            'inference_span': timings.inference_span,
+            'mpjpe': process_frame.mpjpe_values[-1] if len(process_frame.mpjpe_values) > num_mpjpe else None,
+            # 88 bytes; lets the parent reopen the session elsewhere if this worker dies.
+            'snapshot': process_frame.snapshot()
+        }))
+
+    elif kind == 'open':
+        # Imported here so the parent process does not need mediapipe loaded to start workers.
+        from process_frame import ProcessFrame
+        from adaptive_quality import QualityController
+
+        _, session_id, thresholds, kwargs, snapshot = message
+        process_frame = ProcessFrame(thresholds=thresholds, **kwargs)
+        if snapshot is not None:
+            process_frame.restore(snapshot)
+        sessions[session_id] = (process_frame, QualityController(pose_factory))
+
+    elif kind == 'snapshot':
+        _, request_id, session_id = message
+        conn.send((request_id, {'snapshot': sessions[session_id][0].snapshot()}))
+
+    elif kind == 'close':
+        entry = sessions.pop(message[1], None)
+        if entry is not None:
+            entry[1].close()
+
+
+
+def _worker_main(conn, shm_name, slots, slot_bytes, pose_factory, initializer, index, budget):
+    """Worker loop: owns one ProcessFrame and pose per session and processes frames in shared memory."""
+
+    report = apply_thread_budget(budget['threads'], budget['cpus'])
+    print_report(report, label=f'pose-worker-{index}')
+    conn.send((None, report))
+
+    if initializer is not None:
+        initializer()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    sessions = {}
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            try:
+                _handle_message(message, conn, shm, slot_bytes, sessions, pose_factory)
+            except Exception as exc:
+                # One bad message must not take down the worker and its other sessions.
+                if message[0] in REPLY_KINDS:
+                    conn.send((message[1], {'error': repr(exc)}))
+                else:
+                    print(f'pose-worker-{index}: {message[0]} message failed: {exc!r}', file=sys.stderr, flush=True)
+    finally:
+        for _, quality in sessions.values():
+            quality.close()
+        shm.close()
+
+
+
+class _Worker:
+    """Parent-side handle of one worker: its shared-memory ring, pipe and pending requests."""
+
+    def __init__(self, context, index, slots, slot_bytes, pose_factory, initializer, budget, restarts=0):
+        self.index = index
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.budget = budget
+        self.restarts = restarts
+        self.thread_report = None
+        self.sessions = 0
+        # Set once the pipe is closed; no further calls are answered.
+        self.lost = False
+        # Draining workers get no new sessions (see PoseWorkerPool.drain).
+        self.draining = False
+
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, name=f'pose-worker-{index}', daemon=True,
+                                       args=(child_conn, self.shm.name, slots, slot_bytes, pose_factory, initializer,
+                                             index, budget))
+
+        # BLAS/OpenMP size their pools from the environment at import, which in a
+        # spawned child happens before _worker_main runs: start it with the limits set.
+        saved = {name: os.environ.get(name) for name in thread_env(budget['threads'])}
+        os.environ.update(thread_env(budget['threads']))
+        try:
+            self.process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        child_conn.close()
+
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._receiver = threading.Thread(target=self._receive, name=f'pose-worker-{index}-results', daemon=True)
+        self._receiver.start()
+
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if request_id is None:
+                # Thread settings the worker reports once at startup.
+                self.thread_report = result
+                continue
+
+            with self._pending_lock:
+                waiter = self._pending.pop(request_id, None)
+                if waiter is not None:
+                    waiter[1] = result
+                    waiter[0].set()
+            if waiter is not None and waiter[2] is not None:
+                waiter[2]()
+
+        # Worker gone: release everyone still waiting.
+        with self._pending_lock:
+            self.lost = True
+            waiters = list(self._pending.values())
+            for waiter in waiters:
+                waiter[0].set()
+        for waiter in waiters:
+            if waiter[2] is not None:
+                waiter[2]()
+
+
+    @property
+    def alive(self):
+        return not self.lost and self.process.is_alive()
+
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+        except (BrokenPipeError, EOFError, OSError) as exc:
+            raise WorkerLost(f'pose worker {self.index} exited') from exc
+
+
+    def slot_view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+
+    def call(self, kind, *args, timeout=None, late=None):
+        """
+        Send (kind, request_id, *args) and wait for the worker's reply.
+
+        Args:
+            kind: Request type handled by the worker loop.
+            *args: Request arguments.
+            timeout: Seconds to wait before raising TimeoutError, default: no limit.
+            late: Called from the receiver thread when the reply to a timed-out
+                call arrives (or the worker exits), e.g. to release its slot.
+
+        Returns:
+            The worker's reply.
+
+        Raises:
+            WorkerLost: The worker exited before answering.
+            TimeoutError: No reply within timeout.
+        """
+
+        request_id = next(self._request_ids)
+        waiter = [threading.Event(), None, None]
+        with self._pending_lock:
+            if self.lost:
+                raise WorkerLost(f'pose worker {self.index} exited')
+            self._pending[request_id] = waiter
+
+        try:
+            self.send((kind, request_id) + args)
+        except WorkerLost:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise
+
+        if not waiter[0].wait(timeout):
+            with self._pending_lock:
+                if not waiter[0].is_set():
+                    waiter[2] = late
+                    raise TimeoutError(f'pose worker {self.index} did not answer within {timeout:g} s')
+
+        if waiter[1] is None:
+            raise WorkerLost(f'pose worker {self.index} exited')
+        if 'error' in waiter[1]:
+            raise RuntimeError(f"pose worker {self.index}: {waiter[1]['error']}")
+
+        return waiter[1]
+
+
+    def request(self, session_id, slot, shape, attributes, timeout=None, late=None):
+        return self.call('frame', session_id, slot, shape, attributes, timeout=timeout, late=late)
+
+
+    def stop(self):
+        try:
+            self.send(None)
+        except WorkerLost:
+            pass
+
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+    def discard(self):
+        """
+        Clean up after a dead worker. The slot memory stays mapped until
+        sessions that still hold views of it let go.
+        """
+
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.conn.close()
+        self.shm.unlink()
+
+
+
+class RemoteSession:
+    """
+    A live session whose ProcessFrame and pose run in a worker process.
+
+    Drop-in for ProcessFrame on the live page: process(frame, pose) returns
+    (frame, play_sound) with the frame annotated in place, the pose argument
+    is ignored (each worker session owns its pose). Stage timings, counters
+    and MPJPE values are mirrored locally so stats and metrics keep working.
+    The worker-side state is released by close() or when this object is
+    garbage collected (e.g. with the Streamlit session that held it). The
+    pool can move the session to another worker between frames (migrate),
+    and reopens it from the last mirrored state when its worker dies.
+    """
+
+    def __init__(self, pool, worker, session_id, thresholds, process_frame_kwargs, snapshot=None):
+        self.pool = pool
+        self.worker = worker
+        self.session_id = session_id
+        self.thresholds = thresholds
+        self.process_frame_kwargs = process_frame_kwargs
+        self._finalizer = weakref.finalize(self, pool.release_session, worker, session_id)
+        # Held while a frame is processed, so a migration happens between frames.
+        self.lock = threading.Lock()
+
+        self.timings = StageTimings()
+        self.state_tracker = {'SQUAT_COUNT': 0, 'IMPROPER_SQUAT': 0, 'SQUAT_TOTAL': 0, 'IMPROPER_TOTAL': 0}
+        self.mpjpe_values = []
+        self.dropped = 0
+        # ProcessFrame state after the last processed frame, sent along with every result.
+        self.last_snapshot = snapshot
+
+        self.show_hud = False
+        self.mpjpe_overlay = True
+        self.quality_mode = None
+
+
+    def process(self, frame, pose=None):
+        with self.lock:
+            return self._process(frame)
+
+
+    def _process(self, frame):
+        if not self.worker.alive:
+            self.pool.failover(self)
+        worker = self.worker
+
+        if frame.nbytes > worker.slot_bytes:
+            raise ValueError(f'frame of {frame.nbytes} bytes does not fit a {worker.slot_bytes} byte worker slot')
+
+        try:
+            slot = worker.free_slots.get(timeout=SLOT_TIMEOUT)
+        except queue.Empty:
+            # Worker saturated: pass the frame through rather than stall the stream.
+            self.dropped += 1
+            return frame, False
+
+        release = functools.partial(worker.free_slots.put, slot)
+
+        try:
+            start = time.perf_counter()
+
+            view = worker.slot_view(slot, frame.shape)
+            view[...] = frame
+
+            attributes = {name: getattr(self, name) for name in FORWARDED_ATTRIBUTES}
+            result = worker.request(self.session_id, slot, frame.shape, attributes, timeout=FRAME_TIMEOUT,
+                                    late=release)
+
+            frame[...] = view
+        except TimeoutError:
+            # Worker stalled: pass the frame through; the worker may still write
+            # into the slot, so it is released by the late reply.
+            self.dropped += 1
+            return frame, False
+        except WorkerLost:
+            # Worker died: pass the frame through and continue on a live worker.
+            release()
+            self.dropped += 1
+            self.pool.failover(self)
+            return frame, False
+        except BaseException:
+            release()
+            raise
+
+        release()
+
+        for stage, seconds in result['stages'].items():
+            if stage != 'total':
+                self.timings.record(stage, seconds)
+        self.timings.inference_span = result['inference_span']
+        self.timings.end_frame(time.perf_counter() - start)
+
+        self.state_tracker['SQUAT_COUNT'] = result['SQUAT_COUNT']
+        self.state_tracker['IMPROPER_SQUAT'] = result['IMPROPER_SQUAT']
+        self.state_tracker['SQUAT_TOTAL'] = result['SQUAT_TOTAL']
+        self.state_tracker['IMPROPER_TOTAL'] = result['IMPROPER_TOTAL']
+        if result['mpjpe'] is not None:
+            self.mpjpe_values.append(result['mpjpe'])
+        self.last_snapshot = result['snapshot']
+
+        return frame, result['play_sound']
+
+
+    def snapshot(self, timeout=SNAPSHOT_TIMEOUT):
+        """Snapshot of the worker-side ProcessFrame state (see ProcessFrame.snapshot)."""
+
+        return self.worker.call('snapshot', self.session_id, timeout=timeout)['snapshot']
+
+
+    def get_stats(self):
+        stats = self.timings.stats()
+        stats['worker'] = self.worker.index
+        stats['dropped'] = self.dropped
+
+        return stats
+
+
+    def close(self):
+        self._finalizer()
+
+
+
+class PoseWorkerPool:
+    """
+    Pool of pose worker processes fed through shared-memory frame rings.
+
+    Every worker owns a ring of fixed-size frame slots in one SharedMemory
+    block. A frame is copied into a free slot, a small control message is
+    sent over the worker's pipe and the worker draws on the slot in place, so
+    image data is never pickled. Sessions stick to the worker that holds
+    their ProcessFrame state (least-loaded worker at session start).
+    """
+
+    def __init__(self, num_workers=None, slots=DEFAULT_SLOTS, slot_bytes=DEFAULT_SLOT_BYTES, pose_factory=None,
+                 initializer=None, threads_per_worker=None, pin_cpus=None):
+        if pose_factory is None:
+            from utils import get_mediapipe_pose
+            pose_factory = get_mediapipe_pose
+
+        # spawn: workers must not inherit the Streamlit/aiortc threads of the parent.
+        context = mp.get_context('spawn')
+        num_workers = num_workers or os.cpu_count() or 1
+
+        # Per-worker thread budget and optional CPU pinning (see thread_budget).
+        budgets = plan_budgets(num_workers, threads_per_worker, pin_cpus)
+
+        self._context = context
+        self._worker_args = (slots, slot_bytes, pose_factory, initializer)
+        self.workers = [_Worker(context, idx, *self._worker_args, budget) for idx, budget in enumerate(budgets)]
+        self._lock = threading.Lock()
+        self._session_ids = itertools.count()
+        self._sessions = weakref.WeakSet()
+
+
+    def _respawn_dead(self):
+        """Replace workers whose process died; draining ones are on their way out and are not replaced."""
+
+        with self._lock:
+            dead = [w for w in self.workers if not w.alive and not w.draining]
+            for worker in dead:
+                self.workers[worker.index] = _Worker(self._context, worker.index, *self._worker_args, worker.budget,
+                                                     restarts=worker.restarts + 1)
+
+        for worker in dead:
+            worker.discard()
+
+
+    def _place(self, thresholds, process_frame_kwargs, snapshot=None, exclude=None):
+        self._respawn_dead()
+
+        with self._lock:
+            live = [w for w in self.workers if w.alive]
+            candidates = [w for w in live if not w.draining and w is not exclude] or live
+            if not candidates:
+                raise WorkerLost('no live pose worker')
+            worker = min(candidates, key=lambda w: w.sessions)
+            worker.sessions += 1
+            session_id = next(self._session_ids)
+
+        worker.send(('open', session_id, thresholds, process_frame_kwargs, snapshot))
+
+        return worker, session_id
+
+
+    def open_session(self, thresholds, snapshot=None, **process_frame_kwargs):
+        """
+        Create a ProcessFrame(thresholds, **process_frame_kwargs) on the least-loaded worker,
+        optionally continuing from a ProcessFrame snapshot taken elsewhere.
+
+        Raises SnapshotError here, not in the worker, for an invalid snapshot.
+        """
+
+        if snapshot is not None:
+            restore_state({}, snapshot)
+
+        worker, session_id = self._place(thresholds, process_frame_kwargs, snapshot)
+        session = RemoteSession(self, worker, session_id, thresholds, process_frame_kwargs, snapshot)
+        self._sessions.add(session)
+
+        return session
+
+
+    def migrate(self, session, worker=None):
+        """
+        Move a session to another worker (default: the least-loaded other one).
+
+        Counters, rep sequence, feedback and inactivity timers travel as a
+        ProcessFrame snapshot; the pose tracker restarts on the new worker.
+        A hung or dead worker is not waited for: the session continues from
+        the state mirrored with its last processed frame.
+        """
+
+        with session.lock:
+            try:
+                snapshot = session.snapshot()
+            except (TimeoutError, WorkerLost):
+                snapshot = session.last_snapshot
+
+            return self._reopen(session, snapshot, worker)
+
+
+    def failover(self, session):
+        """
+        Continue a session whose worker died on a live worker, from the state
+        mirrored with its last processed frame; the dead worker is respawned.
+        Called by the session with its lock held.
+        """
+
+        return self._reopen(session, session.last_snapshot)
+
+
+    def _reopen(self, session, snapshot, worker=None):
+        old_worker, old_id = session.worker, session.session_id
+
+        if worker is None:
+            new_worker, new_id = self._place(session.thresholds, session.process_frame_kwargs, snapshot,
+                                             exclude=old_worker)
+        else:
+            with self._lock:
+                worker.sessions += 1
+                new_id = next(self._session_ids)
+            worker.send(('open', new_id, session.thresholds, session.process_frame_kwargs, snapshot))
+            new_worker = worker
+
+        session._finalizer.detach()
+        self.release_session(old_worker, old_id)
+
+        session.worker, session.session_id = new_worker, new_id
+        session._finalizer = weakref.finalize(session, self.release_session, new_worker, new_id)
+
+        return new_worker
+
+
+    def drain(self, index):
+        """Stop placing sessions on a worker and migrate its sessions away; returns how many moved."""
+
+        worker = self.workers[index]
+        worker.draining = True
+
+        moved = 0
+        for session in list(self._sessions):
+            if session.worker is worker:
+                self.migrate(session)
+                moved += 1
+
+        return moved
+
+
+    def release_session(self, worker, session_id):
+        with self._lock:
+            worker.sessions -= 1
+
+        try:
+            worker.send(('close', session_id))
+        except WorkerLost:
+            pass
+
+
+    def stats(self):
+        return [{'worker': w.index, 'pid': w.process.pid, 'alive': w.alive, 'sessions': w.sessions,
+                 'draining': w.draining, 'restarts': w.restarts,
+                 'free_slots': w.free_slots.qsize(), 'threads': w.budget['threads'], 'cpus': w.budget['cpus'],
+                 'thread_report': w.thread_report} for w in self.workers]
+
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configured_workers():
+    """Worker count requested through SQUAT_POSE_WORKERS (0 when unset)."""
+
+    value = os.environ.get(POSE_WORKERS_ENV, '0').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return 0
+
+
+
+def get_worker_pool():
+    """Process-wide worker pool, or None when SQUAT_POSE_WORKERS is 0/unset."""
+
+    global _pool
+
+    num_workers = configured_workers()
+    if num_workers == 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoseWorkerPool(num_workers)
+            atexit.register(_pool.shutdown)
+
+    return _pool
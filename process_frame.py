@@ -4,20 +4,42 @@ import numpy as np
 import time
 import cv2
 import numpy as np
-from utils import find_angle, get_landmark_features, draw_text, draw_dotted_line
+from utils import get_landmark_coords, draw_text, draw_dotted_line
+from kinematics import frame_angles
 from mpjpe_evaluation import calculate_mpjpe, format_landmark_array, generate_dummy_ground_truth
 from mpjpe_visualization import draw_mpjpe_results, visualize_mpjpe_comparison
+from frame_buffers import FrameBufferPool
+from instrumentation import StageTimings
+from session_snapshot import snapshot_state, restore_state
+from state_machine import (SquatStateMachine, STATE_NAMES, SEQ_EMPTY,
+                           SEQ_HAS_S3, SEQ_SINGLE_S2, REP_CORRECT, REP_IMPROPER)
 
 
 class ProcessFrame:
-    def __init__(self, thresholds, flip_frame=False, evaluate_mpjpe=False, visualize_comparison=False, display_mpjpe=False):
+    def __init__(self, thresholds, flip_frame=False, evaluate_mpjpe=False, visualize_comparison=False, display_mpjpe=False,
+                 buffer_pool=None, show_hud=False):
         
         # Set if frame should be flipped or not.
         self.flip_frame = flip_frame
 
+        # Preallocated buffers shared with the calling pipeline.
+        self.buffer_pool = buffer_pool if buffer_pool is not None else FrameBufferPool()
+
+        # Per-stage timing histograms and the optional FPS/latency HUD line.
+        self.timings = StageTimings()
+        self.show_hud = show_hud
+
+        # Set by adaptive_quality.QualityController: skip MPJPE drawing under load
+        # and name the active quality level in the HUD.
+        self.mpjpe_overlay = True
+        self.quality_mode = None
+
         # self.thresholds
         self.thresholds = thresholds
 
+        # Knee-angle lookup table and rep transitions compiled once from the thresholds.
+        self.state_machine = SquatStateMachine(thresholds)
+
         # Font type.
         self.font = cv2.FONT_HERSHEY_SIMPLEX
 
@@ -86,7 +108,8 @@ class ProcessFrame:
         
         # For tracking counters and sharing states in and out of callbacks.
         self.state_tracker = {
-            'state_seq': [],
+            # Integer-encoded rep sequence, see state_machine.SEQUENCES.
+            'state_seq': SEQ_EMPTY,
 
             'start_inactive_time': time.perf_counter(),
             'start_inactive_time_front': time.perf_counter(),
@@ -105,7 +128,11 @@ class ProcessFrame:
             'curr_state':None,
 
             'SQUAT_COUNT': 0,
-            'IMPROPER_SQUAT':0
+            'IMPROPER_SQUAT':0,
+
+            # Session totals; unlike the counters above never reset by inactivity.
+            'SQUAT_TOTAL': 0,
+            'IMPROPER_TOTAL': 0
             
         }
         
@@ -121,36 +148,19 @@ class ProcessFrame:
 
     def _get_state(self, knee_angle):
         
-        knee = None        
-
-        if self.thresholds['HIP_KNEE_VERT']['NORMAL'][0] <= knee_angle <= self.thresholds['HIP_KNEE_VERT']['NORMAL'][1]:
-            knee = 1
-        elif self.thresholds['HIP_KNEE_VERT']['TRANS'][0] <= knee_angle <= self.thresholds['HIP_KNEE_VERT']['TRANS'][1]:
-            knee = 2
-        elif self.thresholds['HIP_KNEE_VERT']['PASS'][0] <= knee_angle <= self.thresholds['HIP_KNEE_VERT']['PASS'][1]:
-            knee = 3
-
-        return f's{knee}' if knee else None
+        return STATE_NAMES[self.state_machine.get_state(knee_angle)]
 
 
 
     
-    def _update_state_sequence(self, state):
+    def _update_state_sequence(self, state_code):
 
-        if state == 's2':
-            if (('s3' not in self.state_tracker['state_seq']) and (self.state_tracker['state_seq'].count('s2'))==0) or \
-                    (('s3' in self.state_tracker['state_seq']) and (self.state_tracker['state_seq'].count('s2')==1)):
-                        self.state_tracker['state_seq'].append(state)
-            
-
-        elif state == 's3':
-            if (state not in self.state_tracker['state_seq']) and 's2' in self.state_tracker['state_seq']: 
-                self.state_tracker['state_seq'].append(state)
+        self.state_tracker['state_seq'] = self.state_machine.next_sequence(self.state_tracker['state_seq'], state_code)
 
             
 
 
-    def _show_feedback(self, frame, c_frame, dict_maps, lower_hips_disp):
+    def _show_feedback(self, frame, feedback_ids, dict_maps, lower_hips_disp):
 
 
         if lower_hips_disp:
@@ -163,7 +173,7 @@ class ProcessFrame:
                     text_color_bg=(255, 255, 0)
                 )  
 
-        for idx in np.where(c_frame)[0]:
+        for idx in feedback_ids:
             draw_text(
                     frame, 
                     dict_maps[idx][0], 
@@ -177,25 +187,67 @@ class ProcessFrame:
 
 
 
-    def process(self, frame: np.array, pose):
-        play_sound = None
-       
+    def _show_counters(self, frame, frame_width):
+
+        draw_text(
+            frame, 
+            "CORRECT: " + str(self.state_tracker['SQUAT_COUNT']), 
+            pos=(int(frame_width*0.68), 30),
+            text_color=(255, 255, 230),
+            font_scale=0.7,
+            text_color_bg=(18, 185, 0)
+        )  
+        
+
+        draw_text(
+            frame, 
+            "INCORRECT: " + str(self.state_tracker['IMPROPER_SQUAT']), 
+            pos=(int(frame_width*0.68), 80),
+            text_color=(255, 255, 230),
+            font_scale=0.7,
+            text_color_bg=(221, 0, 0),
+            
+        )  
+
+        return frame
 
-        frame_height, frame_width, _ = frame.shape
 
-        # Process the image.
-        keypoints = pose.process(frame)
+
+    def analyze(self, keypoints, frame_width, frame_height):
+        """
+        Update the squat state from one pose result without touching any pixels.
+
+        Returns a per-frame result dict with the landmark coordinates, angles,
+        state, feedback ids and the sound to play; draw() renders it.
+        """
+
+        timings = self.timings
+        stage_start = time.perf_counter()
+
+        play_sound = None
+
+        result = {
+            'detected': False,
+            'aligned': False,
+            'play_sound': None
+        }
 
         if keypoints.pose_landmarks:
             ps_lm = keypoints.pose_landmarks
 
-            nose_coord = get_landmark_features(ps_lm.landmark, self.dict_features, 'nose', frame_width, frame_height)
-            left_shldr_coord, left_elbow_coord, left_wrist_coord, left_hip_coord, left_knee_coord, left_ankle_coord, left_foot_coord = \
-                                get_landmark_features(ps_lm.landmark, self.dict_features, 'left', frame_width, frame_height)
-            right_shldr_coord, right_elbow_coord, right_wrist_coord, right_hip_coord, right_knee_coord, right_ankle_coord, right_foot_coord = \
-                                get_landmark_features(ps_lm.landmark, self.dict_features, 'right', frame_width, frame_height)
+            # Denormalize every landmark once, per-joint coordinates are views into this array.
+            coords = get_landmark_coords(ps_lm.landmark, frame_width, frame_height)
+
+            landmarks_end = time.perf_counter()
+            timings.record('landmarks', landmarks_end - stage_start)
+            stage_start = landmarks_end
 
-            offset_angle = find_angle(left_shldr_coord, right_shldr_coord, nose_coord)
+            # Offset and side vertical angles in a single kernel call.
+            offset_angle, use_left, hip_vertical_angle, knee_vertical_angle, ankle_vertical_angle = frame_angles(coords)
+
+            result['detected'] = True
+            result['coords'] = coords
+            result['offset_angle'] = offset_angle
 
             if offset_angle > self.thresholds['OFFSET_THRESH']:
                 
@@ -210,60 +262,11 @@ class ProcessFrame:
                     self.state_tracker['IMPROPER_SQUAT'] = 0
                     display_inactivity = True
 
-                cv2.circle(frame, nose_coord, 7, self.COLORS['white'], -1)
-                cv2.circle(frame, left_shldr_coord, 7, self.COLORS['yellow'], -1)
-                cv2.circle(frame, right_shldr_coord, 7, self.COLORS['magenta'], -1)
-
-                if self.flip_frame:
-                    frame = cv2.flip(frame, 1)
-
                 if display_inactivity:
-                    # cv2.putText(frame, 'Resetting SQUAT_COUNT due to inactivity!!!', (10, frame_height - 90), 
-                    #             self.font, 0.5, self.COLORS['blue'], 2, lineType=self.linetype)
                     play_sound = 'reset_counters'
                     self.state_tracker['INACTIVE_TIME_FRONT'] = 0.0
                     self.state_tracker['start_inactive_time_front'] = time.perf_counter()
 
-                draw_text(
-                    frame, 
-                    "CORRECT: " + str(self.state_tracker['SQUAT_COUNT']), 
-                    pos=(int(frame_width*0.68), 30),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(18, 185, 0)
-                )  
-                
-
-                draw_text(
-                    frame, 
-                    "INCORRECT: " + str(self.state_tracker['IMPROPER_SQUAT']), 
-                    pos=(int(frame_width*0.68), 80),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(221, 0, 0),
-                    
-                )  
-                
-                
-                draw_text(
-                    frame, 
-                    'CAMERA NOT ALIGNED PROPERLY!!!', 
-                    pos=(30, frame_height-60),
-                    text_color=(255, 255, 230),
-                    font_scale=0.65,
-                    text_color_bg=(255, 153, 0),
-                ) 
-                
-                
-                draw_text(
-                    frame, 
-                    'OFFSET ANGLE: '+str(offset_angle), 
-                    pos=(30, frame_height-30),
-                    text_color=(255, 255, 230),
-                    font_scale=0.65,
-                    text_color_bg=(255, 153, 0),
-                ) 
-
                 # Reset inactive times for side view.
                 self.state_tracker['start_inactive_time'] = time.perf_counter()
                 self.state_tracker['INACTIVE_TIME'] = 0.0
@@ -276,95 +279,10 @@ class ProcessFrame:
                 self.state_tracker['INACTIVE_TIME_FRONT'] = 0.0
                 self.state_tracker['start_inactive_time_front'] = time.perf_counter()
 
-
-                dist_l_sh_hip = abs(left_foot_coord[1]- left_shldr_coord[1])
-                dist_r_sh_hip = abs(right_foot_coord[1] - right_shldr_coord)[1]
-
-                shldr_coord = None
-                elbow_coord = None
-                wrist_coord = None
-                hip_coord = None
-                knee_coord = None
-                ankle_coord = None
-                foot_coord = None
-
-                if dist_l_sh_hip > dist_r_sh_hip:
-                    shldr_coord = left_shldr_coord
-                    elbow_coord = left_elbow_coord
-                    wrist_coord = left_wrist_coord
-                    hip_coord = left_hip_coord
-                    knee_coord = left_knee_coord
-                    ankle_coord = left_ankle_coord
-                    foot_coord = left_foot_coord
-
-                    multiplier = -1
-                                     
-                
-                else:
-                    shldr_coord = right_shldr_coord
-                    elbow_coord = right_elbow_coord
-                    wrist_coord = right_wrist_coord
-                    hip_coord = right_hip_coord
-                    knee_coord = right_knee_coord
-                    ankle_coord = right_ankle_coord
-                    foot_coord = right_foot_coord
-
-                    multiplier = 1
-                    
-
-                # ------------------- Verical Angle calculation --------------
-                
-                hip_vertical_angle = find_angle(shldr_coord, np.array([hip_coord[0], 0]), hip_coord)
-                cv2.ellipse(frame, hip_coord, (30, 30), 
-                            angle = 0, startAngle = -90, endAngle = -90+multiplier*hip_vertical_angle, 
-                            color = self.COLORS['white'], thickness = 3, lineType = self.linetype)
-
-                draw_dotted_line(frame, hip_coord, start=hip_coord[1]-80, end=hip_coord[1]+20, line_color=self.COLORS['blue'])
-
-
-
-
-                knee_vertical_angle = find_angle(hip_coord, np.array([knee_coord[0], 0]), knee_coord)
-                cv2.ellipse(frame, knee_coord, (20, 20), 
-                            angle = 0, startAngle = -90, endAngle = -90-multiplier*knee_vertical_angle, 
-                            color = self.COLORS['white'], thickness = 3,  lineType = self.linetype)
-
-                draw_dotted_line(frame, knee_coord, start=knee_coord[1]-50, end=knee_coord[1]+20, line_color=self.COLORS['blue'])
-
-
-
-                ankle_vertical_angle = find_angle(knee_coord, np.array([ankle_coord[0], 0]), ankle_coord)
-                cv2.ellipse(frame, ankle_coord, (30, 30),
-                            angle = 0, startAngle = -90, endAngle = -90 + multiplier*ankle_vertical_angle,
-                            color = self.COLORS['white'], thickness = 3,  lineType=self.linetype)
-
-                draw_dotted_line(frame, ankle_coord, start=ankle_coord[1]-50, end=ankle_coord[1]+20, line_color=self.COLORS['blue'])
-
-                # ------------------------------------------------------------
-        
-                
-                # Join landmarks.
-                cv2.line(frame, shldr_coord, elbow_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
-                cv2.line(frame, wrist_coord, elbow_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
-                cv2.line(frame, shldr_coord, hip_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
-                cv2.line(frame, knee_coord, hip_coord, self.COLORS['light_blue'], 4,  lineType=self.linetype)
-                cv2.line(frame, ankle_coord, knee_coord,self.COLORS['light_blue'], 4,  lineType=self.linetype)
-                cv2.line(frame, ankle_coord, foot_coord, self.COLORS['light_blue'], 4,  lineType=self.linetype)
-                
-                # Plot landmark points
-                cv2.circle(frame, shldr_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, elbow_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, wrist_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, hip_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, knee_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, ankle_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-                cv2.circle(frame, foot_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
-
-                
-
-                current_state = self._get_state(int(knee_vertical_angle))
+                state_code = self.state_machine.get_state(int(knee_vertical_angle))
+                current_state = STATE_NAMES[state_code]
                 self.state_tracker['curr_state'] = current_state
-                self._update_state_sequence(current_state)
+                self._update_state_sequence(state_code)
 
 
 
@@ -372,20 +290,21 @@ class ProcessFrame:
 
                 if current_state == 's1':
 
-                    if len(self.state_tracker['state_seq']) == 3 and not self.state_tracker['INCORRECT_POSTURE']:
+                    rep_outcome = self.state_machine.rep_outcome(self.state_tracker['state_seq'],
+                                                                 self.state_tracker['INCORRECT_POSTURE'])
+
+                    if rep_outcome == REP_CORRECT:
                         self.state_tracker['SQUAT_COUNT']+=1
+                        self.state_tracker['SQUAT_TOTAL']+=1
                         play_sound = str(self.state_tracker['SQUAT_COUNT'])
-                        
-                    elif 's2' in self.state_tracker['state_seq'] and len(self.state_tracker['state_seq'])==1:
-                        self.state_tracker['IMPROPER_SQUAT']+=1
-                        play_sound = 'incorrect'
 
-                    elif self.state_tracker['INCORRECT_POSTURE']:
+                    elif rep_outcome == REP_IMPROPER:
                         self.state_tracker['IMPROPER_SQUAT']+=1
+                        self.state_tracker['IMPROPER_TOTAL']+=1
                         play_sound = 'incorrect'
                         
                     
-                    self.state_tracker['state_seq'] = []
+                    self.state_tracker['state_seq'] = SEQ_EMPTY
                     self.state_tracker['INCORRECT_POSTURE'] = False
 
 
@@ -402,13 +321,13 @@ class ProcessFrame:
                         
 
                     elif hip_vertical_angle < self.thresholds['HIP_THRESH'][0] and \
-                         self.state_tracker['state_seq'].count('s2')==1:
+                         SEQ_SINGLE_S2[self.state_tracker['state_seq']]:
                             self.state_tracker['DISPLAY_TEXT'][1] = True
                         
                                         
                     
                     if self.thresholds['KNEE_THRESH'][0] < knee_vertical_angle < self.thresholds['KNEE_THRESH'][1] and \
-                       self.state_tracker['state_seq'].count('s2')==1:
+                       SEQ_SINGLE_S2[self.state_tracker['state_seq']]:
                         self.state_tracker['LOWER_HIPS'] = True
 
 
@@ -451,77 +370,40 @@ class ProcessFrame:
                 # -------------------------------------------------------------------------------------------------------
               
 
-
-                hip_text_coord_x = hip_coord[0] + 10
-                knee_text_coord_x = knee_coord[0] + 15
-                ankle_text_coord_x = ankle_coord[0] + 10
-
-                if self.flip_frame:
-                    frame = cv2.flip(frame, 1)
-                    hip_text_coord_x = frame_width - hip_coord[0] + 10
-                    knee_text_coord_x = frame_width - knee_coord[0] + 15
-                    ankle_text_coord_x = frame_width - ankle_coord[0] + 10
-
-                
                 
-                if 's3' in self.state_tracker['state_seq'] or current_state == 's1':
+                if SEQ_HAS_S3[self.state_tracker['state_seq']] or current_state == 's1':
                     self.state_tracker['LOWER_HIPS'] = False
 
                 self.state_tracker['COUNT_FRAMES'][self.state_tracker['DISPLAY_TEXT']]+=1
 
-                frame = self._show_feedback(frame, self.state_tracker['COUNT_FRAMES'], self.FEEDBACK_ID_MAP, self.state_tracker['LOWER_HIPS'])
-
+                # Feedback shown on this frame, before expired messages are cleared below.
+                feedback_ids = np.flatnonzero(self.state_tracker['COUNT_FRAMES']).tolist()
 
 
                 if display_inactivity:
-                    # cv2.putText(frame, 'Resetting COUNTERS due to inactivity!!!', (10, frame_height - 20), self.font, 0.5, self.COLORS['blue'], 2, lineType=self.linetype)
                     play_sound = 'reset_counters'
                     self.state_tracker['start_inactive_time'] = time.perf_counter()
                     self.state_tracker['INACTIVE_TIME'] = 0.0
 
-                # Display current state realtime
-                cv2.putText(frame, f"State: {current_state}", (frame_width - 150, frame_height - 30), 
-                            self.font, 0.6, self.COLORS['yellow'], 2, lineType=self.linetype)
-
-                
-                cv2.putText(frame, str(int(hip_vertical_angle)), (hip_text_coord_x, hip_coord[1]), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
-                cv2.putText(frame, str(int(knee_vertical_angle)), (knee_text_coord_x, knee_coord[1]+10), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
-                cv2.putText(frame, str(int(ankle_vertical_angle)), (ankle_text_coord_x, ankle_coord[1]), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
-
-                 
-                draw_text(
-                    frame, 
-                    "CORRECT: " + str(self.state_tracker['SQUAT_COUNT']), 
-                    pos=(int(frame_width*0.68), 30),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(18, 185, 0)
-                )  
-                
-
-                draw_text(
-                    frame, 
-                    "INCORRECT: " + str(self.state_tracker['IMPROPER_SQUAT']), 
-                    pos=(int(frame_width*0.68), 80),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(221, 0, 0),
-                    
-                )  
-                
                 
                 self.state_tracker['DISPLAY_TEXT'][self.state_tracker['COUNT_FRAMES'] > self.thresholds['CNT_FRAME_THRESH']] = False
                 self.state_tracker['COUNT_FRAMES'][self.state_tracker['COUNT_FRAMES'] > self.thresholds['CNT_FRAME_THRESH']] = 0    
                 self.state_tracker['prev_state'] = current_state
+
+                result['aligned'] = True
+                result['use_left'] = use_left
+                result['state'] = current_state
+                result['hip_vertical_angle'] = hip_vertical_angle
+                result['knee_vertical_angle'] = knee_vertical_angle
+                result['ankle_vertical_angle'] = ankle_vertical_angle
+                result['feedback_ids'] = feedback_ids
+                result['lower_hips'] = self.state_tracker['LOWER_HIPS']
                                   
 
        
         
         else:
 
-            if self.flip_frame:
-                frame = cv2.flip(frame, 1)
-
             end_time = time.perf_counter()
             self.state_tracker['INACTIVE_TIME'] += end_time - self.state_tracker['start_inactive_time']
 
@@ -530,31 +412,10 @@ class ProcessFrame:
             if self.state_tracker['INACTIVE_TIME'] >= self.thresholds['INACTIVE_THRESH']:
                 self.state_tracker['SQUAT_COUNT'] = 0
                 self.state_tracker['IMPROPER_SQUAT'] = 0
-                # cv2.putText(frame, 'Resetting SQUAT_COUNT due to inactivity!!!', (10, frame_height - 25), self.font, 0.7, self.COLORS['blue'], 2)
                 display_inactivity = True
 
             self.state_tracker['start_inactive_time'] = end_time
 
-            draw_text(
-                    frame, 
-                    "CORRECT: " + str(self.state_tracker['SQUAT_COUNT']), 
-                    pos=(int(frame_width*0.68), 30),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(18, 185, 0)
-                )  
-                
-
-            draw_text(
-                    frame, 
-                    "INCORRECT: " + str(self.state_tracker['IMPROPER_SQUAT']), 
-                    pos=(int(frame_width*0.68), 80),
-                    text_color=(255, 255, 230),
-                    font_scale=0.7,
-                    text_color_bg=(221, 0, 0),
-                    
-                )  
-
             if display_inactivity:
                 play_sound = 'reset_counters'
                 self.state_tracker['start_inactive_time'] = time.perf_counter()
@@ -570,9 +431,218 @@ class ProcessFrame:
             self.state_tracker['DISPLAY_TEXT'] = np.full((5,), False)
             self.state_tracker['COUNT_FRAMES'] = np.zeros((5,), dtype=np.int64)
             self.state_tracker['start_inactive_time_front'] = time.perf_counter()
+
+        result['play_sound'] = play_sound
+        result['SQUAT_COUNT'] = self.state_tracker['SQUAT_COUNT']
+        result['IMPROPER_SQUAT'] = self.state_tracker['IMPROPER_SQUAT']
+
+        timings.record('state', time.perf_counter() - stage_start)
+
+        return result
+
+
+
+    def draw(self, frame, result):
+        """Render the skeleton, angles, feedback and counters of an analyze() result onto the frame."""
+
+        frame_height, frame_width, _ = frame.shape
+
+        if result['detected'] and not result['aligned']:
+            coords = result['coords']
+
+            cv2.circle(frame, coords[self.dict_features['nose']], 7, self.COLORS['white'], -1)
+            cv2.circle(frame, coords[self.left_features['shoulder']], 7, self.COLORS['yellow'], -1)
+            cv2.circle(frame, coords[self.right_features['shoulder']], 7, self.COLORS['magenta'], -1)
+
+            if self.flip_frame:
+                frame = cv2.flip(frame, 1, dst=frame)
+
+            self._show_counters(frame, frame_width)
+            
+            
+            draw_text(
+                frame, 
+                'CAMERA NOT ALIGNED PROPERLY!!!', 
+                pos=(30, frame_height-60),
+                text_color=(255, 255, 230),
+                font_scale=0.65,
+                text_color_bg=(255, 153, 0),
+            ) 
+            
+            
+            draw_text(
+                frame, 
+                'OFFSET ANGLE: '+str(result['offset_angle']), 
+                pos=(30, frame_height-30),
+                text_color=(255, 255, 230),
+                font_scale=0.65,
+                text_color_bg=(255, 153, 0),
+            ) 
+
+        elif result['detected']:
+            coords = result['coords']
+            features = self.left_features if result['use_left'] else self.right_features
+
+            shldr_coord, elbow_coord, wrist_coord, hip_coord, knee_coord, ankle_coord, foot_coord = \
+                                (coords[idx] for idx in features.values())
+
+            multiplier = -1 if result['use_left'] else 1
+
+            hip_vertical_angle = result['hip_vertical_angle']
+            knee_vertical_angle = result['knee_vertical_angle']
+            ankle_vertical_angle = result['ankle_vertical_angle']
+
+
+            # ------------------- Verical Angle drawing ------------------
+            
+            cv2.ellipse(frame, hip_coord, (30, 30), 
+                        angle = 0, startAngle = -90, endAngle = -90+multiplier*hip_vertical_angle, 
+                        color = self.COLORS['white'], thickness = 3, lineType = self.linetype)
+
+            draw_dotted_line(frame, hip_coord, start=hip_coord[1]-80, end=hip_coord[1]+20, line_color=self.COLORS['blue'])
+
+
+
+
+            cv2.ellipse(frame, knee_coord, (20, 20), 
+                        angle = 0, startAngle = -90, endAngle = -90-multiplier*knee_vertical_angle, 
+                        color = self.COLORS['white'], thickness = 3,  lineType = self.linetype)
+
+            draw_dotted_line(frame, knee_coord, start=knee_coord[1]-50, end=knee_coord[1]+20, line_color=self.COLORS['blue'])
+
+
+
+            cv2.ellipse(frame, ankle_coord, (30, 30),
+                        angle = 0, startAngle = -90, endAngle = -90 + multiplier*ankle_vertical_angle,
+                        color = self.COLORS['white'], thickness = 3,  lineType=self.linetype)
+
+            draw_dotted_line(frame, ankle_coord, start=ankle_coord[1]-50, end=ankle_coord[1]+20, line_color=self.COLORS['blue'])
+
+            # ------------------------------------------------------------
+    
+            
+            # Join landmarks.
+            cv2.line(frame, shldr_coord, elbow_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
+            cv2.line(frame, wrist_coord, elbow_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
+            cv2.line(frame, shldr_coord, hip_coord, self.COLORS['light_blue'], 4, lineType=self.linetype)
+            cv2.line(frame, knee_coord, hip_coord, self.COLORS['light_blue'], 4,  lineType=self.linetype)
+            cv2.line(frame, ankle_coord, knee_coord,self.COLORS['light_blue'], 4,  lineType=self.linetype)
+            cv2.line(frame, ankle_coord, foot_coord, self.COLORS['light_blue'], 4,  lineType=self.linetype)
+            
+            # Plot landmark points
+            cv2.circle(frame, shldr_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, elbow_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, wrist_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, hip_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, knee_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, ankle_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+            cv2.circle(frame, foot_coord, 7, self.COLORS['yellow'], -1,  lineType=self.linetype)
+
+
+            hip_text_coord_x = hip_coord[0] + 10
+            knee_text_coord_x = knee_coord[0] + 15
+            ankle_text_coord_x = ankle_coord[0] + 10
+
+            if self.flip_frame:
+                frame = cv2.flip(frame, 1, dst=frame)
+                hip_text_coord_x = frame_width - hip_coord[0] + 10
+                knee_text_coord_x = frame_width - knee_coord[0] + 15
+                ankle_text_coord_x = frame_width - ankle_coord[0] + 10
+
+
+            frame = self._show_feedback(frame, result['feedback_ids'], self.FEEDBACK_ID_MAP, result['lower_hips'])
+
+
+            # Display current state realtime
+            cv2.putText(frame, f"State: {result['state']}", (frame_width - 150, frame_height - 30), 
+                        self.font, 0.6, self.COLORS['yellow'], 2, lineType=self.linetype)
+
+            
+            cv2.putText(frame, str(int(hip_vertical_angle)), (hip_text_coord_x, hip_coord[1]), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
+            cv2.putText(frame, str(int(knee_vertical_angle)), (knee_text_coord_x, knee_coord[1]+10), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
+            cv2.putText(frame, str(int(ankle_vertical_angle)), (ankle_text_coord_x, ankle_coord[1]), self.font, 0.6, self.COLORS['light_green'], 2, lineType=self.linetype)
+
+            self._show_counters(frame, frame_width)
+
+        else:
+
+            if self.flip_frame:
+                frame = cv2.flip(frame, 1, dst=frame)
+
+            self._show_counters(frame, frame_width)
+
+        return frame
+
+
+
+    def _draw_hud(self, frame):
+
+        stats = self.timings.summary()
+
+        hud = f"{stats['fps']:.1f} FPS | {stats['total_ms']:.1f} ms (pose {stats['inference_ms']:.1f} ms)"
+        if self.quality_mode is not None:
+            hud += f" | {self.quality_mode}"
+
+        cv2.putText(frame, hud, (10, 20), self.font, 0.5, self.COLORS['cyan'], 1, lineType=self.linetype)
+
+        return frame
+
+
+
+    def get_stats(self):
+        """Per-stage latency histograms, frame rate and buffer pool counters."""
+
+        stats = self.timings.stats()
+        stats['buffer_pool'] = self.buffer_pool.stats()
+
+        return stats
+
+
+
+    def snapshot(self):
+        """Serialize state_tracker (counters, rep sequence, feedback, inactivity timers), see session_snapshot."""
+
+        return snapshot_state(self.state_tracker)
+
+
+
+    def restore(self, data, count_transit=True):
+        """
+        Continue from a snapshot() taken in this or another process.
+
+        The thresholds are not part of the snapshot: restore into a ProcessFrame
+        created with the same mode.
+        """
+
+        return restore_state(self.state_tracker, data, count_transit=count_transit)
+
+
+
+    def process(self, frame: np.array, pose):
+
+        timings = self.timings
+        frame_start = time.perf_counter()
+
+        frame_height, frame_width, _ = frame.shape
+
+        # Process the image.
+        keypoints = pose.process(frame)
+
+        inference_end = time.perf_counter()
+        timings.record('inference', inference_end - frame_start)
+        timings.inference_span = (frame_start, inference_end)
+
+        result = self.analyze(keypoints, frame_width, frame_height)
+        play_sound = result['play_sound']
+
+        drawing_start = time.perf_counter()
+        frame = self.draw(frame, result)
+        timings.record('drawing', time.perf_counter() - drawing_start)
             
         # Add MPJPE evaluation if enabled
-        if self.evaluate_mpjpe and 'keypoints' in locals() and keypoints.pose_landmarks:
+        if self.evaluate_mpjpe and keypoints.pose_landmarks:
+            mpjpe_start = time.perf_counter()
+
             # Format the predicted landmarks
             pred_landmarks = format_landmark_array(keypoints, frame_width, frame_height)
             
@@ -597,16 +667,22 @@ class ProcessFrame:
                 overall_color = (0, 0, 255)  # Red for needs improvement
             
             # Draw MPJPE results on frame with color coding only if display_on_frame is enabled
-            if isinstance(self.thresholds, dict) and self.thresholds.get('DISPLAY_MPJPE_ON_FRAME', False):
+            if self.mpjpe_overlay and isinstance(self.thresholds, dict) and self.thresholds.get('DISPLAY_MPJPE_ON_FRAME', False):
                 frame = draw_mpjpe_results(frame, mpjpe_value, joint_errors, 
                                          position=(30, 180), 
-                                         overall_color=overall_color)
+                                         overall_color=overall_color,
+                                         in_place=True)
             
             # Visualize the comparison between predicted and ground truth landmarks
             # This shows lines connecting predicted and ground truth points
-            if isinstance(self.thresholds, dict) and self.thresholds.get('VISUALIZE_MPJPE_COMPARISON', False):
-                frame = visualize_mpjpe_comparison(frame, pred_landmarks, gt_landmarks)
+            if self.mpjpe_overlay and isinstance(self.thresholds, dict) and self.thresholds.get('VISUALIZE_MPJPE_COMPARISON', False):
+                frame = visualize_mpjpe_comparison(frame, pred_landmarks, gt_landmarks, in_place=True)
+
+            timings.record('mpjpe', time.perf_counter() - mpjpe_start)
+
+        timings.end_frame(time.perf_counter() - frame_start)
+
+        if self.show_hud:
+            frame = self._draw_hud(frame)
             
         return frame, play_sound
-
-                    
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from collections import Counter
+
+
+# Operator toggles. A session requests a capture with the hidden ?profile=<seconds>
+# query parameter; when SQUAT_PROFILE_TOKEN is set the request must also carry a
+# matching ?profile_token=. SQUAT_PROFILE_SECONDS profiles headless runs.
+PROFILE_SECONDS_ENV = 'SQUAT_PROFILE_SECONDS'
+PROFILE_TOKEN_ENV = 'SQUAT_PROFILE_TOKEN'
+PROFILE_DIR_ENV = 'SQUAT_PROFILE_DIR'
+
+MAX_PROFILE_SECONDS = 300.0
+
+
+def profile_dir():
+    path = os.environ.get(PROFILE_DIR_ENV, os.path.join(tempfile.gettempdir(), 'squat_vision_profiles'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+
+def requested_profile_seconds(query_params=None):
+    """
+    Seconds to profile for this session, or None when no capture was requested.
+
+    Pages pass st.query_params and are profiled only on request;
+    SQUAT_PROFILE_SECONDS applies only to callers without query parameters.
+    """
+
+    if query_params is None:
+        # Headless runs (benchmarks, workers) have no query parameters.
+        value = os.environ.get(PROFILE_SECONDS_ENV)
+    elif query_params.get('profile'):
+        token = os.environ.get(PROFILE_TOKEN_ENV)
+        if token and query_params.get('profile_token') != token:
+            return None
+        value = query_params.get('profile')
+    else:
+        return None
+
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return min(seconds, MAX_PROFILE_SECONDS) if seconds > 0 else None
+
+
+
+class SamplingProfiler:
+    """
+    Sample the Python stack of a single thread for a fixed duration.
+
+    A daemon thread reads the target thread's current frame every interval and
+    counts identical stacks; the result is written in the collapsed-stack format
+    ("frame;frame;frame count") read by flamegraph.pl and speedscope. Nothing is
+    installed in the target thread, so other sessions pay no overhead.
+    """
+
+    def __init__(self, thread_id, duration, interval=0.005, label='session', output_path=None):
+        self.thread_id = thread_id
+        self.duration = duration
+        self.interval = interval
+        self.output_path = output_path or os.path.join(
+            profile_dir(), f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{thread_id}.collapsed")
+
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+
+        return ';'.join(reversed(names))
+
+
+    def _run(self):
+        deadline = time.monotonic() + self.duration
+
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                # Target thread finished.
+                break
+
+            self.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+            del frame
+
+            self._stop.wait(self.interval)
+
+        self.write()
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'profiler-{self.thread_id}', daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self, wait=True):
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def write(self):
+        with open(self.output_path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        return self.output_path
+
+
+
+class ProfileTrigger:
+    """
+    Start a SamplingProfiler at most once, on whichever thread calls maybe_start().
+
+    Created per session with the requested duration; the live page calls
+    maybe_start() from the frame callback so the callback thread is profiled.
+    """
+
+    def __init__(self, seconds, label='session'):
+        self.seconds = seconds
+        self.label = label
+        self.profiler = None
+        self._lock = threading.Lock()
+
+
+    def maybe_start(self):
+        if self.seconds is None or self.profiler is not None:
+            return self.profiler
+
+        with self._lock:
+            if self.profiler is None:
+                self.profiler = SamplingProfiler(threading.get_ident(), self.seconds, label=self.label).start()
+
+        return self.profiler
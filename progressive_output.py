@@ -0,0 +1,210 @@
+"""
+Progressive HLS output of processed videos, playable while processing runs.
+
+Frames are piped to an ffmpeg process that encodes H.264 and writes short
+fMP4 segments plus an event playlist. The playlist is served by Streamlit's
+static file serving (static/hls, see setup.sh) and played with hls.js, so
+the first reps can be watched a few seconds after processing starts. When
+processing is done the segments are remuxed, without re-encoding, into one
+mp4 for download.
+
+Requires the ffmpeg binary (SQUAT_FFMPEG, default: ffmpeg on PATH); callers
+check ffmpeg_available() and fall back to the buffered download without it.
+"""
+import os
+import time
+import shutil
+import weakref
+import threading
+import subprocess
+
+from utils import sweep_dir
+
+
+FFMPEG_ENV = 'SQUAT_FFMPEG'
+
+# Streamlit serves <app dir>/static under app/static when enableStaticServing is on.
+HLS_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'hls')
+HLS_URL = 'app/static/hls'
+
+SEGMENT_SECONDS = 2
+
+PLAYLIST = 'index.m3u8'
+
+# Outputs older than this are swept, then the oldest ones until under HLS_DIR_MAX_BYTES.
+HLS_MAX_AGE = 3600.0
+HLS_DIR_MAX_BYTES = 2 * (1 << 30)
+
+HLS_JS_URL = 'https://cdn.jsdelivr.net/npm/hls.js@1'
+
+# HlsWriters alive in this process; their outputs are still being encoded or remuxed.
+_writers = weakref.WeakSet()
+_writers_lock = threading.Lock()
+
+
+def ffmpeg_path():
+    return shutil.which(os.environ.get(FFMPEG_ENV, 'ffmpeg'))
+
+
+
+def ffmpeg_available():
+    return ffmpeg_path() is not None
+
+
+
+def cleanup_hls_dir(root=HLS_ROOT, max_bytes=HLS_DIR_MAX_BYTES, max_age=HLS_MAX_AGE):
+    """Remove outputs not written to for max_age, then oldest first until under max_bytes; live writers are kept."""
+
+    with _writers_lock:
+        in_use = {writer.path for writer in _writers}
+
+    sweep_dir(root, max_bytes, max_age, in_use)
+
+
+
+class HlsWriter:
+    """
+    Encode RGB frames into an HLS event playlist of fMP4 segments.
+
+    Every segment starts with a keyframe (GOP = segment length), so a
+    segment is published as soon as its SEGMENT_SECONDS of video are encoded.
+    """
+
+    def __init__(self, name, width, height, fps, segment_seconds=SEGMENT_SECONDS, root=HLS_ROOT):
+        """
+        Args:
+            name: Output directory name under root, e.g. a session id plus a counter.
+            width: Frame width.
+            height: Frame height.
+            fps: Frame rate of the input video.
+            segment_seconds: Target segment length.
+            root: Directory of all outputs (served as HLS_URL).
+        """
+
+        ffmpeg = ffmpeg_path()
+        if ffmpeg is None:
+            raise RuntimeError(f'ffmpeg not found, install it or point {FFMPEG_ENV} at the binary')
+
+        cleanup_hls_dir(root)
+
+        self.name = name
+        self.path = os.path.join(root, name)
+        with _writers_lock:
+            _writers.add(self)
+        self.playlist_path = os.path.join(self.path, PLAYLIST)
+        self.url = f'{HLS_URL}/{name}/{PLAYLIST}'
+        self.width = width
+        self.height = height
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.first_segment_time = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._log = open(os.path.join(self.path, 'ffmpeg.log'), 'wb')
+
+        gop = max(int(round(fps * segment_seconds)), 1)
+        command = [
+            ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', f'{fps:g}', '-i', 'pipe:0',
+            # yuv420p needs even dimensions
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-pix_fmt', 'yuv420p',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'event',
+            '-hls_segment_type', 'fmp4', '-hls_flags', 'independent_segments+temp_file',
+            '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', os.path.join(self.path, 'segment_%05d.m4s'),
+            self.playlist_path,
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+
+
+    def write(self, frame):
+        """Send one RGB frame of the configured size to the encoder."""
+
+        try:
+            self._process.stdin.write(memoryview(frame).cast('B') if frame.flags.c_contiguous else frame.tobytes())
+        except BrokenPipeError:
+            raise RuntimeError(f'ffmpeg exited: {self._error()}') from None
+
+        self.frames += 1
+
+
+    def segments(self):
+        """Number of segments published in the playlist so far."""
+
+        try:
+            with open(self.playlist_path) as file:
+                count = file.read().count('#EXTINF')
+        except FileNotFoundError:
+            return 0
+
+        if count and self.first_segment_time is None:
+            self.first_segment_time = time.perf_counter() - self.started
+
+        return count
+
+
+    def ready(self):
+        """Whether playback can start (the first segment is published)."""
+
+        return self.segments() > 0
+
+
+    def _error(self):
+        if not self._log.closed:
+            self._log.flush()
+        with open(self._log.name, 'rb') as file:
+            return file.read().decode(errors='replace').strip()[-500:] or f'exit code {self._process.poll()}'
+
+
+    def close(self):
+        """Flush the encoder and end the playlist (players stop polling for segments)."""
+
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        returncode = self._process.wait()
+        self._log.close()
+
+        if returncode != 0:
+            raise RuntimeError(f'ffmpeg failed: {self._error()}')
+
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        self._log.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+    def to_mp4(self, output_path):
+        """Remux the finished segments into one mp4 (stream copy, no re-encode)."""
+
+        subprocess.run([ffmpeg_path(), '-hide_banner', '-loglevel', 'error', '-y', '-i', self.playlist_path,
+                        '-c', 'copy', '-movflags', '+faststart', output_path], check=True, capture_output=True)
+
+        return output_path
+
+
+
+def player_html(url, height=400):
+    """HTML of an hls.js player for a playlist URL (native HLS on Safari), for st.components.v1.html."""
+
+    return f"""
+<video id="player" controls muted autoplay playsinline style="width:100%; max-height:{height}px; background:#000">
+</video>
+<script src="{HLS_JS_URL}"></script>
+<script>
+  const video = document.getElementById('player');
+  const source = new URL('{url}', document.baseURI).href;
+  if (window.Hls && Hls.isSupported()) {{
+    const hls = new Hls({{liveDurationInfinity: false}});
+    hls.loadSource(source);
+    hls.attachMedia(video);
+  }} else {{
+    video.src = source;
+  }}
+</script>
+"""
@@ -0,0 +1,423 @@
+"""
+Memory-budgeted store for large per-session objects of the Streamlit pages.
+
+Processed frames, encoded videos and pose instances are kept here under the
+page's session id instead of in st.session_state, so the whole process
+shares one byte budget (SQUAT_ARTIFACT_BUDGET_MB). When the budget is
+exceeded the least recently used artifacts are spilled to disk (frames,
+bytes) or dropped (anything else, e.g. a pose instance the page recreates),
+and sessions idle for IDLE_TIMEOUT are removed with their files. Data dropped
+over the disk budget is remembered as dropped, so pages can tell it was too
+large to keep instead of serving what is left of it.
+"""
+import os
+import sys
+import time
+import shutil
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import REGISTRY
+
+
+BUDGET_ENV = 'SQUAT_ARTIFACT_BUDGET_MB'
+DEFAULT_BUDGET_MB = 1024
+
+# Spilled artifacts beyond this are dropped, oldest first.
+DISK_BUDGET_ENV = 'SQUAT_ARTIFACT_DISK_MB'
+DEFAULT_DISK_BUDGET_MB = 8192
+
+SPILL_DIR = os.path.join(tempfile.gettempdir(), 'squat_vision_artifacts')
+
+# Sessions not touched for this long are removed; checked every REAP_INTERVAL.
+IDLE_TIMEOUT = 1800.0
+REAP_INTERVAL = 60.0
+
+# Rough resident size of a mediapipe Pose graph, for put(..., nbytes=POSE_NBYTES).
+POSE_NBYTES = 48 << 20
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+
+    return sys.getsizeof(value)
+
+
+
+def _spillable(value):
+    return isinstance(value, (np.ndarray, bytes, bytearray))
+
+
+
+class _Artifact:
+
+    def __init__(self, key, value, nbytes, pinned, close):
+        self.key = key
+        self.value = value
+        self.items = None
+        self.nbytes = nbytes
+        self.pinned = pinned
+        self.close = close
+        self.spillable = _spillable(value)
+        # Spill files and their sizes; a list artifact spills each in-memory run as one chunk.
+        self.chunks = []
+        self.disk_bytes = 0
+        # A list artifact is open until finish(); open lists are dropped last.
+        self.open = False
+        self.dropped = False
+
+
+
+class ArtifactStore:
+    """
+    Per-session artifacts under a process-wide memory budget with LRU eviction.
+
+    Values are stored with put(); frame sequences grow with append() and are
+    read back chunk by chunk with iterate(), so spilled frames never have to
+    be in memory all at once, and are closed with finish(). Pinned artifacts (e.g. a pose a frame callback
+    is using) count toward the budget but are only removed with their session.
+    """
+
+    def __init__(self, budget_bytes=None, disk_budget_bytes=None, spill_dir=SPILL_DIR, idle_timeout=IDLE_TIMEOUT,
+                 reap_interval=REAP_INTERVAL):
+        self.budget_bytes = budget_bytes or int(float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB)) * (1 << 20))
+        self.disk_budget_bytes = disk_budget_bytes or \
+            int(float(os.environ.get(DISK_BUDGET_ENV, DEFAULT_DISK_BUDGET_MB)) * (1 << 20))
+        self.spill_dir = spill_dir
+        self.idle_timeout = idle_timeout
+
+        # (session_id, name) -> _Artifact, least recently used first.
+        self._artifacts = OrderedDict()
+        self._last_seen = {}
+        self._lock = threading.RLock()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.spills = 0
+        self.drops = 0
+        self.expired = 0
+
+        self._running = True
+        if reap_interval:
+            self._reaper = threading.Thread(target=self._reap_loop, args=(reap_interval,), name='session-artifacts',
+                                            daemon=True)
+            self._reaper.start()
+
+
+    def _reap_loop(self, interval):
+        while self._running:
+            time.sleep(interval)
+            self.expire_idle()
+
+
+    def touch(self, session_id):
+        """Mark a session as active (reruns and frame callbacks) so it is not expired."""
+
+        self._last_seen[session_id] = time.monotonic()
+
+
+    def _use(self, key):
+        self._artifacts.move_to_end(key)
+        self.touch(key[0])
+
+
+    def put(self, session_id, name, value, nbytes=None, pinned=False, close=None):
+        """
+        Store a value, replacing the previous one of that name.
+
+        Args:
+            session_id: The page session (e.g. its metrics_session_id).
+            name: Artifact name within the session.
+            value: The object. numpy arrays and bytes are spilled to disk on
+                eviction, anything else is dropped.
+            nbytes: Memory the value holds, default: measured.
+            pinned: Never evict, only remove with the session.
+            close: Called when the value is dropped or its session removed.
+
+        Returns:
+            The value.
+        """
+
+        with self._lock:
+            self.discard(session_id, name)
+            key = (session_id, name)
+            artifact = self._artifacts[key] = _Artifact(key, value, _nbytes(value) if nbytes is None else nbytes,
+                                                        pinned, close)
+            self.memory_bytes += artifact.nbytes
+            self._use(key)
+            self._enforce_budget()
+
+        return value
+
+
+    def append(self, session_id, name, item):
+        """
+        Append an array (e.g. a processed frame) to a list artifact.
+
+        Returns:
+            False if the list was dropped over the disk budget; the item is
+            discarded, as are all further items until the name is discarded.
+        """
+
+        with self._lock:
+            key = (session_id, name)
+            artifact = self._artifacts.get(key)
+            if artifact is None:
+                artifact = self._artifacts[key] = _Artifact(key, None, 0, False, None)
+                artifact.items = []
+                artifact.spillable = True
+                artifact.open = True
+            elif artifact.dropped:
+                self._use(key)
+                return False
+
+            artifact.items.append(item)
+            artifact.nbytes += _nbytes(item)
+            self.memory_bytes += _nbytes(item)
+            self._use(key)
+            self._enforce_budget()
+
+            return not artifact.dropped
+
+
+    def finish(self, session_id, name):
+        """Mark a list artifact as complete; until then it is only dropped when nothing else is left."""
+
+        with self._lock:
+            artifact = self._artifacts.get((session_id, name))
+            if artifact is not None:
+                artifact.open = False
+
+
+    def dropped(self, session_id, name):
+        """Whether the artifact was dropped over the disk budget (too large to keep)."""
+
+        artifact = self._artifacts.get((session_id, name))
+
+        return artifact is not None and artifact.dropped
+
+
+    def get(self, session_id, name, default=None):
+        """The stored value, loaded back from disk if it was spilled; default if missing or dropped."""
+
+        with self._lock:
+            key = (session_id, name)
+            artifact = self._artifacts.get(key)
+            if artifact is None or artifact.dropped:
+                return default
+            if artifact.items is not None:
+                return list(self.iterate(session_id, name))
+
+            self._use(key)
+            value = artifact.value
+            if value is None:
+                with open(artifact.chunks[0], 'rb') as file:
+                    value = artifact.value = pickle.load(file)
+                artifact.nbytes = _nbytes(value)
+                self.memory_bytes += artifact.nbytes
+                self._remove_files(artifact)
+                # May spill it again right away; the caller keeps its reference.
+                self._enforce_budget()
+
+            return value
+
+
+    def iterate(self, session_id, name):
+        """Items of a list artifact in order, spilled chunks first, without loading them all."""
+
+        with self._lock:
+            artifact = self._artifacts.get((session_id, name))
+            if artifact is None or artifact.dropped:
+                return
+            self._use(artifact.key)
+            chunks = list(artifact.chunks)
+            items = list(artifact.items)
+
+        for path in chunks:
+            with open(path, 'rb') as file:
+                yield from pickle.load(file)
+
+        yield from items
+
+
+    def __contains__(self, key):
+        artifact = self._artifacts.get(key)
+
+        return artifact is not None and not artifact.dropped
+
+
+    def _remove_files(self, artifact):
+        for path in artifact.chunks:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self.disk_bytes -= artifact.disk_bytes
+        artifact.chunks = []
+        artifact.disk_bytes = 0
+
+
+    def _release(self, artifact):
+        self.memory_bytes -= artifact.nbytes
+        self._remove_files(artifact)
+        if artifact.close is not None and artifact.value is not None:
+            artifact.close()
+        artifact.value = artifact.items = None
+        artifact.nbytes = 0
+
+
+    def discard(self, session_id, name):
+        with self._lock:
+            artifact = self._artifacts.pop((session_id, name), None)
+            if artifact is not None:
+                self._release(artifact)
+
+
+    def drop_session(self, session_id):
+        """Remove every artifact and spill file of a session."""
+
+        with self._lock:
+            for key in [key for key in self._artifacts if key[0] == session_id]:
+                self._release(self._artifacts.pop(key))
+            self._last_seen.pop(session_id, None)
+
+        shutil.rmtree(os.path.join(self.spill_dir, session_id), ignore_errors=True)
+
+
+    def expire_idle(self, now=None):
+        """Drop sessions idle for longer than idle_timeout; returns their ids."""
+
+        now = time.monotonic() if now is None else now
+        expired = [sid for sid, seen in list(self._last_seen.items()) if now - seen > self.idle_timeout]
+
+        for session_id in expired:
+            self.drop_session(session_id)
+        self.expired += len(expired)
+
+        return expired
+
+
+    def _spill(self, artifact):
+        directory = os.path.join(self.spill_dir, artifact.key[0])
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{artifact.key[1]}-{len(artifact.chunks)}-{time.monotonic_ns()}.pkl')
+
+        with open(path, 'wb') as file:
+            pickle.dump(artifact.items if artifact.items is not None else artifact.value, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+        size = os.path.getsize(path)
+        artifact.chunks.append(path)
+        artifact.disk_bytes += size
+        self.disk_bytes += size
+        self.memory_bytes -= artifact.nbytes
+        artifact.nbytes = 0
+        if artifact.items is not None:
+            artifact.items = []
+        else:
+            artifact.value = None
+        self.spills += 1
+
+
+    def _drop(self, artifact, remember=False):
+        if remember:
+            # Kept as a marker: appends stop and readers see it as too large, not as missing.
+            self._release(artifact)
+            artifact.dropped = True
+        else:
+            del self._artifacts[artifact.key]
+            self._release(artifact)
+        self.drops += 1
+
+
+    def _enforce_budget(self):
+        for artifact in list(self._artifacts.values()):
+            if self.memory_bytes <= self.budget_bytes:
+                break
+            if artifact.pinned or artifact.nbytes == 0:
+                continue
+            if artifact.spillable:
+                self._spill(artifact)
+            else:
+                self._drop(artifact)
+
+        # Finished artifacts go first, least recently used first; a list still
+        # being appended only when they are not enough.
+        for artifact in sorted(self._artifacts.values(), key=lambda artifact: artifact.open):
+            if self.disk_bytes <= self.disk_budget_bytes:
+                break
+            if artifact.disk_bytes:
+                self._drop(artifact, remember=True)
+
+
+    def stats(self):
+        now = time.monotonic()
+
+        with self._lock:
+            sessions = {}
+            for (session_id, name), artifact in self._artifacts.items():
+                session = sessions.setdefault(session_id, {'memory_bytes': 0, 'disk_bytes': 0, 'artifacts': 0})
+                session['memory_bytes'] += artifact.nbytes
+                session['disk_bytes'] += artifact.disk_bytes
+                session['artifacts'] += 1
+            for session_id, session in sessions.items():
+                session['idle_s'] = round(now - self._last_seen.get(session_id, now), 1)
+
+            return {
+                'budget_bytes': self.budget_bytes,
+                'memory_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes,
+                'spills': self.spills,
+                'drops': self.drops,
+                'expired': self.expired,
+                'sessions': sessions
+            }
+
+
+    def collect_metrics(self):
+        """Metric families for MetricsRegistry.add_collector."""
+
+        stats = self.stats()
+
+        return [
+            ('squat_artifact_bytes', 'gauge', 'Bytes held by per-session artifacts, in memory or spilled to disk.',
+             [({'session': sid, 'location': location}, session[f'{location}_bytes'])
+              for sid, session in stats['sessions'].items() for location in ('memory', 'disk')]),
+            ('squat_artifact_budget_bytes', 'gauge', 'Memory budget of the per-session artifacts.',
+             [({}, stats['budget_bytes'])]),
+            ('squat_artifact_evictions_total', 'counter', 'Artifacts evicted over the memory or disk budget.',
+             [({'action': 'spill'}, stats['spills']), ({'action': 'drop'}, stats['drops'])]),
+            ('squat_artifact_sessions_expired_total', 'counter', 'Idle sessions removed with their artifacts.',
+             [({}, stats['expired'])]),
+        ]
+
+
+    def close(self):
+        self._running = False
+        for session_id in {key[0] for key in list(self._artifacts)} | set(self._last_seen):
+            self.drop_session(session_id)
+
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """Process-wide ArtifactStore shared by all Streamlit sessions, exported in the metrics."""
+
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+            REGISTRY.add_collector(_store.collect_metrics)
+
+    return _store
@@ -0,0 +1,393 @@
+"""
+Persistent history of completed squat sessions with daily and weekly rollups.
+
+Sessions are queued in memory and written in batches (one transaction per
+batch) to a local SQLite database. Every inserted session also updates the
+rollup rows of its day and ISO week in the same transaction, so dashboards
+read a handful of pre-aggregated rows instead of scanning raw sessions.
+"""
+import os
+import sys
+import time
+import atexit
+import sqlite3
+import datetime
+import threading
+
+import numpy as np
+
+
+HISTORY_DB_ENV = 'SQUAT_HISTORY_DB'
+DEFAULT_HISTORY_DB = os.path.join(os.path.expanduser('~'), '.squat_vision', 'history.sqlite3')
+
+# Pending sessions are written once this many are queued or after FLUSH_INTERVAL seconds.
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 5.0
+
+PERIODS = ('day', 'week')
+
+DEFAULT_USER = 'anonymous'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    session_key TEXT UNIQUE,
+    user TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    source TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    day TEXT NOT NULL,
+    week TEXT NOT NULL,
+    frames INTEGER NOT NULL,
+    reps INTEGER NOT NULL,
+    improper INTEGER NOT NULL,
+    mpjpe_count INTEGER NOT NULL,
+    mpjpe_sum REAL NOT NULL,
+    mpjpe_min REAL,
+    mpjpe_max REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_user_day ON sessions (user, day);
+CREATE INDEX IF NOT EXISTS sessions_day ON sessions (day);
+CREATE INDEX IF NOT EXISTS sessions_mode_day ON sessions (mode, day);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    user TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    reps INTEGER NOT NULL,
+    improper INTEGER NOT NULL,
+    mpjpe_count INTEGER NOT NULL,
+    mpjpe_sum REAL NOT NULL,
+    mpjpe_min REAL,
+    mpjpe_max REAL,
+    PRIMARY KEY (period, user, mode, bucket)
+) WITHOUT ROWID;
+"""
+
+_INSERT_SESSION = """
+INSERT OR IGNORE INTO sessions (session_key, user, mode, source, started, ended, day, week, frames, reps, improper,
+                                mpjpe_count, mpjpe_sum, mpjpe_min, mpjpe_max)
+VALUES (:session_key, :user, :mode, :source, :started, :ended, :day, :week, :frames, :reps, :improper,
+        :mpjpe_count, :mpjpe_sum, :mpjpe_min, :mpjpe_max)
+"""
+
+# min()/max() of SQLite return NULL if either side is NULL, hence the coalesce.
+_UPSERT_ROLLUP = """
+INSERT INTO rollups (period, bucket, user, mode, sessions, frames, duration, reps, improper,
+                     mpjpe_count, mpjpe_sum, mpjpe_min, mpjpe_max)
+VALUES (:period, :bucket, :user, :mode, 1, :frames, :duration, :reps, :improper,
+        :mpjpe_count, :mpjpe_sum, :mpjpe_min, :mpjpe_max)
+ON CONFLICT (period, user, mode, bucket) DO UPDATE SET
+    sessions = sessions + 1,
+    frames = frames + excluded.frames,
+    duration = duration + excluded.duration,
+    reps = reps + excluded.reps,
+    improper = improper + excluded.improper,
+    mpjpe_count = mpjpe_count + excluded.mpjpe_count,
+    mpjpe_sum = mpjpe_sum + excluded.mpjpe_sum,
+    mpjpe_min = min(coalesce(mpjpe_min, excluded.mpjpe_min), coalesce(excluded.mpjpe_min, mpjpe_min)),
+    mpjpe_max = max(coalesce(mpjpe_max, excluded.mpjpe_max), coalesce(excluded.mpjpe_max, mpjpe_max))
+"""
+
+
+def period_buckets(timestamp):
+    """Local-time day ('2024-05-17') and ISO week ('2024-W20') of a Unix timestamp."""
+
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    year, week, _ = moment.isocalendar()
+
+    return moment.strftime('%Y-%m-%d'), f'{year}-W{week:02d}'
+
+
+
+def session_record(process_frame, mode, source, started, ended=None, user=None, session_key=None,
+                   frames=None, reps=None, improper=None, mpjpe_values=None):
+    """
+    Build a history record from a finished ProcessFrame (or RemoteSession / MultiAthleteProcessor).
+
+    Rep totals (which survive the inactivity reset of the displayed
+    counters) and MPJPE values default to the processor's; pass them to
+    record a part of a session (see SessionRecorder).
+    """
+
+    ended = time.time() if ended is None else ended
+    mpjpe_values = process_frame.mpjpe_values if mpjpe_values is None else mpjpe_values
+    day, week = period_buckets(started)
+
+    return {
+        'session_key': session_key,
+        'user': user or DEFAULT_USER,
+        'mode': mode.lower(),
+        'source': source,
+        'started': started,
+        'ended': ended,
+        'day': day,
+        'week': week,
+        'frames': int(process_frame.timings.frames if frames is None else frames),
+        'reps': int(process_frame.state_tracker['SQUAT_TOTAL'] if reps is None else reps),
+        'improper': int(process_frame.state_tracker['IMPROPER_TOTAL'] if improper is None else improper),
+        'mpjpe_count': len(mpjpe_values),
+        'mpjpe_sum': float(np.sum(mpjpe_values)) if len(mpjpe_values) else 0.0,
+        'mpjpe_min': float(np.min(mpjpe_values)) if len(mpjpe_values) else None,
+        'mpjpe_max': float(np.max(mpjpe_values)) if len(mpjpe_values) else None
+    }
+
+
+
+def _with_rates(row):
+    attempts = row['reps'] + row['improper']
+    row['error_rate'] = row['improper'] / attempts if attempts else 0.0
+    row['mpjpe_mean'] = row['mpjpe_sum'] / row['mpjpe_count'] if row['mpjpe_count'] else None
+
+    return row
+
+
+
+class SessionHistory:
+    """
+    Batched writer and query interface of the history database.
+
+    record() only queues; a background thread writes batches of BATCH_SIZE
+    sessions or whatever is pending every FLUSH_INTERVAL seconds. Sessions
+    with a session_key are written at most once, so retries are safe.
+    """
+
+    def __init__(self, path=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path or os.environ.get(HISTORY_DB_ENV, DEFAULT_HISTORY_DB)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+        self.written = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._flusher = threading.Thread(target=self._flush_loop, name='session-history', daemon=True)
+        self._flusher.start()
+
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+
+        return conn
+
+
+    def record(self, record):
+        """Queue a session_record() for the next batch."""
+
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self._wake.set()
+
+
+    def _flush_loop(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                # The batch stays queued (e.g. database is locked), the next interval retries it.
+                print(f'session-history: flush failed: {exc!r}', file=sys.stderr, flush=True)
+
+
+    def flush(self):
+        """Write every pending session and its rollup updates in one transaction."""
+
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+
+            if not batch:
+                return 0
+
+            try:
+                self._write(batch)
+            except BaseException:
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+
+            self.written += len(batch)
+
+            return len(batch)
+
+
+    def _write(self, batch):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for record in batch:
+                # Rollups only for sessions actually inserted (not seen before).
+                if conn.execute(_INSERT_SESSION, record).rowcount == 0:
+                    continue
+
+                rollup = {key: record[key] for key in ('user', 'mode', 'frames', 'reps', 'improper',
+                                                        'mpjpe_count', 'mpjpe_sum', 'mpjpe_min', 'mpjpe_max')}
+                rollup['duration'] = record['ended'] - record['started']
+                for period in PERIODS:
+                    conn.execute(_UPSERT_ROLLUP, dict(rollup, period=period, bucket=record[period]))
+            conn.execute('COMMIT')
+        except BaseException:
+            # BEGIN itself fails while another writer holds the lock.
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+
+    def rollups(self, period='day', user=None, mode=None, start=None, end=None):
+        """
+        Pre-aggregated history, oldest bucket first.
+
+        Args:
+            period: 'day' or 'week'.
+            user: Only this user, default: all users combined.
+            mode: Only this mode ('beginner'/'pro'), default: both combined.
+            start: First bucket to include ('2024-05-01' or '2024-W18').
+            end: Last bucket to include.
+
+        Returns:
+            One dict per bucket with sessions, frames, duration, reps,
+            improper, error_rate and mpjpe_mean/min/max.
+        """
+
+        if period not in PERIODS:
+            raise ValueError(f'unknown period {period!r}, expected one of {PERIODS}')
+
+        conditions, params = ['period = ?'], [period]
+        for column, value, operator in (('user', user, '='), ('mode', mode, '='),
+                                        ('bucket', start, '>='), ('bucket', end, '<=')):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                params.append(value.lower() if column == 'mode' else value)
+
+        query = ('SELECT bucket, SUM(sessions) AS sessions, SUM(frames) AS frames, SUM(duration) AS duration, '
+                 'SUM(reps) AS reps, SUM(improper) AS improper, SUM(mpjpe_count) AS mpjpe_count, '
+                 'SUM(mpjpe_sum) AS mpjpe_sum, MIN(mpjpe_min) AS mpjpe_min, MAX(mpjpe_max) AS mpjpe_max '
+                 f'FROM rollups WHERE {" AND ".join(conditions)} GROUP BY bucket ORDER BY bucket')
+
+        conn = self._connect()
+        try:
+            return [_with_rates(dict(row)) for row in conn.execute(query, params)]
+        finally:
+            conn.close()
+
+
+    def sessions(self, user=None, start_day=None, end_day=None, limit=100):
+        """Raw sessions, newest first."""
+
+        conditions, params = [], []
+        for column, value, operator in (('user', user, '='), ('day', start_day, '>='), ('day', end_day, '<=')):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                params.append(value)
+
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'SELECT * FROM sessions {where}ORDER BY started DESC LIMIT ?', params + [limit])
+            return [_with_rates(dict(row)) for row in rows]
+        finally:
+            conn.close()
+
+
+    def users(self):
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT user FROM rollups WHERE period = 'week' "
+                                                   "ORDER BY user")]
+        finally:
+            conn.close()
+
+
+    def close(self):
+        self._running = False
+        self._wake.set()
+        self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+
+class SessionRecorder:
+    """
+    Records a long-lived processor in parts, e.g. a live stream that is
+    started and stopped several times: each checkpoint() writes what
+    happened since the previous one as a session of its own.
+    """
+
+    def __init__(self, mode, source, user=None):
+        self.mode = mode
+        self.source = source
+        self.user = user
+        self.start(None)
+
+
+    def start(self, process_frame):
+        """Begin a new part at the processor's current counters (None: a fresh processor)."""
+
+        self.started = time.time()
+        self.frames = process_frame.timings.frames if process_frame is not None else 0
+        self.reps = process_frame.state_tracker['SQUAT_TOTAL'] if process_frame is not None else 0
+        self.improper = process_frame.state_tracker['IMPROPER_TOTAL'] if process_frame is not None else 0
+        self.mpjpe_index = len(process_frame.mpjpe_values) if process_frame is not None else 0
+
+
+    def checkpoint(self, process_frame, history=None):
+        """Record the part since the last checkpoint, if any frames were processed; returns the record."""
+
+        frames = process_frame.timings.frames - self.frames
+        if frames <= 0:
+            self.start(process_frame)
+            return None
+
+        tracker = process_frame.state_tracker
+        record = session_record(process_frame, self.mode, self.source, self.started, user=self.user, frames=frames,
+                                reps=tracker['SQUAT_TOTAL'] - self.reps,
+                                improper=tracker['IMPROPER_TOTAL'] - self.improper,
+                                mpjpe_values=process_frame.mpjpe_values[self.mpjpe_index:])
+        (history or get_history()).record(record)
+        self.start(process_frame)
+
+        return record
+
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Process-wide SessionHistory on SQUAT_HISTORY_DB, flushed at exit."""
+
+    global _history
+
+    with _history_lock:
+        if _history is None:
+            _history = SessionHistory()
+            atexit.register(_history.close)
+
+    return _history
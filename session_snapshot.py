@@ -0,0 +1,154 @@
+"""
+Compact, versioned snapshots of ProcessFrame.state_tracker.
+
+A snapshot lets a session continue in another process or on another node
+(worker rebalancing, deploys) with its rep counters, rep sequence, feedback
+flags and inactivity timers intact.
+
+Layout (little endian, 88 bytes):
+
+    magic b'SQST', version u8, state_seq u8, prev_state u8, curr_state u8,
+    flags u8 (DISPLAY_TEXT bits 0-4, LOWER_HIPS bit 5, INCORRECT_POSTURE bit 6),
+    feedback slots u8, padding 2 bytes, SQUAT_COUNT u32, IMPROPER_SQUAT u32,
+    COUNT_FRAMES 5 x u32 (unused slots 0),
+    INACTIVE_TIME f64, INACTIVE_TIME_FRONT f64,
+    inactive timer ages f64 x 2 (seconds since start_inactive_time[_front]),
+    wall clock of the snapshot f64, SQUAT_TOTAL u32, IMPROPER_TOTAL u32
+
+Version 1 snapshots (80 bytes, without the totals) are still restored; the
+totals then start from the counters.
+
+The inactivity timers are perf_counter() values, which mean nothing in
+another process, so they are stored as ages and rebased onto the restoring
+process's clock.
+"""
+import time
+import struct
+
+import numpy as np
+
+from state_machine import STATE_NAMES, SEQUENCES
+
+
+MAGIC = b'SQST'
+VERSION = 2
+
+LAYOUT = struct.Struct('<4sBBBBBB2xII5IdddddII')
+LAYOUT_V1 = struct.Struct('<4sBBBBBB2xII5Iddddd')
+
+# DISPLAY_TEXT/COUNT_FRAMES have 4 entries, 5 after a frame without a person
+# (see ProcessFrame.analyze); the length is kept so restores are exact.
+MAX_FEEDBACK_SLOTS = 5
+
+_LOWER_HIPS = 1 << 5
+_INCORRECT_POSTURE = 1 << 6
+
+
+class SnapshotError(ValueError):
+    """Data that is not a snapshot of a supported version."""
+
+
+
+def snapshot_state(state_tracker, now=None, wall_time=None):
+    """
+    Serialize a ProcessFrame.state_tracker.
+
+    Args:
+        state_tracker: The tracker dict to serialize.
+        now: perf_counter() reading the timer ages are taken against, default: now.
+        wall_time: time.time() reading stored with the snapshot, default: now.
+
+    Returns:
+        The snapshot as bytes.
+    """
+
+    now = time.perf_counter() if now is None else now
+    wall_time = time.time() if wall_time is None else wall_time
+
+    display_text = state_tracker['DISPLAY_TEXT']
+    count_frames = np.zeros(MAX_FEEDBACK_SLOTS, dtype=np.int64)
+    count_frames[:len(state_tracker['COUNT_FRAMES'])] = state_tracker['COUNT_FRAMES']
+
+    flags = int(np.packbits(display_text.astype(np.uint8), bitorder='little')[0])
+    if state_tracker['LOWER_HIPS']:
+        flags |= _LOWER_HIPS
+    if state_tracker['INCORRECT_POSTURE']:
+        flags |= _INCORRECT_POSTURE
+
+    return LAYOUT.pack(MAGIC, VERSION,
+                       state_tracker['state_seq'],
+                       STATE_NAMES.index(state_tracker['prev_state']),
+                       STATE_NAMES.index(state_tracker['curr_state']),
+                       flags,
+                       len(display_text),
+                       state_tracker['SQUAT_COUNT'],
+                       state_tracker['IMPROPER_SQUAT'],
+                       *(int(count) for count in count_frames),
+                       state_tracker['INACTIVE_TIME'],
+                       state_tracker['INACTIVE_TIME_FRONT'],
+                       now - state_tracker['start_inactive_time'],
+                       now - state_tracker['start_inactive_time_front'],
+                       wall_time,
+                       state_tracker['SQUAT_TOTAL'],
+                       state_tracker['IMPROPER_TOTAL'])
+
+
+
+def restore_state(state_tracker, data, count_transit=True, now=None, wall_time=None):
+    """
+    Overwrite a ProcessFrame.state_tracker in place from a snapshot.
+
+    Args:
+        state_tracker: The tracker dict to restore into.
+        data: Bytes returned by snapshot_state().
+        count_transit: Whether time between snapshot and restore counts as
+            inactivity (as if the session had kept running). Uses the wall
+            clocks of both hosts; negative transit times (clock skew) count as 0.
+        now: perf_counter() reading the timers are rebased onto, default: now.
+        wall_time: time.time() reading of the restore, default: now.
+
+    Returns:
+        The wall clock time the snapshot was taken.
+    """
+
+    if len(data) < 5 or bytes(data[:4]) != MAGIC:
+        raise SnapshotError('not a ProcessFrame state snapshot')
+
+    layout = {VERSION: LAYOUT, 1: LAYOUT_V1}.get(data[4])
+    if layout is None:
+        raise SnapshotError(f'unsupported snapshot version {data[4]}, expected {VERSION}')
+    if len(data) != layout.size:
+        raise SnapshotError('not a ProcessFrame state snapshot')
+
+    fields = layout.unpack(data)
+    _, _, state_seq, prev_state, curr_state, flags, slots, squat_count, improper_squat = fields[:9]
+    count_frames = fields[9:14]
+    inactive, inactive_front, age, age_front, taken = fields[14:19]
+    squat_total, improper_total = fields[19:] or (squat_count, improper_squat)
+
+    if state_seq >= len(SEQUENCES) or prev_state >= len(STATE_NAMES) or curr_state >= len(STATE_NAMES) \
+            or slots > MAX_FEEDBACK_SLOTS:
+        raise SnapshotError('snapshot holds an unknown state')
+
+    now = time.perf_counter() if now is None else now
+    wall_time = time.time() if wall_time is None else wall_time
+    transit = max(wall_time - taken, 0.0) if count_transit else 0.0
+
+    state_tracker['state_seq'] = state_seq
+    state_tracker['prev_state'] = STATE_NAMES[prev_state]
+    state_tracker['curr_state'] = STATE_NAMES[curr_state]
+    state_tracker['DISPLAY_TEXT'] = np.unpackbits(np.array([flags], dtype=np.uint8), count=slots,
+                                                  bitorder='little').astype(bool)
+    state_tracker['LOWER_HIPS'] = bool(flags & _LOWER_HIPS)
+    state_tracker['INCORRECT_POSTURE'] = bool(flags & _INCORRECT_POSTURE)
+    state_tracker['SQUAT_COUNT'] = squat_count
+    state_tracker['IMPROPER_SQUAT'] = improper_squat
+    state_tracker['SQUAT_TOTAL'] = squat_total
+    state_tracker['IMPROPER_TOTAL'] = improper_total
+    state_tracker['COUNT_FRAMES'] = np.array(count_frames[:slots], dtype=np.int64)
+    state_tracker['INACTIVE_TIME'] = inactive
+    state_tracker['INACTIVE_TIME_FRONT'] = inactive_front
+    state_tracker['start_inactive_time'] = now - age - transit
+    state_tracker['start_inactive_time_front'] = now - age_front - transit
+
+    return taken
@@ -4,6 +4,7 @@ echo "
 headless=true\n
 enableCORS=false\n
 enableXsrfProtection=false\n
+enableStaticServing=true\n
 port=8080\n
 \n
 " > ~/.streamlit/config.toml
\ No newline at end of file
@@ -0,0 +1,174 @@
+import numpy as np
+
+
+# Knee states, encoded as small integers. STATE_NAMES maps them back to the
+# labels shown on the frame.
+STATE_NONE = 0
+STATE_S1 = 1
+STATE_S2 = 2
+STATE_S3 = 3
+
+STATE_NAMES = (None, 's1', 's2', 's3')
+
+
+# The rep sequence can only ever be one of these four lists, so it is kept as
+# an index into SEQUENCES instead of a Python list.
+SEQ_EMPTY = 0
+SEQ_S2 = 1
+SEQ_S2_S3 = 2
+SEQ_S2_S3_S2 = 3
+
+SEQUENCES = ((), ('s2',), ('s2', 's3'), ('s2', 's3', 's2'))
+
+# Properties of each sequence used by the feedback logic.
+SEQ_HAS_S3 = (False, False, True, True)      # 's3' in state_seq
+SEQ_SINGLE_S2 = (False, True, True, False)   # state_seq.count('s2') == 1
+
+
+# SEQ_TRANSITIONS[seq, state] -> next seq.
+SEQ_TRANSITIONS = np.array([
+                            # none  s1  s2  s3
+                            [0,     0,  1,  0],   # []
+                            [1,     1,  1,  2],   # [s2]
+                            [2,     2,  3,  2],   # [s2, s3]
+                            [3,     3,  3,  3],   # [s2, s3, s2]
+                           ], dtype=np.int8)
+
+
+# Outcome of returning to s1, REP_OUTCOMES[seq, incorrect_posture].
+REP_NONE = 0
+REP_CORRECT = 1
+REP_IMPROPER = 2
+
+REP_OUTCOMES = np.array([
+                         [REP_NONE,     REP_IMPROPER],   # []
+                         [REP_IMPROPER, REP_IMPROPER],   # [s2]
+                         [REP_NONE,     REP_IMPROPER],   # [s2, s3]
+                         [REP_CORRECT,  REP_IMPROPER],   # [s2, s3, s2]
+                        ], dtype=np.int8)
+
+
+
+def compile_state_lut(hip_knee_vert, max_angle=180):
+    """
+    Compile the HIP_KNEE_VERT ranges into a lookup table from integer knee angle to state.
+
+    Ranges are checked in the same order as the original if/elif chain
+    (NORMAL, TRANS, PASS), so overlapping ranges resolve identically.
+    """
+
+    lut = np.full((max_angle + 1,), STATE_NONE, dtype=np.int8)
+
+    for angle in range(max_angle + 1):
+        if hip_knee_vert['NORMAL'][0] <= angle <= hip_knee_vert['NORMAL'][1]:
+            lut[angle] = STATE_S1
+        elif hip_knee_vert['TRANS'][0] <= angle <= hip_knee_vert['TRANS'][1]:
+            lut[angle] = STATE_S2
+        elif hip_knee_vert['PASS'][0] <= angle <= hip_knee_vert['PASS'][1]:
+            lut[angle] = STATE_S3
+
+    return lut
+
+
+
+class SquatStateMachine:
+    """
+    Integer-encoded squat rep state machine compiled from a thresholds dict.
+
+    The same tables drive the per-frame path in ProcessFrame and the batch
+    replay below.
+    """
+
+    def __init__(self, thresholds):
+        self.state_lut = compile_state_lut(thresholds['HIP_KNEE_VERT'])
+        self._lut_list = self.state_lut.tolist()
+        self._transitions = SEQ_TRANSITIONS.tolist()
+        self._outcomes = REP_OUTCOMES.tolist()
+
+
+    def get_state(self, knee_angle):
+        if 0 <= knee_angle < len(self._lut_list):
+            return self._lut_list[knee_angle]
+
+        return STATE_NONE
+
+
+    def next_sequence(self, seq, state):
+        return self._transitions[seq][state]
+
+
+    def rep_outcome(self, seq, incorrect_posture):
+        return self._outcomes[seq][1 if incorrect_posture else 0]
+
+
+    def replay(self, knee_angles, incorrect_posture=None):
+        """
+        Replay a recorded sequence of knee vertical angles and count reps.
+
+        Args:
+            knee_angles: Array of knee vertical angles, NaN where no pose was detected
+            incorrect_posture: Optional boolean array, True where a posture error was flagged on that frame
+
+        Returns:
+            Dictionary with per-frame 'states', 'sequences' and 'outcomes' arrays,
+            plus the 'SQUAT_COUNT' and 'IMPROPER_SQUAT' totals.
+
+        Inactivity resets depend on wall-clock time and are not replayed.
+        """
+
+        knee_angles = np.asarray(knee_angles, dtype=np.float64)
+        num_frames = len(knee_angles)
+
+        detected = ~np.isnan(knee_angles)
+        angle_idx = np.zeros((num_frames,), dtype=np.int64)
+        angle_idx[detected] = knee_angles[detected].astype(np.int64)
+
+        in_range = detected & (angle_idx >= 0) & (angle_idx < len(self.state_lut))
+        states = np.full((num_frames,), STATE_NONE, dtype=np.int8)
+        states[in_range] = self.state_lut[angle_idx[in_range]]
+
+        if incorrect_posture is None:
+            incorrect_posture = np.zeros((num_frames,), dtype=bool)
+
+        sequences = np.zeros((num_frames,), dtype=np.int8)
+        outcomes = np.zeros((num_frames,), dtype=np.int8)
+
+        seq = SEQ_EMPTY
+        incorrect = False
+        correct_count = 0
+        improper_count = 0
+
+        for t, (state, present, flagged) in enumerate(zip(states.tolist(), detected.tolist(),
+                                                          np.asarray(incorrect_posture, dtype=bool).tolist())):
+            if not present:
+                # ProcessFrame clears the posture flag while nobody is in view.
+                incorrect = False
+                sequences[t] = seq
+                continue
+
+            seq = self._transitions[seq][state]
+
+            if state == STATE_S1:
+                outcome = self._outcomes[seq][1 if incorrect else 0]
+                outcomes[t] = outcome
+
+                if outcome == REP_CORRECT:
+                    correct_count += 1
+                elif outcome == REP_IMPROPER:
+                    improper_count += 1
+
+                seq = SEQ_EMPTY
+                incorrect = False
+
+            elif flagged:
+                incorrect = True
+
+            sequences[t] = seq
+
+        return {
+            'states': states,
+            'sequences': sequences,
+            'outcomes': outcomes,
+            'SQUAT_COUNT': correct_count,
+            'IMPROPER_SQUAT': improper_count
+        }
@@ -0,0 +1,329 @@
+"""
+Procedural squat sequences for offline benchmarking and MPJPE accuracy runs.
+
+A parametric 3D skeleton is animated through squat reps, viewed from a
+configurable camera yaw and projected into normalized mediapipe-style
+landmarks (T, 33, 4). The same landmarks are the ground truth of the
+rendered stick-figure / silhouette video, and can be replayed through
+pose_backends.ReplayPose.
+
+    python synthetic_squat.py --output squat_4k.mp4 --landmarks squat_4k.npy --width 3840 --height 2160 --fps 60
+    python synthetic_squat.py --seconds 3600 --reps 600 --offset-angle 20 --output long.mp4
+    python synthetic_squat.py --frames 600 --no-video --landmarks squat.npy
+"""
+import math
+import argparse
+
+import cv2
+import numpy as np
+
+
+NUM_LANDMARKS = 33
+
+# Segment lengths as a fraction of standing height.
+SHIN = 0.25
+THIGH = 0.245
+TORSO = 0.30
+UPPER_ARM = 0.17
+FOREARM = 0.15
+FOOT = 0.13
+ANKLE_HEIGHT = 0.045
+
+# Weak perspective: the side nearer to the camera is drawn slightly larger, so
+# ProcessFrame picks it as the visible side like it would on real footage.
+PERSPECTIVE = 0.5
+
+# Lateral offset of each left-side joint from the body midline; the right side mirrors it.
+_LATERAL = {
+    'eye': 0.03, 'ear': 0.07, 'mouth': 0.02, 'shoulder': 0.11, 'elbow': 0.12, 'wrist': 0.12, 'hand': 0.12,
+    'hip': 0.08, 'knee': 0.07, 'ankle': 0.07, 'heel': 0.07, 'foot': 0.08
+}
+
+_SKELETON = ((11, 13), (13, 15), (12, 14), (14, 16), (11, 12), (11, 23), (12, 24), (23, 24),
+             (23, 25), (25, 27), (27, 29), (29, 31), (27, 31), (24, 26), (26, 28), (28, 30), (30, 32), (28, 32))
+
+# Grey level, so clearing a frame is a single ndarray.fill (broadcasting a BGR
+# tuple over a 4K frame costs more than all the drawing).
+BACKGROUND = 40
+NEAR_COLOR = (230, 230, 230)
+FAR_COLOR = (150, 150, 150)
+
+
+def rep_phase(num_frames, fps=30.0, reps=None, rep_period=2.0, rest=0.0):
+    """
+    Squat depth phase per frame in [0, 1]: 0 standing, 1 at the bottom of the rep.
+
+    Reps last rep_period seconds followed by rest seconds standing; with reps
+    given, the figure stands still after the last one.
+
+    Returns:
+        (phase, rep_index) arrays of length num_frames, rep_index -1 while resting.
+    """
+
+    t = np.arange(num_frames, dtype=np.float64) / fps
+    cycle = rep_period + rest
+
+    rep_index = np.floor(t / cycle).astype(np.int64)
+    within = t - rep_index * cycle
+
+    active = within < rep_period
+    if reps is not None:
+        active &= rep_index < reps
+
+    phase = np.where(active, 0.5 - 0.5 * np.cos(2 * np.pi * within / rep_period), 0.0)
+
+    return phase, np.where(active, rep_index, -1)
+
+
+
+def _sagittal_pose(phase, depth, knee_travel, torso_lean):
+    """Joint positions (forward, up) in units of standing height, each an array over frames."""
+
+    rad = np.radians
+
+    thigh = rad(3.0 + (90.0 * depth - 3.0) * phase)
+    shin = rad(2.0 + (knee_travel - 2.0) * phase)
+    lean = rad(8.0 + (torso_lean - 8.0) * phase)
+    arm = rad(20.0 + 65.0 * phase)
+
+    zeros = np.zeros_like(phase)
+
+    ankle = (zeros, zeros + ANKLE_HEIGHT)
+    knee = (ankle[0] + SHIN * np.sin(shin), ankle[1] + SHIN * np.cos(shin))
+    hip = (knee[0] - THIGH * np.sin(thigh), knee[1] + THIGH * np.cos(thigh))
+    shoulder = (hip[0] + TORSO * np.sin(lean), hip[1] + TORSO * np.cos(lean))
+    nose = (shoulder[0] + 0.12 * np.sin(lean) + 0.05, shoulder[1] + 0.12 * np.cos(lean))
+    elbow = (shoulder[0] + UPPER_ARM * np.sin(arm), shoulder[1] - UPPER_ARM * np.cos(arm))
+    wrist = (elbow[0] + FOREARM * np.sin(arm + 0.2), elbow[1] - FOREARM * np.cos(arm + 0.2))
+
+    def offset(point, df, du):
+        return point[0] + df, point[1] + du
+
+    return {
+        'nose': nose,
+        'eye': offset(nose, -0.015, 0.02),
+        'ear': offset(nose, -0.07, 0.01),
+        'mouth': offset(nose, -0.005, -0.025),
+        'shoulder': shoulder,
+        'elbow': elbow,
+        'wrist': wrist,
+        'hand': offset(wrist, 0.03, -0.01),
+        'hip': hip,
+        'knee': knee,
+        'ankle': ankle,
+        'heel': offset(ankle, -0.04, -0.035),
+        'foot': offset(ankle, FOOT, -0.035)
+    }
+
+
+
+def _landmark_layout():
+    """(joint name, lateral sign) of each of the 33 landmarks, +1 for the left side."""
+
+    layout = [('nose', 0)]
+    layout += [('eye', 1)] * 3 + [('eye', -1)] * 3
+    layout += [('ear', 1), ('ear', -1), ('mouth', 1), ('mouth', -1)]
+
+    for name in ('shoulder', 'elbow', 'wrist', 'hand', 'hand', 'hand', 'hip', 'knee', 'ankle', 'heel', 'foot'):
+        layout += [(name, 1), (name, -1)]
+
+    return layout
+
+
+
+def squat_sequence(num_frames, fps=30.0, reps=None, rep_period=2.0, rest=0.0, depth=1.0, knee_travel=25.0,
+                   torso_lean=40.0, offset_angle=0.0, variation=0.0, aspect=4 / 3, scale=0.7, seed=0):
+    """
+    Ground-truth landmarks of a synthetic squat set.
+
+    Args:
+        num_frames: Sequence length.
+        fps: Frame rate the rep timing is expressed in.
+        reps: Number of reps, None to keep squatting for the whole sequence.
+        rep_period: Seconds per rep, down and up.
+        rest: Seconds standing between reps.
+        depth: Squat depth, 1.0 brings the thigh to horizontal (90 deg from vertical).
+        knee_travel: Forward shin lean at the bottom, degrees from vertical.
+        torso_lean: Forward torso lean at the bottom, degrees from vertical.
+        offset_angle: Camera yaw away from a pure side view, degrees (90 = frontal).
+        variation: Relative random depth variation per rep, e.g. 0.2 for +-20%.
+        aspect: Frame width / height the normalized coordinates are meant for.
+        scale: Standing height as a fraction of the frame height.
+        seed: Seed of the per-rep depth variation.
+
+    Returns:
+        (num_frames, 33, 4) float32 array of normalized x, y, z, visibility,
+        facing right with the left side towards the camera.
+    """
+
+    phase, rep_index = rep_phase(num_frames, fps, reps, rep_period, rest)
+
+    rng = np.random.default_rng(seed)
+    num_reps = int(rep_index.max()) + 1 if num_frames else 0
+    rep_depth = depth * (1.0 + rng.uniform(-variation, variation, max(num_reps, 1)))
+    frame_depth = np.clip(np.where(rep_index >= 0, rep_depth[np.maximum(rep_index, 0)], depth), 0.0, 1.2)
+
+    joints = _sagittal_pose(phase, frame_depth, knee_travel, torso_lean)
+
+    yaw = math.radians(offset_angle)
+    cos_yaw, sin_yaw = math.cos(yaw), math.sin(yaw)
+
+    landmarks = np.empty((num_frames, NUM_LANDMARKS, 4), dtype=np.float32)
+
+    for idx, (name, side) in enumerate(_landmark_layout()):
+        forward, up = joints[name]
+        lateral = side * _LATERAL.get(name, 0.0)
+
+        # Rotate the body about the vertical axis, then project with weak perspective
+        # around mid-height so the near side appears slightly larger.
+        x = forward * cos_yaw + lateral * sin_yaw
+        towards_camera = lateral * cos_yaw - forward * sin_yaw
+        persp = 1.0 / (1.0 - PERSPECTIVE * towards_camera)
+
+        landmarks[:, idx, 0] = 0.5 + x * persp * scale / aspect
+        landmarks[:, idx, 1] = 0.95 - scale * 0.5 - (up - 0.5) * persp * scale
+        landmarks[:, idx, 2] = -towards_camera * scale
+        landmarks[:, idx, 3] = 1.0 if side >= 0 else 0.8
+
+    return landmarks
+
+
+
+def add_detection_noise(landmarks, jitter=0.003, dropout=0.0, seed=0):
+    """Simulate a pose estimator: Gaussian jitter on x, y and whole frames without detection (NaN)."""
+
+    rng = np.random.default_rng(seed)
+    noisy = landmarks.copy()
+
+    noisy[..., :2] += rng.normal(0.0, jitter, noisy[..., :2].shape).astype(np.float32)
+
+    if dropout > 0:
+        noisy[rng.random(len(noisy)) < dropout] = np.nan
+
+    return noisy
+
+
+
+def render_frame(landmarks, width, height, style='stick', out=None):
+    """
+    Draw one frame of landmarks as a BGR image.
+
+    Args:
+        landmarks: (33, 4) normalized landmarks.
+        width, height: Output size in pixels.
+        style: 'stick' for a thin skeleton, 'silhouette' for a filled body shape.
+        out: Optional (height, width, 3) uint8 buffer to draw into.
+
+    Returns:
+        The rendered frame (out when given).
+    """
+
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+
+    out.fill(BACKGROUND)
+
+    if np.isnan(landmarks).any():
+        return out
+
+    points = np.rint(landmarks[:, :2] * (width, height)).astype(np.int32)
+    unit = height / 100.0
+
+    limb = max(1, int(unit * (5.0 if style == 'silhouette' else 0.6)))
+    joint = max(2, int(unit * (2.5 if style == 'silhouette' else 1.0)))
+    head = max(3, int(unit * 4.5))
+
+    # Far (right) side first so the near side is drawn on top.
+    for color, side in ((FAR_COLOR, 0), (NEAR_COLOR, 1)):
+        for a, b in _SKELETON:
+            if a % 2 != side and b % 2 != side:
+                continue
+            cv2.line(out, tuple(points[a]), tuple(points[b]), color, limb, cv2.LINE_AA)
+
+        for idx in range(11, NUM_LANDMARKS):
+            if idx % 2 == side:
+                cv2.circle(out, tuple(points[idx]), joint, color, -1, cv2.LINE_AA)
+
+    if style == 'silhouette':
+        torso = points[[11, 12, 24, 23]]
+        cv2.fillConvexPoly(out, cv2.convexHull(torso), NEAR_COLOR, cv2.LINE_AA)
+
+    cv2.circle(out, tuple(points[0]), head, NEAR_COLOR, -1 if style == 'silhouette' else max(1, limb), cv2.LINE_AA)
+
+    return out
+
+
+
+def iter_frames(landmarks, width, height, style='stick'):
+    """
+    Yield rendered BGR frames one at a time.
+
+    The same buffer is reused for every frame, so each yielded frame is only
+    valid until the next iteration; copy it to keep it.
+    """
+
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+    for frame_landmarks in landmarks:
+        yield render_frame(frame_landmarks, width, height, style, out=buffer)
+
+
+
+def write_video(path, landmarks, width, height, fps, style='stick', fourcc='mp4v'):
+    """Render landmarks to a video file; returns the number of frames written."""
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f'Could not open video writer for {path}')
+
+    count = 0
+    try:
+        for frame in iter_frames(landmarks, width, height, style):
+            writer.write(frame)
+            count += 1
+    finally:
+        writer.release()
+
+    return count
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='synthetic_squat.mp4', help='Video to write')
+    parser.add_argument('--landmarks', help='Also save the ground-truth (T, 33, 4) landmarks as .npy')
+    parser.add_argument('--no-video', action='store_true', help='Only generate the landmarks')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--frames', type=int, help='Length in frames, overrides --seconds')
+    parser.add_argument('--reps', type=int, help='Number of reps, default: squat for the whole length')
+    parser.add_argument('--rep-period', type=float, default=2.0, help='Seconds per rep')
+    parser.add_argument('--rest', type=float, default=0.5, help='Seconds standing between reps')
+    parser.add_argument('--depth', type=float, default=1.0, help='1.0 = thighs horizontal')
+    parser.add_argument('--knee-travel', type=float, default=25.0, help='Shin lean at the bottom, degrees')
+    parser.add_argument('--torso-lean', type=float, default=40.0, help='Torso lean at the bottom, degrees')
+    parser.add_argument('--offset-angle', type=float, default=0.0, help='Camera yaw from side view, degrees')
+    parser.add_argument('--variation', type=float, default=0.0, help='Relative per-rep depth variation')
+    parser.add_argument('--style', choices=['stick', 'silhouette'], default='silhouette')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    num_frames = args.frames if args.frames is not None else int(round(args.seconds * args.fps))
+
+    landmarks = squat_sequence(num_frames, fps=args.fps, reps=args.reps, rep_period=args.rep_period, rest=args.rest,
+                               depth=args.depth, knee_travel=args.knee_travel, torso_lean=args.torso_lean,
+                               offset_angle=args.offset_angle, variation=args.variation,
+                               aspect=args.width / args.height, seed=args.seed)
+
+    if args.landmarks:
+        np.save(args.landmarks, landmarks)
+
+    if not args.no_video:
+        count = write_video(args.output, landmarks, args.width, args.height, args.fps, style=args.style)
+        print(f'{args.output}: {count} frames, {args.width}x{args.height} @ {args.fps:g} fps')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import sys
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+
+# Threads each pose worker may use across OpenCV, BLAS/OpenMP and TFLite;
+# default: the available CPUs split evenly between workers.
+THREADS_PER_WORKER_ENV = 'SQUAT_THREADS_PER_WORKER'
+# Pin every worker to its own CPU subset (Linux only).
+PIN_CPUS_ENV = 'SQUAT_PIN_CPUS'
+# CPUs kept free of workers for the Streamlit server and WebRTC threads.
+RESERVED_CPUS_ENV = 'SQUAT_RESERVED_CPUS'
+
+# Read by OpenMP, OpenBLAS, MKL, numexpr, Accelerate and TensorFlow when they
+# start their thread pools, so they must be in the environment before import.
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'TF_NUM_INTRAOP_THREADS',
+    'TF_NUM_INTEROP_THREADS',
+)
+
+
+def available_cpus():
+    """CPUs this process may run on (the container's cpuset where supported)."""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+
+def plan_budgets(num_workers, threads_per_worker=None, pin_cpus=None, reserved_cpus=None):
+    """
+    Split the available CPUs between pose workers.
+
+    Args:
+        num_workers: Number of worker processes.
+        threads_per_worker: Threads per worker, default from SQUAT_THREADS_PER_WORKER
+            or the usable CPUs divided by the worker count.
+        pin_cpus: Give every worker a disjoint CPU set, default from SQUAT_PIN_CPUS.
+        reserved_cpus: CPUs left to the parent process, default from SQUAT_RESERVED_CPUS.
+
+    Returns:
+        One budget dict per worker: {'threads': int, 'cpus': list or None}.
+    """
+
+    cpus = available_cpus()
+
+    if reserved_cpus is None:
+        reserved_cpus = int(os.environ.get(RESERVED_CPUS_ENV, 0))
+    usable = cpus[reserved_cpus:] if reserved_cpus < len(cpus) else cpus[-1:]
+
+    if threads_per_worker is None:
+        threads_per_worker = int(os.environ.get(THREADS_PER_WORKER_ENV, 0)) or max(1, len(usable) // num_workers)
+
+    if pin_cpus is None:
+        pin_cpus = os.environ.get(PIN_CPUS_ENV, '0').lower() in ('1', 'true', 'yes')
+
+    budgets = []
+    for idx in range(num_workers):
+        worker_cpus = None
+        if pin_cpus:
+            # Consecutive blocks, wrapping around when workers x threads exceeds the CPUs.
+            start = idx * threads_per_worker
+            worker_cpus = sorted({usable[(start + k) % len(usable)] for k in range(threads_per_worker)})
+        budgets.append({'threads': threads_per_worker, 'cpus': worker_cpus})
+
+    return budgets
+
+
+
+def thread_env(threads):
+    """Environment variables limiting library thread pools to `threads`."""
+
+    return {name: str(threads) for name in THREAD_ENV_VARS}
+
+
+
+def apply_thread_budget(threads, cpus=None):
+    """
+    Limit the current process to a thread budget and report the effective settings.
+
+    Sets the thread environment variables (for libraries loaded later),
+    cv2.setNumThreads, already-loaded BLAS/OpenMP pools through threadpoolctl
+    when it is installed, and the CPU affinity. mediapipe's TFLite pools have
+    no runtime knob; the affinity mask is what bounds them.
+    """
+
+    os.environ.update(thread_env(threads))
+
+    import cv2
+    cv2.setNumThreads(threads)
+
+    if threadpoolctl is not None:
+        threadpoolctl.threadpool_limits(threads)
+
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    return thread_report()
+
+
+
+def thread_report():
+    """Effective thread settings of the current process."""
+
+    import cv2
+
+    report = {
+        'pid': os.getpid(),
+        'opencv_threads': cv2.getNumThreads(),
+        'cpus': available_cpus(),
+        'env': {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    }
+
+    if threadpoolctl is not None:
+        report['threadpools'] = [{'api': pool['internal_api'], 'threads': pool['num_threads']}
+                                 for pool in threadpoolctl.threadpool_info()]
+
+    return report
+
+
+
+def format_report(report, label='process'):
+    cpus = report['cpus']
+    cpu_text = f'{cpus[0]}-{cpus[-1]}' if cpus == list(range(cpus[0], cpus[-1] + 1)) else ','.join(map(str, cpus))
+    pools = ', '.join(f"{pool['api']}={pool['threads']}" for pool in report.get('threadpools', []))
+
+    return (f"{label} pid={report['pid']} opencv_threads={report['opencv_threads']} "
+            f"omp={report['env']['OMP_NUM_THREADS']} cpus={cpu_text}" + (f' {pools}' if pools else ''))
+
+
+
+def print_report(report, label='process'):
+    print(format_report(report, label), file=sys.stderr, flush=True)
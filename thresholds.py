@@ -56,4 +56,9 @@ def get_thresholds_pro():
                     'VISUALIZE_MPJPE_COMPARISON': False
                  }
                  
-    return thresholds
\ No newline at end of file
+    return thresholds
+
+
+
+# Thresholds per analysis mode, by name.
+MODES = {'beginner': get_thresholds_beginner, 'pro': get_thresholds_pro}
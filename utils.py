@@ -1,7 +1,23 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
 import cv2
 import mediapipe as mp
 import numpy as np
 
+
+# Uploads are spooled into a dedicated directory so stale files can be swept.
+UPLOAD_TEMP_DIR = os.path.join(tempfile.gettempdir(), 'squat_vision_uploads')
+UPLOAD_CHUNK_SIZE = 1 << 20          # 1 MiB
+UPLOAD_DIR_MAX_BYTES = 2 * (1 << 30)  # 2 GiB
+UPLOAD_MAX_AGE = 3600.0              # seconds
+
+# Spooled uploads not removed yet (still processed or played), never swept.
+_uploads_in_use = set()
+_uploads_lock = threading.Lock()
+
 def draw_rounded_rect(img, rect_start, rect_end, corner_width, box_color):
 
     x1, y1 = rect_start
@@ -91,6 +107,142 @@ def find_angle(p1, p2, ref_pt = np.array([0,0])):
     return int(degree)
 
 
+def encode_preview(frame, max_width=480, jpeg_quality=80):
+    """Downscale an RGB frame and JPEG-encode it for a lightweight UI preview."""
+
+    height, width = frame.shape[:2]
+
+    if width > max_width:
+        scale = max_width / width
+        frame = cv2.resize(frame, (max_width, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    # cv2 encodes from BGR, the pipeline works in RGB.
+    ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                              [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)])
+
+    return buffer.tobytes() if ok else None
+
+
+def _entry_stats(path):
+    """Size and newest modification time of a file, or of everything under a directory."""
+
+    stat = os.stat(path)
+    if not os.path.isdir(path):
+        return stat.st_size, stat.st_mtime
+
+    size, modified = 0, stat.st_mtime
+
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            modified = max(modified, stat.st_mtime)
+
+    return size, modified
+
+
+def sweep_dir(root, max_bytes, max_age, in_use=()):
+    """
+    Remove the entries (files or directories) of root not written to for max_age,
+    then the oldest ones until the rest is under max_bytes.
+
+    Paths in in_use are still being written or read and are never removed.
+    """
+
+    if not os.path.isdir(root):
+        return
+
+    now = time.time()
+    entries = []
+
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if path in in_use:
+            continue
+        try:
+            size, modified = _entry_stats(path)
+        except OSError:
+            continue
+
+        if now - modified > max_age:
+            _remove_entry(path)
+        else:
+            entries.append((modified, size, path))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_entry(path)
+        total -= size
+
+
+def _remove_entry(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        remove_upload(path)
+
+
+def cleanup_upload_dir(max_bytes=UPLOAD_DIR_MAX_BYTES, max_age=UPLOAD_MAX_AGE):
+    """
+    Remove spooled uploads older than max_age, then oldest first until under max_bytes.
+
+    Uploads of this process not passed to remove_upload() yet are still
+    processed or played and are skipped, so one session never deletes another's.
+    """
+
+    with _uploads_lock:
+        in_use = set(_uploads_in_use)
+
+    sweep_dir(UPLOAD_TEMP_DIR, max_bytes, max_age, in_use)
+
+
+def spool_upload(file_obj, suffix='', chunk_size=UPLOAD_CHUNK_SIZE):
+    """Copy an uploaded file object to disk in fixed-size chunks and return the path."""
+
+    os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+    cleanup_upload_dir()
+
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TEMP_DIR, suffix=suffix, delete=False) as tfile:
+        with _uploads_lock:
+            _uploads_in_use.add(tfile.name)
+        try:
+            while True:
+                chunk = file_obj.read(chunk_size)
+                if not chunk:
+                    break
+                tfile.write(chunk)
+        except BaseException:
+            tfile.close()
+            remove_upload(tfile.name)
+            raise
+
+    return tfile.name
+
+
+def remove_upload(path):
+    """Delete a spooled upload once it is no longer needed (also when it was moved away)."""
+
+    if path is None:
+        return
+
+    with _uploads_lock:
+        _uploads_in_use.discard(path)
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 def get_landmark_array(pose_landmark, key, frame_width, frame_height):
 
     denorm_x = int(pose_landmark[key].x * frame_width)
@@ -99,6 +251,17 @@ def get_landmark_array(pose_landmark, key, frame_width, frame_height):
     return np.array([denorm_x, denorm_y])
 
 
+def get_landmark_coords(pose_landmark, frame_width, frame_height):
+    """Denormalize all pose landmarks into a single (N, 2) integer pixel array."""
+
+    num_landmarks = len(pose_landmark)
+    coords = np.fromiter((v for lm in pose_landmark for v in (lm.x * frame_width, lm.y * frame_height)),
+                         dtype=np.float64, count=2 * num_landmarks)
+
+    # astype truncates towards zero like int().
+    return coords.astype(np.int64).reshape(num_landmarks, 2)
+
+
 def get_landmark_features(kp_results, dict_features, feature, frame_width, frame_height):
 
     if feature == 'nose':
@@ -0,0 +1,52 @@
+import cv2
+
+
+def open_video(video_path):
+    """Open a video file and read the metadata the upload pipeline needs."""
+
+    vf = cv2.VideoCapture(video_path)
+
+    metadata = {
+        'fps': int(vf.get(cv2.CAP_PROP_FPS)),
+        'width': int(vf.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(vf.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'frame_count': int(vf.get(cv2.CAP_PROP_FRAME_COUNT))
+    }
+
+    return vf, metadata
+
+
+
+def iter_processed_frames(vf, process_frame, pose, metrics=None):
+    """
+    Decode, convert and process every frame of an opened capture.
+
+    Yields (out_frame, play_sound) per frame. Decoding and the BGR -> RGB
+    conversion reuse process_frame.buffer_pool, so out_frame is only valid
+    until the next iteration; copy it (or convert it) to keep it.
+
+    With metrics (a SessionMetrics), a frame counts as in flight from the
+    start of its processing until the caller asks for the next one.
+    """
+
+    buffer_pool = process_frame.buffer_pool
+
+    while vf.isOpened():
+        # Decode into the same buffer every frame.
+        ret, frame = vf.read(buffer_pool.buffers.get('decode'))
+        if not ret:
+            break
+        buffer_pool.adopt('decode', frame)
+
+        # convert frame from BGR to RGB before processing it.
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer_pool.get('rgb', frame.shape))
+
+        if metrics is None:
+            yield process_frame.process(frame, pose)
+            continue
+
+        metrics.frame_started()
+        try:
+            yield process_frame.process(frame, pose)
+        finally:
+            metrics.frame_finished()